@@ -1,6 +1,6 @@
-import pandas as pd
 import json
-from openpyxl import Workbook
+import os
+import threading
 import logging
 
 
@@ -11,79 +11,250 @@ import logging
         "External id", "Test Summary", "OrderId", "Step", "Test Data", 
         "Expected Result", "Assigned To", "Comments", "Description", "Component", 
         "jira-customfield-checkbox", "Epic Link", "Linked issues", "Labels", "Issue Key [To add steps]".
-    The Excel file should be saved as "Zephyr_Test_Cases_Output.xlsx".
+    The Excel file is saved as "Zephyr_Test_Cases_Output.xlsx" unless another output file is given,
+    e.g. one file per ticket when running in batch mode, or one workbook for the whole batch
+    (ZephyrWorkbookWriter).
 
     For simplicty, some dummy variabels have been hardcoded in the function. 
     These should be replaced with the actual values or fetched from the environment variables.
 
 
 """
-def generate_excel_from_json(json_file, epic_link):
+# Default name of the Excel file used as input for the Zephyr Squad Internal Import utility
+DEFAULT_OUTPUT_FILE = "Zephyr_Test_Cases_Output.xlsx"
+
+# Step rows per batch workbook before the writer rolls over to a new workbook
+MAX_ROWS_PER_WORKBOOK = 50000
+
+# Header row of every test case sheet
+HEADERS = (
+    "External id", "Test Summary", "OrderId", "Step", "Test Data",
+    "Expected Result", "Assigned To", "Comments", "Description", 
+    "Component", "jira-customfield-checkbox", "Epic Link", 
+    "Linked issues", "Labels", "Issue Key [To add steps]", 
+    "Issue Link Type", "Issues Key To Link", "Priority", "Sprint", 
+    "Version", "Cascade"
+)
+
+# Values the generated test cases are created with, shared by the Excel export and the
+# Zephyr API upload (exporters.py)
+ASSIGNED_TO = "6414a0cd67102fc717c034d7"
+COMMENTS = "This test case has been built by GenAI Workbench for XL import via Internal Importer."
+COMPONENT = "Core"
+LABELS = "GenAI_Test_Case"
+PRIORITY = "3 - Medium"
+
+# Columns with the same value on every row, grouped by their position around the per-step columns
+ASSIGNMENT_COLUMNS = (
+    ASSIGNED_TO,  # Assigned To
+    COMMENTS,  # Comments
+)
+COMPONENT_COLUMNS = (
+    COMPONENT,  # Component
+    "external",  # jira-customfield-checkbox
+)
+LINK_COLUMNS = (
+    "blocks",  # Linked issues
+    LABELS,  # Labels
+    "IM-5000",  # Issue Key [To add steps]
+    "blocks",  # Issue Link Type
+    "IM-3000",  # Issues Key To Link
+    PRIORITY,  # Priority
+    37,  # Sprint
+    "Release-1.0",  # Version
+    "Dublin"  # Cascade
+)
+
+
+def test_case_rows(external_id, test_case, epic_link):
+    """
+    Yield the Excel rows for the steps of one test case.
+    """
+    summary = test_case.get('summary', '')
+    preconditions = test_case.get('preconditions', '')
+    postconditions = test_case.get('postconditions', '')
+    description = f"{preconditions}\n{postconditions}"
+
+    for order_id, step in enumerate(test_case.get('steps', []), start=1):
+        yield (external_id, summary, order_id, step.get('step', ''),
+               '',  # Test Data (optional, leaving empty)
+               step.get('expectedResult', ''),
+               *ASSIGNMENT_COLUMNS, description, *COMPONENT_COLUMNS, epic_link, *LINK_COLUMNS)
+
+
+class ZephyrExcelBuilder:
+    """
+    Build the Zephyr import workbook one test case at a time, one sheet per test case.
+    Test cases can be added as soon as they are available, e.g. while the LLM response is still streaming.
+    By default the workbook is write-only: each row is written out to a temporary file as it is
+    appended and each sheet is finished as soon as its test case is complete, so only the shared
+    strings of the workbook stay in memory. The workbook can be saved once.
+    """
+    def __init__(self, epic_link, write_only=True):
+        # openpyxl is imported when the first workbook is built, not when the tool starts
+        from openpyxl import Workbook
+
+        self.epic_link = epic_link
+        self.wb = Workbook(write_only=write_only)
+        if not write_only:
+            self.wb.remove(self.wb.active)
+        self.sheet_count = 0
+        self.row_count = 0
+        self.id_counter = 1
+
+    def add_test_case(self, test_case, epic_link=None):
+        """
+        Add a test case on a new sheet. The EPIC link defaults to the builder's.
+        """
+        self.sheet_count += 1
+        ws = self.wb.create_sheet(title=f"Sheet{self.sheet_count}")
+        ws.append(HEADERS)
+        self.row_count += 1
+
+        for row in test_case_rows(self.id_counter, test_case, epic_link or self.epic_link):
+            ws.append(row)
+            self.row_count += 1
+
+        # Finish the sheet now rather than at save time, releasing its XML writer
+        if self.wb.write_only:
+            ws.close()
+        self.id_counter += 1
+
+    def save(self, output_file):
+        self.wb.save(output_file)
+        return output_file
+
+
+def build_workbook(output_file, tickets):
+    """
+    Build and save one Zephyr import workbook from the test cases of (epic_link, test_cases)
+    pairs, in order. Returns the name of the file. Runs in the post-processing processes
+    (procpool.py).
+    """
+    builder = ZephyrExcelBuilder(tickets[0][0] if tickets else None)
+    for epic_link, test_cases in tickets:
+        for test_case in test_cases:
+            builder.add_test_case(test_case, epic_link)
+    return builder.save(output_file)
+
+
+def ticket_order(jira_ticket):
+    """
+    Sort key of JIRA ticket keys: by project, then by issue number, e.g. FAKE-9 before FAKE-10.
+    """
+    project, _, number = jira_ticket.rpartition("-")
+    return (project, int(number), "") if number.isdigit() else (project, -1, jira_ticket)
+
+
+class ZephyrWorkbookWriter:
+    """
+    Stream the test cases of many tickets into one Zephyr import workbook for a whole batch run,
+    instead of one file per ticket. Tickets can be added from several threads as they finish.
+    Once a workbook holds max_rows rows it is saved and the next ticket starts a new workbook,
+    named <output_file stem>_part2.xlsx and so on, so each file stays a practical size to import.
+
+    With a pool of processes (procpool.py) the tickets are collected instead, and close() sorts
+    them by ticket key, splits them into workbooks by the same max_rows rule and builds the
+    workbooks in parallel, one per process. The workbooks are then the same whatever order the
+    tickets finished in, at the cost of keeping the test cases of the run in memory until then.
+    """
+    def __init__(self, output_file, max_rows=MAX_ROWS_PER_WORKBOOK, pool=None):
+        self.output_file = output_file
+        self.max_rows = max_rows
+        self.pool = pool
+        self.files = []
+        self._builder = None
+        self._tickets = []
+        self._lock = threading.Lock()
+
+    def _current_file(self):
+        return self._part_file(len(self.files))
+
+    def _part_file(self, index):
+        if index == 0:
+            return self.output_file
+        stem, ext = os.path.splitext(self.output_file)
+        return f"{stem}_part{index + 1}{ext}"
+
+    def add_ticket(self, jira_ticket, epic_link, test_cases):
+        """
+        Append the test cases of one ticket and return the name of the workbook they went into.
+        With a pool, return the name of the first workbook of the run: the workbook a ticket goes
+        into is only known when the run is closed.
+        """
+        if self.pool is not None:
+            with self._lock:
+                self._tickets.append((jira_ticket, epic_link, test_cases))
+            logging.info(f"Stage 5b - {len(test_cases)} test cases for {jira_ticket} queued for '{self.output_file}'")
+            return self.output_file
+        with self._lock:
+            if self._builder is not None and self._builder.row_count >= self.max_rows:
+                self._save()
+            if self._builder is None:
+                self._builder = ZephyrExcelBuilder(epic_link)
+            for test_case in test_cases:
+                self._builder.add_test_case(test_case, epic_link)
+            logging.info(f"Stage 5b - {len(test_cases)} test cases for {jira_ticket} added to '{self._current_file()}'")
+            return self._current_file()
+
+    def _save(self):
+        output_file = self._current_file()
+        self._builder.save(output_file)
+        self.files.append(output_file)
+        self._builder = None
+        logging.info(f"Stage 5b - Excel file '{output_file}' created successfully.")
+
+    def _build_parts(self):
+        """
+        Build the collected tickets into workbooks on the pool, in ticket order.
+        """
+        parts = []
+        rows = 0
+        for jira_ticket, epic_link, test_cases in sorted(self._tickets, key=lambda t: ticket_order(t[0])):
+            if not test_cases:
+                continue
+            if not parts or rows >= self.max_rows:
+                parts.append([])
+                rows = 0
+            parts[-1].append((epic_link, test_cases))
+            rows += sum(1 + len(test_case.get('steps', [])) for test_case in test_cases)
+        self._tickets = []
+        futures = [self.pool.submit(build_workbook, self._part_file(n), part) for n, part in enumerate(parts)]
+        for future in futures:
+            output_file = future.result()
+            self.files.append(output_file)
+            logging.info(f"Stage 5b - Excel file '{output_file}' created successfully.")
+
+    def close(self):
+        """
+        Save the last workbook and return the names of all workbooks written.
+        """
+        with self._lock:
+            if self.pool is not None and self._tickets:
+                self._build_parts()
+            if self._builder is not None and self._builder.sheet_count:
+                self._save()
+            self._builder = None
+            return list(self.files)
+
+
+def generate_excel_from_json(json_file, epic_link, output_file=DEFAULT_OUTPUT_FILE):
+    """
+    Build the Zephyr import Excel file from the JSON file of test cases.
+    Returns the name of the Excel file created, or None if it could not be built.
+    """
     try:
         with open(json_file, 'r') as file:
             data = json.load(file)
 
-        test_cases = data.get('testCases', [])
-        wb = Workbook()
-
-        id_counter = 1
-
-        for sheet_index, test_case in enumerate(test_cases, start=1):
-            # Create a new sheet for each test case
-            if sheet_index == 1:
-                ws = wb.active
-                ws.title = f"Sheet{sheet_index}"
-            else:
-                ws = wb.create_sheet(title=f"Sheet{sheet_index}")
-
-            # Set up headers
-            headers = [
-                "External id", "Test Summary", "OrderId", "Step", "Test Data",
-                "Expected Result", "Assigned To", "Comments", "Description", 
-                "Component", "jira-customfield-checkbox", "Epic Link", 
-                "Linked issues", "Labels", "Issue Key [To add steps]", 
-                "Issue Link Type", "Issues Key To Link", "Priority", "Sprint", 
-                "Version", "Cascade"
-            ]
-            ws.append(headers)
-
-            preconditions = test_case.get('preconditions', '')
-            postconditions = test_case.get('postconditions', '')
-            description = f"{preconditions}\n{postconditions}"
-
-            for order_id, step in enumerate(test_case.get('steps', []), start=1):
-                row = [
-                    id_counter,  # External id
-                    test_case.get('summary', ''),  # Test Summary
-                    order_id,  # OrderId
-                    step.get('step', ''),  # Step
-                    '',  # Test Data (optional, leaving empty)
-                    step.get('expectedResult', ''),  # Expected Result
-                    "6414a0cd67102fc717c034d7",  # Assigned To
-                    "This test case has been built by GenAI Workbench for XL import via Internal Importer.",  # Comments
-                    description,  # Description
-                    "Core",  # Component
-                    "external",  # jira-customfield-checkbox
-                    #"INVHUB-10821",  # Epic Link
-                    epic_link,  # Epic Link
-                    "blocks",  # Linked issues
-                    "GenAI_Test_Case",  # Labels
-                    "IM-5000",  # Issue Key [To add steps]
-                    "blocks",  # Issue Link Type
-                    "IM-3000",  # Issues Key To Link
-                    "3 - Medium",  # Priority
-                    37,  # Sprint
-                    "Release-1.0",  # Version
-                    "Dublin"  # Cascade
-                ]
-                ws.append(row)
-
-            id_counter += 1
+        builder = ZephyrExcelBuilder(epic_link)
+        for test_case in data.get('testCases', []):
+            builder.add_test_case(test_case)
 
         # Save the workbook
-        output_file = "Zephyr_Test_Cases_Output.xlsx"
-        wb.save(output_file)
+        builder.save(output_file)
         logging.info(f"Stage 5b - Excel file '{output_file}' created successfully.")
+        return output_file
 
     except FileNotFoundError:
         print(f"The file '{json_file}' does not exist.")
@@ -92,3 +263,5 @@ def generate_excel_from_json(json_file, epic_link):
     except Exception as e:
         print(f"An error occurred: {e}")
 
+    return None
+
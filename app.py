@@ -1,24 +1,84 @@
 
-from requests.auth import HTTPBasicAuth
+from concurrent.futures import ThreadPoolExecutor
+import argparse
 import json
 import logging
+import os
 import sys
+import threading
+import time
 
 
 # Import custom functions to extract JIRA requirements data
 from jiraextraction import (retrieve_jira_ticket_from_server, 
-                            filter_dict, 
+                            retrieve_jira_ticket_updated,
+                            compile_whitelist,
+                            project_dict,
+                            search_jira_issues,
                             validate_JIRA_env_vars)
 
 
 # Import custom functions to for OpenAI LLm connectivity
 from queryLLM import (query_ai, 
                       validate_OpenAI_env_vars, 
-                      clean_ai_response)
+                      query_ai_stream,
+                      query_ai_fix_json,
+                      cache_response,
+                      set_response_format,
+                      set_hedging,
+                      RESPONSE_FORMATS,
+                      decode_answer,
+                      load_system_prompt,
+                      response_cache,
+                      ai_router,
+                      MAX_TOKENS)
+from llmcache import log_cache_stats
+from llmrouter import log_router_stats
+
+
+# Import the token-budgeted prompt builder
+from promptbuilder import build_prompts, merge_test_cases, count_tokens
 
 
 # Import custom function to generate Excel file used as inout for Zephyr Squad Internal Import utilty
-from ZephyrImport import generate_excel_from_json
+from ZephyrImport import ZephyrExcelBuilder, DEFAULT_OUTPUT_FILE
+
+
+# Import the export backends: Excel, CSV, JSON lines and direct upload to Zephyr
+from exporters import create_exporters, validate_Zephyr_env_vars, EXPORT_FORMATS
+
+
+# Import the incremental parser for streamed LLM responses
+from llmstream import TestCaseStreamParser
+
+
+# Import the staged pipeline used to overlap the stages in batch mode
+from pipeline import Pipeline, Stage
+
+
+# Import the per-stage timing, token and cost instrumentation
+from instrumentation import RunMetrics, write_report, log_stage_timings, map_in_context
+
+
+# Import the background writer of the JSON files of test cases
+from artifacts import JsonArtifactWriter
+
+
+# Import the record of previous generations used by incremental mode
+from ticketstate import TicketStateStore, content_hash, log_unchanged_ticket
+from openaienvvars import config, LazyObject, SETTINGS
+
+
+# Import the near-duplicate detection of tickets and test cases
+from dedup import NearDuplicateTickets, TestCaseDeduplicator, ticket_signature, adapt_generation, log_dedup_stats
+
+
+# Import the journal of batch runs used to resume an interrupted run
+from jobjournal import JobJournal, UploadLog, FILTERED, log_resumed_tickets
+
+
+# Import the pool of processes for the CPU-bound post-processing
+from procpool import process_pool
 
 
 
@@ -31,6 +91,43 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Set up file name structure for JSON files output/input of Test Cases
 sFile_TC_suffix = "_test_case_steps"
 
+# Number of workers for each pipeline stage in batch mode. The LLM query is by far the slowest
+# stage, so it gets the most workers; fetching and Excel building only need to keep it fed.
+DEFAULT_FETCH_WORKERS = 2
+DEFAULT_LLM_WORKERS = 4
+DEFAULT_EXPORT_WORKERS = 1
+
+# --resume without a run id resumes the last batch run that did not finish
+RESUME_LAST = "last"
+
+
+# Record of the last generation for each ticket, shared by every ticket in the run and opened
+# from the TICKET_STATE_PATH setting when first used
+ticket_state = LazyObject(lambda: TicketStateStore(config.TICKET_STATE_PATH))
+
+# Journal of the stages completed by the tickets of batch runs, opened from the JOB_JOURNAL_PATH
+# setting when first used
+job_journal = LazyObject(lambda: JobJournal(config.JOB_JOURNAL_PATH, config.JOB_JOURNAL_MAX_AGE_DAYS))
+
+# Generations of the tickets in this process, for near-duplicate tickets to reuse (--dedup)
+ticket_index = LazyObject(lambda: NearDuplicateTickets(config.DEDUP_TICKET_THRESHOLD))
+
+# Writer of the <ticket>_test_case_steps.json files, off the critical path of each ticket
+json_artifacts = JsonArtifactWriter()
+
+# Timings, payload sizes and token usage of every ticket in the run
+run_metrics = LazyObject(lambda: RunMetrics(config.AI_PROMPT_COST_PER_1K, config.AI_COMPLETION_COST_PER_1K))
+
+
+class TicketProcessingError(Exception):
+    """
+    Raised when one of the procedural stages fails for a ticket.
+    The stage is recorded so that batch runs can report where each ticket failed.
+    """
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+
 
 # Define the whitelist
 WHITELIST = {
@@ -52,6 +149,11 @@ WHITELIST = {
     }
 }
 
+# The whitelist compiled once into projection plans. The fetch plan also keeps the ticket's
+# update time, which is used by incremental mode but not sent to the LLM.
+WHITELIST_PLAN = compile_whitelist(WHITELIST)
+FETCH_PLAN = compile_whitelist({**WHITELIST, "fields": {**WHITELIST["fields"], "updated": True}})
+
 # Check Environment Variables
 def validate_env_vars():
     """
@@ -65,142 +167,902 @@ def validate_env_vars():
 
 
 
-# Main function to retrieve and process a JIRA ticket, then query the AI for test cases,
-# # and finally generate an Excel file for Zephyr Squad Internal Import utility.
+# The procedural stages for one JIRA ticket: extract the JIRA data, query the AI for test cases,
+# parse the AI response and generate an Excel file for Zephyr Squad Internal Import utility.
 
-# This function is called when the script is run from the command line.
-def main(jira_ticket, epic_link):
+# Each group of stages is a separate function so that batch mode can run them as independently
+# sized stages of a pipeline. Errors are raised as TicketProcessingError so that one failing
+# ticket never stops a batch run.
+def fetch_ticket(jira_ticket, ticket_data=None):
     """
-    Main function to retrieve and process a JIRA ticket, then query the AI for test cases.
+    Stage 1: retrieve and filter the JIRA ticket. Returns the filtered ticket together with
+    the ticket's 'updated' timestamp.
+    ticket_data is given when the ticket was already extracted in bulk by a JQL search.
     """
-    if validate_env_vars() == False:
-        print("Environment variables not set correctly. Exiting.")
-        exit()
+    if ticket_data is None:
+        logging.info(f"Stage 1 - Extract Ticket Data from JIRA for {jira_ticket}")
+        stats = {}
+        try:
+            ticket_data = retrieve_jira_ticket_from_server(jira_ticket, FETCH_PLAN, stats)
+        except Exception as e:
+            logging.error(f"\nError retrieving JIRA ticket: {e}")
+            ticket_data = None
+        if stats:
+            run_metrics.add_time(jira_ticket, "jira_fetch", stats["fetch_seconds"])
+            run_metrics.add_time(jira_ticket, "filter", stats["filter_seconds"])
+            run_metrics.add(jira_ticket, "jira_payload_bytes", stats["payload_bytes"])
+
+    if ticket_data is None:
+        raise TicketProcessingError("Stage 1", "Failed to retrieve JIRA ticket data.")
+
+    updated = ticket_data.get("fields", {}).get("updated")
+
+    try:
+        with run_metrics.time(jira_ticket, "filter"):
+            reduced_ticket = project_dict(ticket_data, WHITELIST_PLAN)
+    except Exception as e:
+        raise TicketProcessingError("Stage 1", f"Failed to filter JIRA ticket data: {e}")
 
-    # Do not proceed to the LLM if there are any errors in JIRA Ticket Data Extraction
-    bProceedtoLLM = True
+    return reduced_ticket, updated
 
+
+
+def build_ticket_prompts(jira_ticket, reduced_ticket):
     """
-    Set up procedural stages to extract JIRA data, query AI, and parse the AI response
+    Stage 2: build the compact JSON prompt(s) for the LLM within the model's token budget.
+    A ticket too large for one prompt has its comments split over several prompts.
     """
+    logging.info(f"Stage 2 - Build JSON Object with JIRA Ticket Details for {jira_ticket}")
     try:
-        # Stage 1: Retrieve and filter the JIRA ticket
+        with run_metrics.time(jira_ticket, "prompt_build"):
+            prompts = build_prompts(reduced_ticket, load_system_prompt(), config.AI_CONTEXT_TOKENS, MAX_TOKENS,
+                                    config.AI_PROMPT_MAX_CHUNKS)
+    except Exception as e:
+        raise TicketProcessingError("Stage 2", f"Failed to build the LLM prompt from the ticket data: {e}")
+    run_metrics.add(jira_ticket, "prompts", len(prompts))
+
+    if len(prompts) > 1:
+        logging.info(f"Stage 2 - {jira_ticket} is too large for one prompt: split into {len(prompts)} parts")
+    return prompts
+
+
+
+def parse_ai_response(jira_ticket, query_ai_response):
+    """
+    Stage 4a: extract the JSON test cases from an LLM response.
+    """
+    if not query_ai_response.get("choices"):
+        raise TicketProcessingError("Stage 3", "No valid response from AI")
+
+    logging.info(f"Stage 4a - Parsing LLM Response into JSON Format for {jira_ticket}..")
+    ai_content = query_ai_response["choices"][0]["message"]["content"]
+    parsed, repaired, error = decode_answer(ai_content)
+    if repaired:
+        logging.warning("LLM response was cut off - repaired by keeping only its complete elements")
+    if error is not None:
+        raise TicketProcessingError("Stage 4", error)
+    return parsed
+
+
+
+def parse_with_retry(jira_ticket, prompt, query_ai_response):
+    """
+    Stage 4a with a targeted retry: if the LLM answer cannot be parsed as JSON, the LLM is shown
+    its answer and asked to correct it (up to AI_PARSE_RETRIES times), instead of failing the ticket.
+    Only an answer that was parsed is stored in the LLM response cache.
+    """
+    for attempt in range(config.AI_PARSE_RETRIES + 1):
+        choices = query_ai_response.get("choices") or []
+        if choices and choices[0].get("finish_reason") == "length":
+            logging.warning(f"LLM answer for {jira_ticket} was cut off at max_tokens={MAX_TOKENS}")
         try:
-            logging.info("Stage 1 - Extract Ticket Data from JIRA")
-            ticket_data = retrieve_jira_ticket_from_server(jira_ticket)
-        except Exception as e:
-            logging.error(f"\nError retrieving JIRA ticket: {e}")
-            ticket_data = None
-        
-        if ticket_data is None:
-            raise ValueError("\nFailed to retrieve JIRA ticket data.")
-        
+            with run_metrics.time(jira_ticket, "parse"):
+                parsed = parse_ai_response(jira_ticket, query_ai_response)
+        except TicketProcessingError as e:
+            if e.stage != "Stage 4" or attempt == config.AI_PARSE_RETRIES:
+                raise
+            logging.warning(f"Stage 4a - Asking the LLM to correct its answer for {jira_ticket}: {e}")
+            try:
+                with run_metrics.time(jira_ticket, "llm_query"):
+                    query_ai_response = query_ai_fix_json(prompt, choices[0]["message"]["content"], e)
+            except Exception as retry_error:
+                raise TicketProcessingError("Stage 3", f"Error querying AI: {retry_error}")
+            run_metrics.add(jira_ticket, "parse_retries", 1)
+            run_metrics.add_usage(jira_ticket, query_ai_response.get("usage") or {})
+        else:
+            if not query_ai_response.get("cached"):
+                cache_response(prompt, query_ai_response)
+            return parsed
+
+
+
+def generate_test_cases(jira_ticket, prompts):
+    """
+    Stages 3-4a: query the AI with the JIRA ticket prompt(s) and parse the response(s).
+    The prompts of a ticket split into several parts are queried in parallel and their test
+    cases merged. Returns the parsed test cases.
+    """
+    # Stage 3: Query AI with the JIRA ticket JSON
+    logging.info(f"Stage 3 - Requesting LLM to generate test cases for {jira_ticket}...")
+
+    def query_and_parse(prompt):
         try:
-            reduced_ticket = filter_dict(ticket_data, WHITELIST)
+            with run_metrics.time(jira_ticket, "llm_query"):
+                query_ai_response = query_ai(prompt)
         except Exception as e:
-            logging.error(f"Error filtering JIRA ticket data: {e}")
-            reduced_ticket = None
-        
-        if reduced_ticket is None:
-            raise ValueError("Failed to filter JIRA ticket data.")
-        
+            raise TicketProcessingError("Stage 3", f"Error querying AI: {e}")
+        run_metrics.add_usage(jira_ticket, query_ai_response.get("usage") or {},
+                              cached=query_ai_response.get("cached", False))
+        return parse_with_retry(jira_ticket, prompt, query_ai_response)
+
+    if len(prompts) == 1:
+        parsed_ai_content = query_and_parse(prompts[0])
+    else:
+        with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
+            parsed_ai_content = merge_test_cases(map_in_context(executor, query_and_parse, prompts))
+
+    return parsed_ai_content
+
+
+
+def write_test_cases_json(jira_ticket, parsed_ai_content, on_written=None, output_dir=None):
+    """
+    Stage 4b: queue the parsed test cases to be written to <jira_ticket>_test_case_steps.json,
+    in output_dir when one is given, in the background. Returns the file name, or None when the
+    JSON files are turned off.
+    """
+    file_name = f"{jira_ticket}{sFile_TC_suffix}.json"
+    if output_dir:
+        file_name = os.path.join(output_dir, file_name)
+    return json_artifacts.write(file_name, parsed_ai_content, on_written)
+
 
 
-        # Stage 2: Convert to JIRA Ticket data to JSON format
+def stream_test_cases(jira_ticket, epic_link, prompts, output_file=DEFAULT_OUTPUT_FILE):
+    """
+    Stages 3-5 overlapped, for streaming mode: the LLM response is streamed and each test case is
+    added to the Excel workbook as soon as the model has finished writing it, rather than after
+    the whole answer has arrived. Returns the parsed test cases and the name of the Excel file.
+    Without an output file no Excel file is built, e.g. when the export goes to a batch workbook.
+    """
+    logging.info(f"Stage 3 - Streaming LLM test case generation for {jira_ticket}...")
+    builder = ZephyrExcelBuilder(epic_link) if output_file is not None else None
+    builder_lock = threading.Lock()
+    start = time.perf_counter()
+
+    def stream_prompt(prompt):
+        parser = TestCaseStreamParser()
+        content = []
+        meta = {}
+        query_start = time.perf_counter()
         try:
-            logging.info("Stage 2 - Build JSON Object with JIRA Ticket Details")
-            ticket_json_str = json.dumps(reduced_ticket)
+            for chunk in query_ai_stream(prompt, meta=meta):
+                content.append(chunk)
+                if builder is None:
+                    continue
+                for test_case in parser.feed(chunk):
+                    with builder_lock:
+                        if builder.sheet_count == 0:
+                            run_metrics.add_time(jira_ticket, "first_test_case", time.perf_counter() - start)
+                            logging.info(f"Stage 5a - First test case for {jira_ticket} received after "
+                                         f"{time.perf_counter() - start:.1f}s, building Excel file..")
+                        builder.add_test_case(test_case)
         except Exception as e:
-            logging.error(f"Error converting ticket data to JSON string: {e}")
-            ticket_json_str = None
-        
-        if ticket_json_str is None:
-            raise ValueError("Failed to convert ticket data to JSON string.")
-
-        
-         # Stage 3: Convert to JSON and query AI
+            raise TicketProcessingError("Stage 3", f"Error querying AI: {e}")
+        run_metrics.add_time(jira_ticket, "llm_query", time.perf_counter() - query_start)
+        # Streamed responses carry no usage: the tokens are counted locally
+        answer = "".join(content)
+        run_metrics.add_usage(jira_ticket, {"prompt_tokens": count_tokens(load_system_prompt()) + count_tokens(prompt),
+                                            "completion_tokens": count_tokens(answer)},
+                              cached=meta.get("cached", False), estimated=True)
+
+        # The complete answer is parsed as well, for the JSON file of test cases
+        parsed = parse_with_retry(jira_ticket, prompt, {"choices": [{"message": {"role": "assistant", "content": answer}}],
+                                                        "cached": meta.get("cached", False)})
+        # A corrected answer after a parse failure may hold test cases the stream did not deliver
+        test_cases = parsed.get("testCases", []) if isinstance(parsed, dict) and builder is not None else []
+        for test_case in test_cases[parser.emitted:]:
+            with builder_lock:
+                builder.add_test_case(test_case)
+        return parsed
+
+    if len(prompts) == 1:
+        parsed_ai_content = stream_prompt(prompts[0])
+    else:
+        with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
+            parsed_ai_content = merge_test_cases(map_in_context(executor, stream_prompt, prompts))
+
+    if builder is None:
+        return parsed_ai_content, None
+
+    try:
+        with run_metrics.time(jira_ticket, "export_excel"):
+            builder.save(output_file)
+        logging.info(f"Stage 5b - Excel file '{output_file}' created successfully.")
+    except Exception as e:
+        raise TicketProcessingError("Stage 5", f"Error generating Excel file: {e}")
+    return parsed_ai_content, output_file
+
+
+
+def load_test_cases(json_file):
+    """
+    Read the test cases back from a JSON file of test case steps.
+    """
+    try:
+        with open(json_file, 'r') as f:
+            return json.load(f).get('testCases', [])
+    except (IOError, json.JSONDecodeError) as e:
+        raise TicketProcessingError("Stage 5", f"Error reading test cases from {json_file}: {e}")
+
+
+
+def export_test_cases(jira_ticket, epic_link, test_cases, exporters):
+    """
+    Stage 5: hand the test cases to each export backend, by default the Excel file for the
+    Zephyr Squad Internal Import utility. Returns the outputs, e.g. the names of the files written.
+    """
+    logging.info(f"Stage 5a - Exporting test cases for {jira_ticket} ({', '.join(e.name for e in exporters)})..")
+    outputs = []
+    for exporter in exporters:
         try:
-            logging.info("Stage 3 - Requesting LLM to generate test cases using JIRA input...")
-            query_ai_response = query_ai(ticket_json_str)
+            with run_metrics.time(jira_ticket, f"export_{exporter.name}"):
+                outputs.append(exporter.export(jira_ticket, epic_link, test_cases))
         except Exception as e:
-            logging.error(f"Error querying AI: {e}")
-            query_ai_response = {}
+            raise TicketProcessingError("Stage 5", f"Error exporting test cases ({exporter.name}): {e}")
+    return outputs
 
 
-    except ValueError as ve:
-        logging.error(f"Processing halted: {ve}")
-        bProceedtoLLM = False
 
-    except Exception as e:
-        logging.error(f"Unexpected error: {e}")
-
-    
-    
-    # Stage 4: Parse the LLM response to build a JSON file of test case steps
-    if bProceedtoLLM == True:
-        logging.info("Stage 4a - Parsing LLM Response into JSON Format..")
-        if "choices" in query_ai_response and query_ai_response["choices"]:
-            ai_content = query_ai_response["choices"][0]["message"]["content"]
-            ai_content = clean_ai_response(ai_content)
-            
-            try: 
-                parsed_ai_content = json.loads(ai_content) 
-            except json.JSONDecodeError as e:
-                print("JSONDecodeError:", e)
-                parsed_ai_content = None  # or handle the error appropriately, e.g., assign an empty dict or similar
-
-            if parsed_ai_content is not None:
-                                               
-                # Write the successful JSON output to a file
-                try:
-                    file_name = f"{jira_ticket}{sFile_TC_suffix}.json"
-                    with open(file_name, 'w') as json_file:
-                        json.dump(parsed_ai_content, json_file, indent=4)
-                    logging.info(f"Stage 4b - JSON output successfully written to {file_name}")
-                except IOError as e:
-                    logging.error(f"Failed to write JSON output to file: {e}")
-            else:
-                logging.error("Parsed AI content is not available due to JSON decoding failure.")
-                print("\n Failed AI Content:\n")
+# A job carries one ticket through the stages. The job functions below are shared by single-ticket
+# runs and by the batch pipeline.
+# A batch run journals the stages of its jobs under journal_run; journaled is the journal entry of
+# the ticket in the run being resumed. The JSON file of the test cases goes to output_dir, like
+# the outputs of the export backends.
+def new_job(jira_ticket, epic_link, exporters, ticket_data=None, test_case_dedup=None, journal_run=None,
+            journaled=None, output_dir=None):
+    return {"ticket": jira_ticket, "epic_link": epic_link, "exporters": exporters, "outputs": [],
+            "ticket_data": ticket_data, "streamed": None, "unchanged": False, "start": time.perf_counter(),
+            "test_case_dedup": test_case_dedup, "journal_run": journal_run, "journaled": journaled,
+            "output_dir": output_dir}
+
+
+
+def new_test_case_dedup():
+    """
+    The near-duplicate test case filter of a run, or None unless near-duplicate detection is on.
+    """
+    return TestCaseDeduplicator(config.DEDUP_TEST_CASE_THRESHOLD) if config.DEDUP_ENABLED else None
+
+
+
+def fetch_job(job, incremental=False):
+    """
+    Stages 1-2 for a job. In incremental mode a ticket whose 'updated' timestamp, or failing that
+    whose filtered content, matches the last generation reuses that generation's JSON file of
+    test cases and is not sent to the LLM again. A ticket of a resumed run starts after the last
+    stage it completed: with its journaled test cases, or its journaled filtered data.
+    """
+    jira_ticket = job["ticket"]
+    ticket_data = job.pop("ticket_data")
+    journaled = job["journaled"]
+    if journaled is not None and journaled["parsed"] is not None:
+        logging.info(f"{jira_ticket} resumed with its test cases generated in the interrupted run")
+        job.update(updated=journaled["updated"], content_hash=journaled["content_hash"],
+                   journaled_parsed=journaled["parsed"])
+        return job
+    if journaled is not None and journaled["stage"] == FILTERED:
+        logging.info(f"{jira_ticket} resumed with its ticket data fetched in the interrupted run")
+        reduced_ticket, job["updated"] = journaled["reduced_ticket"], journaled["updated"]
+        job["content_hash"] = journaled["content_hash"]
+        return prepare_generation(job, reduced_ticket)
+
+    state = ticket_state.get_output(jira_ticket) if incremental else None
+
+    # Cheap check first: the update time, from the bulk extraction or a fields-only request
+    if state is not None and state["updated"] is not None:
+        if ticket_data is not None:
+            updated = ticket_data.get("fields", {}).get("updated")
+        else:
+            with run_metrics.time(jira_ticket, "jira_updated_check"):
+                updated = retrieve_jira_ticket_updated(jira_ticket)
+        if updated == state["updated"]:
+            log_unchanged_ticket(jira_ticket, "same update time")
+            job.update(json_file=state["json_file"], unchanged=True)
+            return job
+
+    reduced_ticket, job["updated"] = fetch_ticket(jira_ticket, ticket_data)
+    job["content_hash"] = content_hash(reduced_ticket)
+    if job["journal_run"] is not None:
+        job_journal.filtered(job["journal_run"], jira_ticket, job["updated"], job["content_hash"], reduced_ticket)
+
+    # The ticket was touched, but possibly only in fields that are not sent to the LLM
+    if state is not None and state["content_hash"] == job["content_hash"]:
+        ticket_state.touch(jira_ticket, job["updated"])
+        log_unchanged_ticket(jira_ticket, "same filtered content")
+        job.update(json_file=state["json_file"], unchanged=True)
+        return job
+
+    return prepare_generation(job, reduced_ticket)
+
+
+
+def prepare_generation(job, reduced_ticket):
+    """
+    Stage 2 for a job: build the prompts of the filtered ticket, and its signature for
+    near-duplicate detection.
+    """
+    jira_ticket = job["ticket"]
+    job["prompts"] = build_ticket_prompts(jira_ticket, reduced_ticket)
+    if config.DEDUP_ENABLED:
+        with run_metrics.time(jira_ticket, "dedup"):
+            job["signature"] = ticket_signature(jira_ticket, reduced_ticket)
+    return job
+
+
 
-            
+def reuse_generation(job):
+    """
+    Stage 3 for a near-duplicate ticket: wait for the generation of the ticket it duplicates and
+    reuse its test cases. Returns None, so that the ticket is generated itself, if there is no
+    such ticket or its generation failed. Otherwise the ticket is registered for later ones.
+    """
+    jira_ticket = job["ticket"]
+    duplicate = ticket_index.begin(jira_ticket, job["signature"])
+    if duplicate is None:
+        job["dedup_source"] = True
+        return None
+    source_ticket, score, future = duplicate
+    logging.info(f"Stage 3 - {jira_ticket} is a near-duplicate of {source_ticket} ({score:.0%} similar), "
+                 f"reusing its test cases")
+    with run_metrics.time(jira_ticket, "dedup_wait"):
+        parsed = future.result()
+    if parsed is None:
+        logging.info(f"Stage 3 - Generation for {source_ticket} failed, generating {jira_ticket} itself")
+        return None
+    ticket_index.count_reuse()
+    run_metrics.add(jira_ticket, "dedup_reused", 1)
+    return adapt_generation(parsed, source_ticket, jira_ticket)
+
+
+
+def generate_job(job, stream=False):
+    """
+    Stages 3-4 for a job, skipped for unchanged tickets. A near-duplicate of a ticket generated
+    before reuses its test cases when near-duplicate detection is on. In streaming mode the Excel
+    file is built here too, while the response arrives. The parsed test cases stay with the job for
+    Stage 5; the JSON file is written in the background, and the generation is recorded for
+    later incremental runs once that file is complete. A batch run journals the generation, and
+    a resumed ticket that was generated before uses the journaled one.
+    """
+    if job["unchanged"]:
+        return job
+    parsed = job.pop("journaled_parsed", None)
+    if parsed is None:
+        parsed = generate_parsed(job, stream)
+        if job["journal_run"] is not None:
+            job_journal.generated(job["journal_run"], job["ticket"], job["updated"], job["content_hash"], parsed)
+    job["test_cases"] = parsed.get("testCases", []) if isinstance(parsed, dict) else []
+
+    jira_ticket, updated, ticket_hash = job["ticket"], job.get("updated"), job["content_hash"]
+    job["json_file"] = write_test_cases_json(
+        jira_ticket, parsed, lambda json_file: ticket_state.record(jira_ticket, updated, ticket_hash, json_file),
+        job["output_dir"])
+    return job
+
+
+
+def generate_parsed(job, stream=False):
+    """
+    Stages 3-4a for a job: reuse the test cases of a near-duplicate ticket or query the LLM, and
+    return the parsed test cases.
+    """
+    parsed = reuse_generation(job) if job.get("signature") is not None else None
+    if parsed is not None:
+        job.pop("prompts")
+        return parsed
+    try:
+        parsed = query_job(job, stream)
+    except Exception:
+        if job.get("dedup_source"):
+            ticket_index.fail(job["ticket"])
+        raise
+    if job.get("dedup_source"):
+        ticket_index.finish(job["ticket"], parsed)
+    return parsed
+
+
+
+def query_job(job, stream=False):
+    """
+    Stages 3-4a for a job: query the LLM and return the parsed test cases.
+    """
+    if stream:
+        # The per-ticket Excel file, if one is wanted, is built while the response streams in;
+        # the other export backends take the whole ticket in Stage 5
+        excel = next((e for e in job["exporters"] if e.name == "excel"), None)
+        parsed, output_file = stream_test_cases(job["ticket"], job["epic_link"], job.pop("prompts"),
+                                                excel.output_file(job["ticket"]) if excel else None)
+        if excel is not None:
+            job["streamed"] = excel
+            job["outputs"].append(output_file)
+        return parsed
+    return generate_test_cases(job["ticket"], job.pop("prompts"))
+
+
+
+def export_job(job):
+    """
+    Stage 5 for a job, for the export backends that were not already served while streaming.
+    With near-duplicate detection on, the test cases already exported in the run for the EPIC are
+    left out, and a ticket left with none is not exported. A resumed ticket is not exported again
+    to the per-ticket backends it was exported to before the interruption; the run-wide files
+    are written anew, so they get it again. A batch run journals the export.
+    """
+    journaled = job["journaled"]
+    done = set(journaled["exported_to"]) if journaled is not None else set()
+    exporters = [e for e in job["exporters"]
+                 if e is not job["streamed"] and not (e.per_ticket and e.name in done)]
+    if journaled is not None and done:
+        job["outputs"] += journaled["outputs"]
+    if exporters:
+        # Unchanged tickets reuse the test cases recorded by an earlier run
+        test_cases = job.get("test_cases")
+        if test_cases is None:
+            test_cases = load_test_cases(job["json_file"])
+        collapsed = False
+        if job["test_case_dedup"] is not None and test_cases:
+            with run_metrics.time(job["ticket"], "dedup"):
+                test_cases = job["test_case_dedup"].collapse(job["ticket"], job["epic_link"], test_cases)
+            collapsed = not test_cases
+        if collapsed:
+            logging.info(f"Stage 5a - All test cases of {job['ticket']} were already exported, skipping export")
         else:
-            logging.error("No valid response from AI")
+            outputs = export_test_cases(job["ticket"], job["epic_link"], test_cases, exporters)
+            job["outputs"] += [output for output in outputs if output not in job["outputs"]]
+    if job["journal_run"] is not None:
+        done.update(e.name for e in exporters)
+        if job["streamed"] is not None:
+            done.add(job["streamed"].name)
+        job_journal.exported(job["journal_run"], job["ticket"], done, job["outputs"])
+    return job
+
+
+
+def process_ticket(jira_ticket, epic_link, exporters, incremental=False, stream=False, test_case_dedup=None,
+                   output_dir=None):
+    """
+    Run Stages 1-5 for one JIRA ticket and return the outputs of the export backends.
+    """
+    job = new_job(jira_ticket, epic_link, exporters, test_case_dedup=test_case_dedup, output_dir=output_dir)
+    fetch_job(job, incremental)
+    generate_job(job, stream)
+    export_job(job)
+    return job["outputs"]
+
+
+
+# Main function to retrieve and process a JIRA ticket, then query the AI for test cases,
+# # and finally generate an Excel file for Zephyr Squad Internal Import utility.
+
+# This function is called when the script is run from the command line.
+def main(jira_ticket, epic_link, incremental=False, stream=False, output_dir=None, export_formats=("excel",),
+         report_path=None):
+    """
+    Main function to retrieve and process a JIRA ticket, then query the AI for test cases.
+    The Excel file is Zephyr_Test_Cases_Output.xlsx, or <jira_ticket>_Zephyr_Test_Cases_Output.xlsx
+    in the output directory when one is given. The stage timings are logged, and written to
+    report_path when one is given.
+    """
+    if validate_env_vars() == False or ("zephyr" in export_formats and validate_Zephyr_env_vars() == False):
+        print("Environment variables not set correctly. Exiting.")
+        exit()
+
+    output_dir = prepare_output_dir(output_dir)
+    exporters = create_exporters(export_formats, output_dir, new_run_id(), None if output_dir else DEFAULT_OUTPUT_FILE)
+    test_case_dedup = new_test_case_dedup()
+    start = time.perf_counter()
+    try:
+        process_ticket(jira_ticket, epic_link, exporters, incremental=incremental, stream=stream,
+                       test_case_dedup=test_case_dedup, output_dir=output_dir)
+        logging.info("\n Successfully Generated AI Content and Created XL for Zephyr Squad Import\n")
+    except TicketProcessingError as e:
+        logging.error(f"Processing halted at {e.stage}: {e}")
+    finally:
+        close_exporters(exporters)
+        json_artifacts.flush()
+        process_pool.close()
+    elapsed = time.perf_counter() - start
+    run_metrics.add_time(jira_ticket, "total", elapsed)
+
+    report_run(elapsed, report_path)
+    log_cache_stats(response_cache)
+    log_router_stats(ai_router)
+    log_dedup_stats(ticket_index, test_case_dedup)
+
+
+
+def report_run(elapsed, report_path=None):
+    """
+    Log where the time of the run went and write the run report if a path is given.
+    """
+    report = run_metrics.report(elapsed)
+    logging.info("Stage timings:")
+    log_stage_timings(report)
+    if report_path:
+        try:
+            write_report(report, report_path)
+        except IOError as e:
+            logging.error(f"Failed to write the run report to {report_path}: {e}")
+    return report
+
+
+
+def new_run_id():
+    """
+    Identify a run by its start time, e.g. to name its batch workbook.
+    """
+    return time.strftime("%Y%m%d-%H%M%S")
+
 
-        # Stage 5: Parse the JSON file of test case steps into XL format for Zephyr Squad Import    
-        logging.info("Stage 5a - Building Excel File for Zephyr Squad Import..")
+
+def prepare_output_dir(output_dir):
+    """
+    Create the output directory if one is given and does not exist yet.
+    """
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    return output_dir
+
+
+
+def close_exporters(exporters):
+    """
+    Finish every export backend of the run, e.g. save the batch workbook, and log the files written.
+    """
+    for exporter in exporters:
         try:
-            generate_excel_from_json(f"{jira_ticket}{sFile_TC_suffix}.json", epic_link)
-            logging.info("\n Successfully Generated AI Content and Created XL for Zephyr Squad Import\n")
+            files = exporter.close()
         except Exception as e:
-            logging.error(f"Error generating Excel file: {e}")
-            print(f"Error generating Excel file: {e}")
+            logging.error(f"Error finishing the {exporter.name} export: {e}")
+            continue
+        if files:
+            logging.info(f"{exporter.name} export written: {', '.join(files)}")
 
 
 
+def read_ticket_list(source, default_epic_link):
+    """
+    Read the tickets for a batch run from a file, or from stdin when the source is '-'.
+    Each line holds a JIRA ticket, optionally followed by its EPIC link separated by a comma
+    or whitespace. Blank lines and lines starting with '#' are ignored.
+    """
+    if source == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
 
+    tickets = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.replace(",", " ").split()
+        epic_link = parts[1] if len(parts) > 1 else default_epic_link
+        if epic_link is None:
+            raise ValueError(f"No EPIC link given for ticket {parts[0]}")
+        tickets.append((parts[0], epic_link))
+    return tickets
 
 
-if __name__ == "__main__":
 
-    # Input the JIRA ticket number as a command line parameter
-    
+def run_batch(tickets, llm_workers=DEFAULT_LLM_WORKERS, fetch_workers=DEFAULT_FETCH_WORKERS,
+              export_workers=DEFAULT_EXPORT_WORKERS, incremental=False, stream=False, output_dir=None,
+              export_formats=("excel",), run_id=None, report_path=None, resume=False):
+    """
+    Process many (jira_ticket, epic_link) pairs in one run. A third item, the ticket data, may be
+    given for tickets that were already extracted in bulk; tickets can be an iterator that yields
+    them as they arrive.
+
+    The JIRA fetch, LLM query and export run as separate pipeline stages, each with its own
+    pool of workers, so tickets are fetched and exported while the LLM works on others and the
+    end-to-end time approaches the time spent in the LLM stage alone.
+    The test cases go to the export backends named in export_formats (see exporters.py). With
+    'excel' each ticket writes its own <jira_ticket>_Zephyr_Test_Cases_Output.xlsx so that tickets
+    do not overwrite each other's output; the other backends collect the whole run in
+    Zephyr_Test_Cases_<run_id>.* files or upload to Zephyr. Output files go to output_dir when it is given.
+    A failing ticket is recorded and never stops the rest of the batch.
+    In incremental mode, unchanged tickets reuse their previous test cases instead of querying the LLM.
+    In streaming mode, each ticket's Excel file is built while its LLM response streams in.
+    With POSTPROCESS_PROCESSES above 0, the workbooks are built on that many processes (see procpool.py).
+    The stages each ticket completes are journaled under run_id (see jobjournal.py); with resume,
+    the run of that id was interrupted and each ticket carries on after its last completed stage.
+    Per-stage timings and token usage are logged at the end, and written to report_path when given.
+    Returns a list of per-ticket result dictionaries.
+    """
+    pipeline = Pipeline([
+        Stage("jira-fetch", lambda job: fetch_job(job, incremental), fetch_workers),
+        Stage("llm-query", lambda job: generate_job(job, stream), llm_workers),
+        # An export worker waits while a process builds its workbook: one per process keeps them busy
+        Stage("excel-export", export_job, max(export_workers, process_pool.processes)),
+    ])
+
+    pipeline_results = []
+
+    def log_result(pipeline_result):
+        pipeline_results.append(pipeline_result)
+        job = pipeline_result.item
+        job["elapsed"] = time.perf_counter() - job["start"]
+        run_metrics.add_time(job["ticket"], "total", job["elapsed"])
+        if pipeline_result.ok:
+            logging.info(f"{job['ticket']} completed in {job['elapsed']:.1f}s -> {', '.join(job['outputs'])}")
+        else:
+            logging.error(f"{job['ticket']} failed at {pipeline_result.failed_stage}: {pipeline_result.error}")
+            if journal_run is not None:
+                job_journal.failed(journal_run, job["ticket"], str(pipeline_result.error))
+
+    run_id = run_id or new_run_id()
+    journal_run, journaled = None, {}
+    if config.JOB_JOURNAL_ENABLED:
+        journal_run = run_id
+        journaled = job_journal.start_run(run_id, resume)
+        if resume:
+            log_resumed_tickets(run_id, journaled)
+    elif resume:
+        logging.warning("JOB_JOURNAL_ENABLED is off, the run starts over")
+
+    output_dir = prepare_output_dir(output_dir)
+    exporters = create_exporters(export_formats, output_dir, run_id,
+                                 upload_log=UploadLog(job_journal, journal_run) if journal_run is not None else None)
+    test_case_dedup = new_test_case_dedup()
+
+    batch_start = time.perf_counter()
+    jobs = (new_job(ticket[0], ticket[1], exporters, ticket[2] if len(ticket) > 2 else None, test_case_dedup,
+                    journal_run, journaled.get(ticket[0]), output_dir)
+            for ticket in tickets)
+    try:
+        pipeline.run(jobs, on_result=log_result)
+    finally:
+        close_exporters(exporters)
+        json_artifacts.flush()
+        process_pool.close()
+    elapsed = time.perf_counter() - batch_start
+
+    results = []
+    for pipeline_result in sorted(pipeline_results, key=lambda r: r.index):
+        job = pipeline_result.item
+        result = {"ticket": job["ticket"], "epic_link": job["epic_link"], "status": "ok",
+                  "stage": None, "error": None,
+                  "outputs": job["outputs"] if pipeline_result.ok else [],
+                  "unchanged": job["unchanged"], "elapsed": job.get("elapsed")}
+        if not pipeline_result.ok:
+            error = pipeline_result.error
+            if isinstance(error, TicketProcessingError):
+                result.update(status="failed", stage=error.stage, error=str(error))
+            else:
+                result.update(status="failed", stage=pipeline_result.failed_stage,
+                              error=f"Unexpected error: {error}")
+        results.append(result)
+    if journal_run is not None and all(r["status"] == "ok" for r in results):
+        job_journal.finish_run(journal_run)
+
+    log_batch_summary(results, elapsed)
+    for line in pipeline.stage_summary(elapsed):
+        logging.info(f"  {line}")
+    report_run(elapsed, report_path)
+    log_cache_stats(response_cache)
+    log_router_stats(ai_router)
+    log_dedup_stats(ticket_index, test_case_dedup)
+    return results
+
+
+
+def log_batch_summary(results, elapsed):
+    """
+    Log the throughput and the failures of a batch run.
+    """
+    failures = [r for r in results if r["status"] != "ok"]
+    throughput = len(results) / elapsed if elapsed > 0 else 0.0
+
+    logging.info(f"Batch complete: {len(results)} tickets in {elapsed:.1f}s "
+                 f"({throughput:.2f} tickets/s), {len(results) - len(failures)} succeeded "
+                 f"({sum(1 for r in results if r.get('unchanged'))} unchanged), {len(failures)} failed")
+    for r in failures:
+        logging.info(f"  FAILED {r['ticket']} at {r['stage']}: {r['error']}")
+
+
+
+def batch_main(args):
+    """
+    Entry point for batch mode: collect the ticket list and run it through the pipeline.
+    """
+    if validate_env_vars() == False or ("zephyr" in args.export and validate_Zephyr_env_vars() == False):
+        print("Environment variables not set correctly. Exiting.")
+        exit()
+
+    if args.jql:
+        if args.epic is None:
+            print("An EPIC link (--epic) is required when selecting tickets with --jql")
+            exit(1)
+        # Issues stream into the pipeline as the search result pages arrive
+        tickets = ((issue["key"], args.epic, issue) for issue in search_jira_issues(args.jql, whitelist=FETCH_PLAN))
+    else:
+        tickets = read_ticket_list(args.batch, args.epic)
+
+    run_id = None
+    if args.resume:
+        run_id = job_journal.last_unfinished_run() if args.resume == RESUME_LAST else args.resume
+        if run_id is None or not job_journal.has_run(run_id):
+            print(f"No interrupted batch run {'' if args.resume == RESUME_LAST else args.resume + ' '}"
+                  f"to resume in {config.JOB_JOURNAL_PATH}")
+            exit(1)
+
+    try:
+        results = run_batch(tickets, args.workers, args.fetch_workers, args.export_workers, args.incremental,
+                            args.stream, args.output_dir, args.export, run_id=run_id, report_path=args.report,
+                            resume=run_id is not None)
+    except Exception as e:
+        # e.g. the JQL search itself failed part way through
+        logging.error(f"Batch run aborted: {e}")
+        sys.exit(1)
+    if any(r["status"] != "ok" for r in results):
+        sys.exit(1)
+
+
+
+def serve_main(args):
+    """
+    Entry point for service mode: run the job service until it is stopped.
+    """
+    if validate_env_vars() == False or ("zephyr" in args.export and validate_Zephyr_env_vars() == False):
+        print("Environment variables not set correctly. Exiting.")
+        exit()
+    if not json_artifacts.enabled:
+        # The service always runs incrementally, which reuses the JSON files of test cases
+        logging.warning("--no-json-artifact ignored in service mode")
+        json_artifacts.enabled = True
+
+    # The service module imports this one: make it share this run's module state (the JSON
+    # writer, metrics and command line settings) rather than import a second copy of app.py
+    sys.modules.setdefault("app", sys.modules[__name__])
+    import service
+    service.serve(args.serve, output_dir=args.output_dir or "service_output", fetch_workers=args.fetch_workers,
+                  llm_workers=args.workers, export_workers=args.export_workers, stream=args.stream,
+                  export_formats=args.export)
+
+
+
+def parse_export_formats(value):
+    formats = tuple(f.strip() for f in value.split(",") if f.strip())
+    unknown = [f for f in formats if f not in EXPORT_FORMATS]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(f"unknown export format(s) {', '.join(unknown)}; "
+                                         f"expected {', '.join(EXPORT_FORMATS)}")
+    return formats
+
+
+def parse_setting(value):
+    name, sep, setting = value.partition("=")
+    name = name.strip()
+    if not sep or name not in SETTINGS:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE with one of the settings in openaienvvars.py, got '{value}'")
+    try:
+        SETTINGS[name][1](setting.strip())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid value for {name}: '{setting.strip()}'")
+    return name, setting.strip()
+
+
+
+def build_arg_parser():
+    """
+    Command line options. The original 'python app.py <JIRA_TICKET> <EPIC_LINK>' form is unchanged.
+    """
+    parser = argparse.ArgumentParser(
+        description="Generate Zephyr Squad test cases from JIRA tickets using an LLM.",
+        usage="python app.py <JIRA_TICKET> <EPIC_LINK>\n"
+              "       python app.py --batch <FILE|-> [--epic EPIC_LINK] [--workers N] [--resume [RUN_ID]]\n"
+              "       python app.py --jql <JQL> --epic EPIC_LINK [--workers N]\n"
+              "       python app.py --serve [HOST:]PORT [--workers N] [--output-dir DIR]")
+    parser.add_argument("jira_ticket", nargs="?", help="JIRA ticket with the requirements, e.g. INVHUB-11696")
+    parser.add_argument("epic_link", nargs="?", help="EPIC to link the new test cases to, e.g. INVHUB-10821")
+    parser.add_argument("--batch", metavar="FILE", help="file with one ticket per line ('TICKET [EPIC]'), or '-' for stdin")
+    parser.add_argument("--jql", help="JQL query selecting the tickets to process")
+    parser.add_argument("--epic", help="default EPIC link for tickets in batch mode")
+    parser.add_argument("--serve", metavar="[HOST:]PORT",
+                        help="run as a long-lived HTTP job service (see service.py); always incremental")
+    parser.add_argument("--workers", type=int, default=DEFAULT_LLM_WORKERS,
+                        help=f"number of concurrent LLM queries (default {DEFAULT_LLM_WORKERS})")
+    parser.add_argument("--fetch-workers", type=int, default=DEFAULT_FETCH_WORKERS,
+                        help=f"number of concurrent JIRA fetches (default {DEFAULT_FETCH_WORKERS})")
+    parser.add_argument("--export-workers", type=int, default=DEFAULT_EXPORT_WORKERS,
+                        help=f"number of concurrent Excel builds (default {DEFAULT_EXPORT_WORKERS})")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only query the LLM for tickets that changed since their test cases were last generated")
+    parser.add_argument("--resume", nargs="?", const=RESUME_LAST, metavar="RUN_ID",
+                        help="resume an interrupted batch run, by default the last one, with the same tickets: "
+                             "each ticket carries on after the last stage it completed (see JOB_JOURNAL_PATH)")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream the LLM response and build the Excel file as each test case arrives")
+    parser.add_argument("--output-dir", help="directory for the output files (created if missing)")
+    parser.add_argument("--export", type=parse_export_formats, default=("excel",),
+                        help=f"comma-separated export backends: {', '.join(EXPORT_FORMATS)} (default excel); "
+                             f"'workbook' writes one Excel file for the whole run")
+    parser.add_argument("--report", metavar="FILE",
+                        help="write the run report of stage timings, tokens and cost (JSON, or Prometheus text for .prom)")
+    parser.add_argument("--no-json-artifact", action="store_true",
+                        help="do not write the <ticket>_test_case_steps.json files (not with --incremental, "
+                             "which reuses them)")
+    parser.add_argument("--structured-output", choices=RESPONSE_FORMATS,
+                        help="request JSON output from the LLM with response_format (json_schema needs model support)")
+    parser.add_argument("--hedge", action="store_true",
+                        help="send an LLM request that is slower than usual to a second deployment as well and "
+                             "use the first answer (see AI_DEPLOYMENTS); cuts the tail latency of interactive runs")
+    parser.add_argument("--dedup", action="store_true",
+                        help="reuse the test cases of a near-duplicate ticket instead of querying the LLM, and leave "
+                             "out test cases already exported for the EPIC (same as --set DEDUP_ENABLED=true)")
+    parser.add_argument("--processes", type=int, metavar="N",
+                        help="build the workbooks on N worker processes, for large batches on a machine with "
+                             "spare cores (same as --set POSTPROCESS_PROCESSES=N)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="bypass the LLM response cache and always query the LLM")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="empty the LLM response cache before running")
+    parser.add_argument("--env-file", metavar="FILE",
+                        help="file with the settings as NAME=VALUE lines (default SNR_Azure_OpenAI_Key.txt "
+                             "next to app.py); environment variables take precedence")
+    parser.add_argument("--set", metavar="NAME=VALUE", type=parse_setting, action="append", default=[],
+                        dest="settings", help="override a setting for this run, e.g. --set AI_PARSE_RETRIES=2 "
+                                              "(can be repeated; takes precedence over the environment)")
+    return parser
+
 
-    # Create a new string variable for the test cases file name
-    #test_cases_file_name = JIRA_TICKET + sFile_TC_suffix
 
-    # Retrieve test cases from the file specified by the new variable
 
-    # Build an XL from these test cases to use in Zephyr Squad Internal Import utility
+
+
+if __name__ == "__main__":
 
     # JIRA: INVHUb-11696
     # EPIC_LINK: INVHUB-10821
-   
-    if len(sys.argv) != 3:
+
+    parser = build_arg_parser()
+    args = parser.parse_args()
+
+    # Before anything reads a setting
+    if args.env_file:
+        config.use_env_file(args.env_file)
+    if args.settings:
+        config.override(**dict(args.settings))
+    if args.dedup:
+        config.override(DEDUP_ENABLED="true")
+    if args.processes is not None:
+        config.override(POSTPROCESS_PROCESSES=str(args.processes))
+
+    if args.clear_cache:
+        response_cache.clear()
+        logging.info("LLM response cache cleared")
+    if args.no_cache:
+        response_cache.enabled = False
+    if args.no_json_artifact:
+        if args.incremental:
+            logging.warning("--no-json-artifact ignored: incremental mode reuses the JSON files of test cases")
+        else:
+            json_artifacts.enabled = False
+    if args.structured_output:
+        set_response_format(args.structured_output)
+    if args.hedge:
+        set_hedging(True)
+
+    if args.serve:
+        serve_main(args)
+    elif args.batch or args.jql:
+        batch_main(args)
+    elif args.jira_ticket is None or args.epic_link is None:
         print("Usage: python app.py <JIRA_TICKET> <EPIC_LINK>")
     else:
         # The user specifies the JIRA ticket from which to generate test cases
         # The EPIC ticket to be linked is also specified - this is an IH requirement
-        JIRA_TICKET = sys.argv[1]
-        EPIC_LINK = sys.argv[2]
-        main(JIRA_TICKET, EPIC_LINK)
\ No newline at end of file
+        main(args.jira_ticket, args.epic_link, args.incremental, args.stream, args.output_dir, args.export,
+             args.report)
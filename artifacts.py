@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+"""
+    Background writer for the <ticket>_test_case_steps.json artifacts.
+
+    The parsed test cases are handed to the export stage in memory; the JSON file is only a
+    record of the LLM output for people to read, and for incremental runs to reuse. Writing it
+    is therefore taken off the ticket's critical path: files are written by one background
+    thread, each to a temporary file that is renamed into place once complete, so a reader
+    never sees a half-written file and a failed run never leaves a partial one behind.
+"""
+
+
+class JsonArtifactWriter:
+    """
+    Write JSON files in the background. When disabled, nothing is written.
+    on_written callbacks run on the writer thread once a file is complete.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.written = 0
+        self.failed = 0
+        self._executor = None
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def write(self, file_name, data, on_written=None):
+        """
+        Queue data to be written to file_name. Returns the file name, or None when disabled.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="json-artifacts")
+            # Only the files still being written are kept, so a long-running service does not
+            # hold on to every file it has written
+            self._pending = [future for future in self._pending if not self._finished(future)]
+            self._pending.append(self._executor.submit(self._write, file_name, data, on_written))
+        return file_name
+
+    @staticmethod
+    def _finished(future):
+        if not future.done():
+            return False
+        if future.exception() is not None:
+            logging.error(f"Error in JSON artifact writer: {future.exception()}")
+        return True
+
+    def _write(self, file_name, data, on_written):
+        temp_file = f"{file_name}.tmp"
+        try:
+            with open(temp_file, 'w') as json_file:
+                json.dump(data, json_file, indent=4)
+            os.replace(temp_file, file_name)
+        except (IOError, TypeError, ValueError) as e:
+            self.failed += 1
+            logging.error(f"Stage 4b - Failed to write JSON output to {file_name}: {e}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            return
+        self.written += 1
+        logging.info(f"Stage 4b - JSON output successfully written to {file_name}")
+        if on_written is not None:
+            on_written(file_name)
+
+    def flush(self):
+        """
+        Wait until every queued file has been written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Error in JSON artifact writer: {e}")
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
@@ -0,0 +1,682 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+
+"""
+    Offline benchmarks for the performance-sensitive parts of the tool.
+
+    Each scenario builds its own synthetic input and returns a list of result rows. No JIRA or
+    Azure OpenAI access is needed: the end-to-end scenarios run against the local fake services
+    in fakeservers.py, which are started before the tool's modules are imported and whose
+    latency and throttling each scenario sets. Run all scenarios, or name the ones to run:
+
+        python benchmark.py
+        python benchmark.py filter --repeat 10 --output bench_results.json
+        python benchmark.py single batch --output after.json --compare before.json
+
+    The results are saved together with the git commit they were measured on, and --compare
+    prints the change against a results file from another commit.
+"""
+
+
+# Registered scenarios by name, in the order they were defined
+SCENARIOS = {}
+
+
+def scenario(name):
+    """
+    Register a benchmark scenario. The function receives the parsed command line arguments.
+    """
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+# The fake JIRA and chat completions services shared by the end-to-end scenarios
+_fakes = None
+
+
+def start_fake_services():
+    """
+    Start the fake JIRA and chat completions services once, and point the tool at them.
+    This must run before the tool first reads its settings (see openaienvvars.py).
+    """
+    global _fakes
+    if _fakes is not None:
+        return _fakes
+
+    from fakeservers import FakeJira, FakeChatCompletions, make_jira_issue
+
+    jira = FakeJira([make_jira_issue(f"BENCH-{n}", comments=20, words_per_body=100) for n in range(1, 201)])
+    llm = FakeChatCompletions()
+    jira.start()
+    llm.start()
+
+    state_dir = tempfile.mkdtemp(prefix="benchmark-")
+    os.environ.update({
+        "JIRA_BASE_URL": jira.base_url,
+        "AZURE_OPENAI_BASE_PATH": llm.base_url + "/openai/deployments",
+        "LLM_CACHE_ENABLED": "false",
+        "LLM_CACHE_PATH": os.path.join(state_dir, "llm_cache.sqlite"),
+        "TICKET_STATE_PATH": os.path.join(state_dir, "ticket_state.sqlite"),
+        "JOB_JOURNAL_PATH": os.path.join(state_dir, "job_journal.sqlite"),
+        # Enough connections for the largest batch concurrency
+        "HTTP_POOL_SIZE": "16",
+    })
+    for name in ("AI_API_TOKEN", "AZURE_OPENAI_API_EMBEDDINGS_DEPLOYMENT_NAME", "AZURE_OPENAI_API_VERSION"):
+        os.environ.setdefault(name, "benchmark")
+    _fakes = {"jira": jira, "llm": llm, "state_dir": state_dir}
+    return _fakes
+
+
+def set_service_conditions(jira_latency=0.0, llm_latency=0.0, tokens_per_second=0.0, throttle_rate=0.0):
+    """
+    Set the latency, LLM generation speed and share of throttled (429) requests of the fakes.
+    Streamed answers are paced to the same generation speed.
+    """
+    fakes = start_fake_services()
+    fakes["jira"].latency = jira_latency
+    fakes["llm"].latency = llm_latency
+    fakes["llm"].tokens_per_second = tokens_per_second
+    fakes["llm"].chunk_delay = fakes["llm"].chunk_chars / 4 / tokens_per_second if tokens_per_second else 0.0
+    for fake in (fakes["jira"], fakes["llm"]):
+        fake.throttle_rate = throttle_rate
+        fake.reset_counts()
+    return fakes
+
+
+def time_call(func, repeat):
+    """
+    Call func repeat times and return (best, median) wall time in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), statistics.median(timings)
+
+
+def peak_memory(func):
+    """
+    Return the peak memory in bytes allocated by Python while func runs.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@scenario("filter")
+def bench_filter(args):
+    """
+    Whitelist filtering of large synthetic JIRA responses: the recursive filter_dict on the
+    parsed response, the compiled iterative projector on the parsed response, and the
+    projection of the raw response bytes (streaming when ijson is installed).
+    Timings include parsing the raw response, as in a real fetch.
+    """
+    from app import WHITELIST
+    from fakeservers import make_jira_issue
+    from jiraextraction import filter_dict, compile_whitelist, project_dict, project_json, load_ijson
+
+    cases = [
+        ("10 comments", dict(comments=10, words_per_body=50)),
+        ("1000 comments", dict(comments=1000, words_per_body=200)),
+        ("5000 comments + changelog", dict(comments=5000, words_per_body=200, changelog=2000)),
+    ]
+    plan = compile_whitelist(WHITELIST)
+    stream_name = "project_json (ijson)" if load_ijson() is not None else "project_json (json fallback)"
+
+    rows = []
+    for case, params in cases:
+        raw = json.dumps(make_jira_issue("BENCH-1", **params)).encode("utf-8")
+        impls = [
+            ("filter_dict", lambda: filter_dict(json.loads(raw), WHITELIST)),
+            ("project_dict", lambda: project_dict(json.loads(raw), plan)),
+            (stream_name, lambda: project_json(raw, plan)),
+        ]
+        for impl, func in impls:
+            best, median = time_call(func, args.repeat)
+            rows.append({"scenario": "filter", "case": case, "impl": impl,
+                         "payload_kb": round(len(raw) / 1024, 1),
+                         "best_ms": round(best * 1000, 2), "median_ms": round(median * 1000, 2),
+                         "peak_mb": round(peak_memory(func) / 1024 ** 2, 2)})
+    return rows
+
+
+@scenario("export")
+def bench_export(args):
+    """
+    Zephyr Excel export of growing numbers of test case steps: the in-memory openpyxl workbook
+    against the write-only workbook used by ZephyrExcelBuilder. The write-only workbook only
+    keeps the workbook's shared strings in memory, so its peak grows far more slowly.
+    Timings include saving the workbook.
+    """
+    import os
+    import tempfile
+    from ZephyrImport import ZephyrExcelBuilder
+
+    def make_test_cases(steps, steps_per_case=50):
+        return [{"id": f"TC-{n}", "summary": f"Test case {n}", "preconditions": "Logged in",
+                 "postconditions": "Logged out",
+                 "steps": [{"step": f"Step {s} of test case {n}", "expectedResult": f"Result {s}"}
+                           for s in range(1, steps_per_case + 1)]}
+                for n in range(steps // steps_per_case)]
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = os.path.join(tmp, "bench.xlsx")
+        for steps in (1000, 5000, 20000):
+            test_cases = make_test_cases(steps)
+            for impl, write_only in (("in-memory", False), ("write-only", True)):
+                def export():
+                    builder = ZephyrExcelBuilder("BENCH-0", write_only=write_only)
+                    for test_case in test_cases:
+                        builder.add_test_case(test_case)
+                    builder.save(output_file)
+                best, median = time_call(export, min(args.repeat, 2))
+                rows.append({"scenario": "export", "case": f"{steps} steps", "impl": impl,
+                             "best_ms": round(best * 1000, 2), "median_ms": round(median * 1000, 2),
+                             "peak_mb": round(peak_memory(export) / 1024 ** 2, 2),
+                             "file_kb": round(os.path.getsize(output_file) / 1024, 1)})
+    return rows
+
+
+# Simulated service conditions for the end-to-end scenarios. The LLM is much faster than a real
+# deployment so that the scenarios finish quickly, but still dominates the time of a ticket.
+SERVICE_CONDITIONS = {
+    "no latency": dict(),
+    "typical": dict(jira_latency=0.05, llm_latency=0.3, tokens_per_second=2000),
+}
+
+
+@scenario("startup")
+def bench_startup(args):
+    """
+    Start-up time of the tool in a fresh interpreter: importing app.py, and the whole of
+    'app.py --help', against a bare interpreter start. Heavy imports (requests, openpyxl,
+    tiktoken) are deferred until first use, so these should stay within tens of milliseconds.
+    """
+    import sys
+    here = os.path.dirname(os.path.abspath(__file__))
+    commands = {
+        "python": [sys.executable, "-c", "pass"],
+        "import app": [sys.executable, "-c", "import app"],
+        "app.py --help": [sys.executable, os.path.join(here, "app.py"), "--help"],
+    }
+    rows = []
+    for impl, command in commands.items():
+        # From another directory, as the tool no longer depends on being started from its own
+        best, median = time_call(lambda: subprocess.run(command, cwd=tempfile.gettempdir(), check=True,
+                                                        env=dict(os.environ, PYTHONPATH=here),
+                                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL),
+                                 max(args.repeat, 5))
+        rows.append({"scenario": "startup", "case": "cold process", "impl": impl,
+                     "best_ms": round(best * 1000, 2), "median_ms": round(median * 1000, 2)})
+    return rows
+
+
+@scenario("single")
+def bench_single(args):
+    """
+    Single-ticket latency end to end against the fakes: JIRA fetch, prompt build, LLM query,
+    parsing and Excel export, without and with streaming. Streaming rows also show the time to
+    the first test case.
+    """
+    start_fake_services()
+    import app
+    from exporters import create_exporters
+    from instrumentation import RunMetrics
+
+    app.response_cache.enabled = False
+    app.json_artifacts.enabled = False
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for case, conditions in SERVICE_CONDITIONS.items():
+            set_service_conditions(**conditions)
+            for impl, stream in (("blocking", False), ("stream", True)):
+                app.run_metrics = RunMetrics()
+                exporters = create_exporters(("excel",), tmp, "bench")
+                best, median = time_call(lambda: app.process_ticket("BENCH-1", "BENCH-0", exporters, stream=stream),
+                                         args.repeat)
+                row = {"scenario": "single", "case": case, "impl": impl,
+                       "best_ms": round(best * 1000, 2), "median_ms": round(median * 1000, 2)}
+                first = app.run_metrics.report(0)["stages"].get("first_test_case")
+                if first:
+                    row["first_test_case_ms"] = round(first["p50_seconds"] * 1000, 2)
+                rows.append(row)
+    return rows
+
+
+@scenario("batch")
+def bench_batch(args):
+    """
+    Batch throughput against the fakes at several LLM concurrencies, under typical latency and
+    with 10% of the requests throttled (429 with a Retry-After of 1s).
+    """
+    start_fake_services()
+    import app
+
+    app.response_cache.enabled = False
+    app.json_artifacts.enabled = False
+
+    tickets = [(f"BENCH-{n}", "BENCH-0") for n in range(1, args.batch_tickets + 1)]
+    cases = [("typical", SERVICE_CONDITIONS["typical"])]
+    cases.append(("typical, 10% throttled", dict(SERVICE_CONDITIONS["typical"], throttle_rate=0.1)))
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for case, conditions in cases:
+            for workers in (1, 4, 8, 16):
+                fakes = set_service_conditions(**conditions)
+                start = time.perf_counter()
+                results = app.run_batch(tickets, llm_workers=workers, fetch_workers=max(2, workers // 4),
+                                        output_dir=tmp, run_id="bench")
+                elapsed = time.perf_counter() - start
+                rows.append({"scenario": "batch", "case": case, "impl": f"{workers} workers",
+                             "tickets": len(tickets),
+                             "failed": sum(1 for r in results if r["status"] != "ok"),
+                             "elapsed_s": round(elapsed, 2),
+                             "tickets_per_s": round(len(tickets) / elapsed, 2),
+                             "throttled": fakes["jira"].throttled_count + fakes["llm"].throttled_count})
+    return rows
+
+
+@scenario("ratelimit")
+def bench_ratelimit(args):
+    """
+    Batch throughput at 16 LLM workers against a fake deployment with a tokens quota, as a real
+    Azure OpenAI deployment has: without client side limiting (throttled requests only wait out
+    their Retry-After), with the adaptive concurrency limiter, and with the limiter and the
+    deployment's TPM configured. The quota is counted over a short window instead of a minute,
+    and sized for about 5 tickets per window, so that it binds within the run.
+    """
+    start_fake_services()
+    import app
+    import queryLLM
+    from ratelimit import AdaptiveRateLimiter
+
+    app.response_cache.enabled = False
+    app.json_artifacts.enabled = False
+
+    window = 2.0
+    quota = 23000
+    tickets = [(f"BENCH-{n}", "BENCH-0") for n in range(1, args.batch_tickets + 1)]
+    limiters = {
+        "retry only": lambda: AdaptiveRateLimiter(max_concurrency=16, adaptive=False, period=window),
+        "adaptive": lambda: AdaptiveRateLimiter(max_concurrency=16, period=window),
+        "adaptive + TPM": lambda: AdaptiveRateLimiter(tokens_per_minute=quota, max_concurrency=16, period=window),
+    }
+
+    rows = []
+    deployment = queryLLM.ai_router.deployments[0]
+    saved_limiter = deployment.limiter
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for impl, make_limiter in limiters.items():
+                fakes = set_service_conditions(**SERVICE_CONDITIONS["typical"])
+                fakes["llm"].tokens_per_minute = quota
+                fakes["llm"].quota_window = window
+                deployment.limiter = make_limiter()
+                start = time.perf_counter()
+                results = app.run_batch(tickets, llm_workers=16, fetch_workers=4, output_dir=tmp, run_id="bench")
+                elapsed = time.perf_counter() - start
+                rows.append({"scenario": "ratelimit", "case": f"{quota} tokens per {window:.0f}s", "impl": impl,
+                             "tickets": len(tickets),
+                             "failed": sum(1 for r in results if r["status"] != "ok"),
+                             "elapsed_s": round(elapsed, 2),
+                             "tickets_per_s": round(len(tickets) / elapsed, 2),
+                             "throttled": fakes["llm"].throttled_count})
+    finally:
+        deployment.limiter = saved_limiter
+        fakes = start_fake_services()
+        fakes["llm"].tokens_per_minute = 0
+    return rows
+
+
+@scenario("hedge")
+def bench_hedge(args):
+    """
+    Single-ticket latency (p50, p95, p99, max over --hedge-tickets sequential tickets) when 3% of the
+    LLM requests take 10 times as long: with one deployment, with two, and with two and hedged
+    requests, where a request slower than the p95 of its deployment is also sent to the other.
+    """
+    fakes = start_fake_services()
+    import app
+    import queryLLM
+    from exporters import create_exporters
+    from fakeservers import FakeChatCompletions
+    from instrumentation import RunMetrics, percentile
+    from llmrouter import Deployment
+
+    app.response_cache.enabled = False
+    app.json_artifacts.enabled = False
+
+    second = FakeChatCompletions()
+    second.seed = 1
+    second.start()
+    llms = [fakes["llm"], second]
+    llm_latency = SERVICE_CONDITIONS["typical"]["llm_latency"]
+
+    def deployment(n):
+        return Deployment(f"region-{n + 1}", llms[n].base_url + "/openai/deployments", "benchmark", "benchmark",
+                          "benchmark")
+
+    cases = {"1 deployment": (1, False), "2 deployments": (2, False), "2 deployments, hedged": (2, True)}
+    router = queryLLM.ai_router
+    saved_deployments, saved_delay = router.deployments, router.hedge_delay
+    # Until a deployment's own p95 is known, as AI_HEDGE_DELAY would be set for a deployment
+    # whose usual latency is known
+    router.hedge_delay = 1.0
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for impl, (count, hedge) in cases.items():
+                set_service_conditions(**SERVICE_CONDITIONS["typical"])
+                for llm in llms:
+                    llm.latency = llm_latency
+                    llm.tokens_per_second = SERVICE_CONDITIONS["typical"]["tokens_per_second"]
+                    llm.slow_rate = 0.03
+                    llm.slow_latency = llm_latency * 10
+                    llm.reset_counts()
+                router.deployments = [deployment(n) for n in range(count)]
+                queryLLM.set_hedging(hedge)
+                hedged = router.hedged
+                exporters = create_exporters(("excel",), tmp, "bench")
+
+                timings = []
+                for n in range(1, args.hedge_tickets + 1):
+                    app.run_metrics = RunMetrics()
+                    start = time.perf_counter()
+                    app.process_ticket(f"BENCH-{n}", "BENCH-0", exporters)
+                    timings.append(time.perf_counter() - start)
+                rows.append({"scenario": "hedge", "case": "3% of LLM requests 10x slower", "impl": impl,
+                             "tickets": len(timings),
+                             "p50_ms": round(percentile(timings, 50) * 1000, 2),
+                             "p95_ms": round(percentile(timings, 95) * 1000, 2),
+                             "p99_ms": round(percentile(timings, 99) * 1000, 2),
+                             "max_ms": round(max(timings) * 1000, 2),
+                             "hedged": router.hedged - hedged})
+    finally:
+        router.deployments, router.hedge_delay = saved_deployments, saved_delay
+        queryLLM.set_hedging(None)
+        second.stop()
+        fakes["llm"].slow_rate = 0.0
+    return rows
+
+
+@scenario("dedup")
+def bench_dedup(args):
+    """
+    Batch of --batch-tickets tickets of one EPIC where every fourth ticket is a clone of the one
+    before, and the generated test cases of all tickets overlap as they do within an epic: LLM
+    requests, exported test cases and elapsed time without and with near-duplicate detection.
+    """
+    fakes = start_fake_services()
+    import app
+    from dedup import NearDuplicateTickets
+    from fakeservers import make_jira_issue
+    from openaienvvars import config
+
+    app.response_cache.enabled = False
+    app.json_artifacts.enabled = False
+
+    tickets = []
+    for n in range(1, args.batch_tickets + 1):
+        key = f"DEDUP-{n}"
+        variant = n - 1 if n % 4 == 0 else n
+        fakes["jira"].issues[key] = make_jira_issue(key, comments=20, words_per_body=100, variant=variant)
+        tickets.append((key, "DEDUP-0"))
+
+    saved_override = config.overrides.get("DEDUP_ENABLED")
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for impl, enabled in (("off", "false"), ("on", "true")):
+                config.override(DEDUP_ENABLED=enabled)
+                app.ticket_index = NearDuplicateTickets(config.DEDUP_TICKET_THRESHOLD)
+                fakes = set_service_conditions(**SERVICE_CONDITIONS["typical"])
+                fakes["llm"].vary_content = True
+                output_dir = os.path.join(tmp, impl)
+                start = time.perf_counter()
+                results = app.run_batch(tickets, llm_workers=8, fetch_workers=2, output_dir=output_dir,
+                                        run_id="bench", export_formats=("jsonl",))
+                elapsed = time.perf_counter() - start
+                exported = 0
+                for name in os.listdir(output_dir):
+                    if name.endswith(".jsonl"):
+                        with open(os.path.join(output_dir, name), encoding="utf-8") as f:
+                            exported += sum(1 for _ in f)
+                rows.append({"scenario": "dedup", "case": "25% cloned tickets", "impl": impl,
+                             "tickets": len(tickets),
+                             "failed": sum(1 for r in results if r["status"] != "ok"),
+                             "llm_requests": fakes["llm"].request_count,
+                             "test_cases": exported,
+                             "elapsed_s": round(elapsed, 2)})
+    finally:
+        if saved_override is None:
+            config.overrides.pop("DEDUP_ENABLED", None)
+            config.override()
+        else:
+            config.override(DEDUP_ENABLED=saved_override)
+        fakes["llm"].vary_content = False
+        for key, _ in tickets:
+            fakes["jira"].issues.pop(key, None)
+    return rows
+
+
+@scenario("resume")
+def bench_resume(args):
+    """
+    A batch run interrupted after half of its tickets (the ticket source fails part way, as a
+    JQL search can), then completed by running it again from the start, or by resuming it from
+    the job journal: LLM requests and elapsed time of the second run.
+    """
+    start_fake_services()
+    import app
+
+    app.response_cache.enabled = False
+    app.json_artifacts.enabled = False
+
+    tickets = [(f"BENCH-{n}", "BENCH-0") for n in range(1, args.batch_tickets + 1)]
+
+    def interrupted(tickets):
+        yield from tickets[:len(tickets) // 2]
+        raise RuntimeError("ticket source failed")
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        set_service_conditions(**SERVICE_CONDITIONS["typical"])
+        try:
+            app.run_batch(interrupted(tickets), llm_workers=8, fetch_workers=2, output_dir=tmp,
+                          run_id="bench-interrupted")
+        except RuntimeError:
+            pass
+        for impl, run_id, resume in (("restart", "bench-restart", False), ("resume", "bench-interrupted", True)):
+            fakes = set_service_conditions(**SERVICE_CONDITIONS["typical"])
+            start = time.perf_counter()
+            results = app.run_batch(tickets, llm_workers=8, fetch_workers=2, output_dir=tmp, run_id=run_id,
+                                    resume=resume)
+            elapsed = time.perf_counter() - start
+            rows.append({"scenario": "resume", "case": "interrupted after 50%", "impl": impl,
+                         "tickets": len(tickets),
+                         "failed": sum(1 for r in results if r["status"] != "ok"),
+                         "llm_requests": fakes["llm"].request_count,
+                         "jira_requests": fakes["jira"].request_count,
+                         "elapsed_s": round(elapsed, 2)})
+    return rows
+
+
+@scenario("processes")
+def bench_processes(args):
+    """
+    Batch of --batch-tickets tickets with large LLM answers (40 test cases of 10 steps) and no
+    service latency, so that building the per-ticket workbooks is the bottleneck: in the threads
+    of the run, and on 1, 2, 4... post-processing processes up to the number of cores. The
+    speedup is against the threads alone; on a single core the processes only add overhead.
+    (A run workbook is built by one process per part of MAX_ROWS_PER_WORKBOOK rows, so it only
+    scales across parts.)
+    """
+    fakes = start_fake_services()
+    import app
+    from procpool import process_pool
+
+    app.response_cache.enabled = False
+    app.json_artifacts.enabled = False
+
+    words = " ".join(f"word{n}" for n in range(30))
+    answer = {"testCases": [{"id": f"TC-{n}", "summary": f"Test case {n} {words}", "preconditions": words,
+                             "postconditions": words,
+                             "steps": [{"step": f"Step {s} {words}", "expectedResult": f"Result {s} {words}"}
+                                       for s in range(1, 11)]}
+                            for n in range(1, 41)]}
+    tickets = [(f"BENCH-{n}", "BENCH-0") for n in range(1, args.batch_tickets + 1)]
+    cores = os.cpu_count() or 1
+    counts = [0] + [n for n in (1, 2, 4, 8, 16) if n <= max(2, cores)]
+
+    saved_content, saved_processes = fakes["llm"].content, process_pool.processes
+    fakes["llm"].content = "```json\n" + json.dumps(answer) + "\n```"
+    rows = []
+    baseline = None
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for processes in counts:
+                set_service_conditions()
+                process_pool.processes = processes
+                start = time.perf_counter()
+                results = app.run_batch(tickets, llm_workers=max(4, processes), fetch_workers=2, output_dir=tmp,
+                                        run_id="bench")
+                elapsed = time.perf_counter() - start
+                baseline = baseline or elapsed
+                rows.append({"scenario": "processes", "case": f"{len(answer['testCases'])} test cases per ticket, "
+                                                             f"{cores} cores",
+                             "impl": f"{processes} processes" if processes else "threads",
+                             "tickets": len(tickets),
+                             "failed": sum(1 for r in results if r["status"] != "ok"),
+                             "elapsed_s": round(elapsed, 2),
+                             "tickets_per_s": round(len(tickets) / elapsed, 2),
+                             "speedup": round(baseline / elapsed, 2)})
+    finally:
+        fakes["llm"].content = saved_content
+        process_pool.close()
+        process_pool.processes = saved_processes
+    return rows
+
+
+def run_metadata():
+    """
+    Describe what the results were measured on, so that results from different commits can be compared.
+    """
+    def git(*git_args):
+        try:
+            return subprocess.run(["git", *git_args], capture_output=True, text=True, check=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {"commit": git("rev-parse", "--short", "HEAD"),
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform()}
+
+
+# Result columns where a lower value is better; for the others (throughput) higher is better
+LOWER_IS_BETTER = ("best_ms", "median_ms", "peak_mb", "first_test_case_ms", "elapsed_s")
+
+
+def compare_rows(rows, baseline_file):
+    """
+    Print the change of each measurement against the same scenario, case and implementation in
+    an earlier results file.
+    """
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)
+    # Results files written before run metadata was recorded are a plain list of rows
+    baseline_rows = baseline["rows"] if isinstance(baseline, dict) else baseline
+    commit = baseline.get("meta", {}).get("commit") if isinstance(baseline, dict) else None
+
+    def key(row):
+        return row["scenario"], row.get("case"), row.get("impl")
+
+    previous = {key(row): row for row in baseline_rows}
+    print(f"\nChange against {baseline_file}" + (f" (commit {commit})" if commit else ""))
+    for row in rows:
+        before = previous.get(key(row))
+        if before is None:
+            continue
+        changes = []
+        for column, value in row.items():
+            old = before.get(column)
+            if column in ("tickets", "failed", "throttled") or not isinstance(value, (int, float)) \
+                    or not isinstance(old, (int, float)) or not old:
+                continue
+            change = (value - old) / old * 100
+            better = change < 0 if column in LOWER_IS_BETTER else change > 0
+            changes.append(f"{column} {old} -> {value} ({change:+.1f}%{'' if abs(change) < 5 else ', better' if better else ', worse'})")
+        if changes:
+            print(f"  {' / '.join(str(k) for k in key(row))}: {'; '.join(changes)}")
+
+
+def print_rows(rows):
+    """
+    Print result rows as an aligned table, one table per scenario.
+    """
+    by_scenario = {}
+    for row in rows:
+        by_scenario.setdefault(row["scenario"], []).append(row)
+
+    for name, scenario_rows in by_scenario.items():
+        columns = [c for c in scenario_rows[0] if c != "scenario"]
+        widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in scenario_rows)) for c in columns}
+        print(f"\n[{name}]")
+        print("  ".join(c.ljust(widths[c]) for c in columns))
+        for row in scenario_rows:
+            print("  ".join(str(row.get(c, "")).ljust(widths[c]) for c in columns))
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks.")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run (default all): {', '.join(SCENARIOS)}")
+    parser.add_argument("--repeat", type=int, default=5, help="timed repetitions per measurement")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results with an earlier results file")
+    parser.add_argument("--batch-tickets", type=int, default=40, help="tickets per run in the batch scenario")
+    parser.add_argument("--hedge-tickets", type=int, default=100, help="tickets timed in the hedge scenario")
+    return parser
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = build_arg_parser().parse_args()
+
+    # Before any scenario imports the tool, so that it talks to the fakes
+    start_fake_services()
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        print(f"Unknown scenario(s): {', '.join(unknown)}. Available: {', '.join(SCENARIOS)}")
+        raise SystemExit(2)
+
+    rows = []
+    for name in args.scenarios or SCENARIOS:
+        rows.extend(SCENARIOS[name](args))
+
+    print_rows(rows)
+    if args.compare:
+        compare_rows(rows, args.compare)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"meta": run_metadata(), "rows": rows}, f, indent=4)
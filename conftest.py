@@ -0,0 +1,53 @@
+import pytest
+
+
+# Import OpenAI Environment Variables
+from openaienvvars import config
+
+
+# Import the local fake JIRA and Azure OpenAI servers
+from fakeservers import FakeJira, FakeChatCompletions, make_jira_issue
+
+
+@pytest.fixture
+def settings():
+    """
+    Override settings for one test with settings(NAME="value"); the overrides in place before
+    the test are restored after it.
+    """
+    saved = dict(config.overrides)
+    yield config.override
+    config.overrides.clear()
+    config.override(**saved)
+
+
+@pytest.fixture
+def fake_jira(settings):
+    """
+    A local fake JIRA server with seven issues that returns at most three per search page.
+    """
+    from jiraextraction import jira_session
+    issues = [make_jira_issue(f"FAKE-{n}", comments=3) for n in range(1, 8)]
+    with FakeJira(issues, max_results=3) as jira:
+        settings(JIRA_BASE_URL=jira.base_url, JIRA_USER_NAME="tester", JIRA_API_TOKEN="token")
+        jira_session.close()
+        yield jira
+        jira_session.close()
+
+
+@pytest.fixture
+def fake_llm(settings, monkeypatch):
+    """
+    A local fake Azure OpenAI deployment streaming its canned answer in chunks of seven
+    characters, used by queryLLM through a router built for the test.
+    """
+    import queryLLM
+    from llmrouter import DeploymentRouter, load_deployments
+    with FakeChatCompletions(chunk_chars=7) as llm:
+        settings(AZURE_OPENAI_BASE_PATH=llm.base_url + "/openai/deployments", AI_API_TOKEN="token",
+                 AZURE_OPENAI_API_EMBEDDINGS_DEPLOYMENT_NAME="fake", AZURE_OPENAI_API_VERSION="2024-06-01",
+                 LLM_CACHE_ENABLED="false")
+        monkeypatch.setattr(queryLLM, "ai_router", DeploymentRouter(load_deployments(config)))
+        queryLLM.ai_session.close()
+        yield llm
+        queryLLM.ai_session.close()
@@ -0,0 +1,285 @@
+import collections
+import hashlib
+import logging
+import random
+import re
+import threading
+from concurrent.futures import Future
+
+
+# Import the pool of processes the test case signatures are computed on
+from procpool import process_pool
+
+
+"""
+    Near-duplicate detection for tickets and test cases, to save LLM calls and export size.
+
+    Epics often hold near-identical stories (cloned tickets, sub-tasks with the same description),
+    and the test cases generated for the tickets of an epic overlap. Texts are compared by the
+    Jaccard similarity of their sets of word 3-grams (shingles), estimated with MinHash
+    signatures, and looked up in a locality sensitive hashing (LSH) index so that a new text is
+    only compared with the few signatures that share a band with it:
+
+      - NearDuplicateTickets: a ticket whose filtered content is a near-duplicate of a ticket
+        generated before in this process reuses that generation, with the other ticket's key
+        replaced by its own, instead of querying the LLM. A generation still in progress is
+        waited for.
+      - TestCaseDeduplicator: before export, a test case that is a near-duplicate of one already
+        exported in the run for the same EPIC is dropped.
+"""
+
+
+SIGNATURE_SIZE = 64
+# The signature is split into BANDS bands of SIGNATURE_SIZE // BANDS rows; texts that agree on
+# a whole band are candidates. With 16 bands of 4 rows, texts 80% similar are candidates with a
+# probability of over 99.9%, texts 30% similar with about 12%.
+BANDS = 16
+SHINGLE_WORDS = 3
+
+# Fields that identify or date a ticket or test case rather than describe it
+IGNORED_FIELDS = frozenset(("key", "id", "self", "updated", "created", "displayName", "accountId"))
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_WORD = re.compile(r"\w+")
+
+# The same hash functions in every process, so that signatures can be compared between runs
+_random = random.Random(20240611)
+_PERMUTATIONS = [(_random.randrange(1, _MERSENNE_PRIME), _random.randrange(_MERSENNE_PRIME))
+                 for _ in range(SIGNATURE_SIZE)]
+
+
+def text_of(value, ignored=IGNORED_FIELDS):
+    """
+    Join the strings of a JSON value, e.g. a filtered ticket or a test case, leaving out the
+    ignored fields.
+    """
+    parts = []
+
+    def walk(item):
+        if isinstance(item, dict):
+            for k, v in item.items():
+                if k not in ignored:
+                    walk(v)
+        elif isinstance(item, list):
+            for v in item:
+                walk(v)
+        elif isinstance(item, str):
+            parts.append(item)
+
+    walk(value)
+    return "\n".join(parts)
+
+
+def shingles(text, size=SHINGLE_WORDS):
+    """
+    Return the set of 64-bit hashes of the word size-grams of text, case-insensitive.
+    A text shorter than size words is one shingle.
+    """
+    words = _WORD.findall(text.lower())
+    grams = (" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1)))
+    return {int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "little") for g in grams}
+
+
+def signature(text):
+    """
+    Return the MinHash signature of text: for each hash function, the least hash of its shingles.
+    """
+    hashes = shingles(text)
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(signature_a, signature_b):
+    """
+    Estimate the Jaccard similarity of two texts from their signatures.
+    """
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / len(signature_a)
+
+
+def ticket_key_pattern(jira_ticket):
+    """
+    Match a ticket key as a whole key: INVHUB-11 but not INVHUB-110 or XINVHUB-11.
+    """
+    return re.compile(rf"(?<![\w-]){re.escape(jira_ticket)}(?!\d)")
+
+
+def ticket_signature(jira_ticket, reduced_ticket):
+    """
+    Signature of a filtered ticket's content. Its own key is left out of the text, so that a
+    clone that mentions its key is still a near-duplicate of the original.
+    """
+    return signature(ticket_key_pattern(jira_ticket).sub("", text_of(reduced_ticket)))
+
+
+def test_case_signatures(test_cases):
+    """
+    Signatures of a ticket's test cases. Runs in the post-processing processes (procpool.py).
+    """
+    return [signature(text_of(test_case)) for test_case in test_cases]
+
+
+class SimilarityIndex:
+    """
+    LSH index of MinHash signatures by key, keeping up to max_entries (the oldest are dropped),
+    or every entry when max_entries is None. Not thread-safe: its users serialise the calls.
+    """
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.buckets = collections.defaultdict(set)
+
+    @staticmethod
+    def _bands(sig):
+        rows = len(sig) // BANDS
+        return [(band, sig[band * rows:(band + 1) * rows]) for band in range(BANDS)]
+
+    def add(self, key, sig, value=None):
+        self.remove(key)
+        self.entries[key] = (sig, value)
+        for band in self._bands(sig):
+            self.buckets[band].add(key)
+        while self.max_entries is not None and len(self.entries) > self.max_entries:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for band in self._bands(entry[0]):
+            bucket = self.buckets[band]
+            bucket.discard(key)
+            if not bucket:
+                del self.buckets[band]
+
+    def most_similar(self, sig, threshold, exclude=None):
+        """
+        Return (key, value, similarity) of the most similar entry at or above threshold, or None.
+        """
+        candidates = set()
+        for band in self._bands(sig):
+            candidates |= self.buckets.get(band, set())
+        candidates.discard(exclude)
+        best = None
+        for key in candidates:
+            entry_sig, value = self.entries[key]
+            score = similarity(sig, entry_sig)
+            if score >= threshold and (best is None or score > best[2]):
+                best = (key, value, score)
+        return best
+
+
+def adapt_generation(parsed, source_ticket, jira_ticket):
+    """
+    Return a copy of the parsed test cases generated for source_ticket with its key replaced by
+    jira_ticket's wherever it appears as a whole key in a string value.
+    """
+    pattern = ticket_key_pattern(source_ticket)
+
+    def adapt(value):
+        if isinstance(value, dict):
+            return {k: adapt(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [adapt(v) for v in value]
+        if isinstance(value, str):
+            return pattern.sub(lambda match: jira_ticket, value)
+        return value
+
+    return adapt(parsed)
+
+
+class NearDuplicateTickets:
+    """
+    The generations of the tickets of this process, by ticket signature. A ticket starting its
+    generation either finds a near-duplicate generation, finished or in progress, to wait for,
+    or is registered so that later near-duplicates can use its own. A ticket never matches
+    itself, so an edited ticket is generated again.
+    """
+    def __init__(self, threshold=0.9, max_entries=10000):
+        self.threshold = threshold
+        self.index = SimilarityIndex(max_entries)
+        self.reused = 0
+        self._lock = threading.Lock()
+
+    def begin(self, jira_ticket, sig):
+        """
+        Return (source_ticket, similarity, future) of a near-duplicate generation, whose future
+        gives the parsed test cases, or None for a failed generation. Returns None if there is
+        none; the ticket is then registered and must call finish() or fail().
+        """
+        with self._lock:
+            match = self.index.most_similar(sig, self.threshold, exclude=jira_ticket)
+            if match is not None:
+                source_ticket, future, score = match
+                return source_ticket, score, future
+            self.index.add(jira_ticket, sig, Future())
+            return None
+
+    def count_reuse(self):
+        with self._lock:
+            self.reused += 1
+
+    def _future(self, jira_ticket):
+        entry = self.index.entries.get(jira_ticket)
+        return entry[1] if entry is not None else None
+
+    def finish(self, jira_ticket, parsed):
+        with self._lock:
+            future = self._future(jira_ticket)
+        if future is not None and not future.done():
+            future.set_result(parsed)
+
+    def fail(self, jira_ticket):
+        """
+        Release the near-duplicates waiting for a failed generation, which then generate their own.
+        """
+        with self._lock:
+            future = self._future(jira_ticket)
+            self.index.remove(jira_ticket)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+
+class TestCaseDeduplicator:
+    """
+    Drop the test cases that are near-duplicates of a test case already kept in the run for the
+    same EPIC, by this or another ticket. One per run.
+    """
+    def __init__(self, threshold=0.85):
+        self.threshold = threshold
+        self.kept = 0
+        self.dropped = 0
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def collapse(self, jira_ticket, epic_link, test_cases):
+        """
+        Return the test cases of a ticket that are not near-duplicates of one kept before.
+        """
+        signatures = process_pool.run(test_case_signatures, test_cases)
+        kept = []
+        with self._lock:
+            index = self._indexes.setdefault(epic_link, SimilarityIndex(max_entries=None))
+            for n, (test_case, sig) in enumerate(zip(test_cases, signatures)):
+                match = index.most_similar(sig, self.threshold)
+                if match is not None:
+                    logging.debug(f"{jira_ticket} test case {n + 1} is a near-duplicate of {match[0]} "
+                                  f"({match[2]:.0%} similar)")
+                    continue
+                index.add((jira_ticket, n), sig)
+                kept.append(test_case)
+            self.kept += len(kept)
+            self.dropped += len(test_cases) - len(kept)
+        if len(kept) < len(test_cases):
+            logging.info(f"Stage 5a - {len(test_cases) - len(kept)} of {len(test_cases)} test cases of "
+                         f"{jira_ticket} collapsed as near-duplicates")
+        return kept
+
+
+def log_dedup_stats(tickets, test_cases=None):
+    """
+    Log how many LLM generations and test cases near-duplicate detection saved in the run.
+    """
+    if tickets.reused:
+        logging.info(f"Near-duplicate tickets: {tickets.reused} generations reused")
+    if test_cases is not None and test_cases.dropped:
+        logging.info(f"Near-duplicate test cases: {test_cases.dropped} of {test_cases.kept + test_cases.dropped} "
+                     f"collapsed before export")
@@ -0,0 +1,388 @@
+import collections
+import csv
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Import the Zephyr import format shared with the Excel export
+from ZephyrImport import (ZephyrWorkbookWriter, HEADERS, test_case_rows, build_workbook, DEFAULT_OUTPUT_FILE,
+                          ASSIGNED_TO, COMPONENT, LABELS, PRIORITY)
+
+
+# Import OpenAI Environment Variables
+from openaienvvars import config
+
+
+# Import the shared HTTP session support
+from httpclient import build_session, SharedSession, RateLimiter
+
+
+# Import the pool of processes the workbooks are built on
+from procpool import process_pool
+
+
+# Import the canonical hash that identifies a test case in the journal of uploads
+from ticketstate import content_hash
+
+
+"""
+    Export backends for the generated test cases.
+
+    Every backend takes the test cases of one ticket at a time through export() and returns
+    where they went; close() finishes the run and returns the files written. The backends are
+    selected by name with --export:
+
+        excel     - one Zephyr import workbook per ticket (the original output)
+        workbook  - one Zephyr import workbook for the whole run
+        csv       - one CSV file for the run with the same columns as the workbook
+        jsonl     - one JSON line per test case, cheap to produce and to diff between runs
+        zephyr    - create the tests directly through the JIRA and Zephyr APIs, no import needed
+
+    Backends shared by a batch run are called from several threads and lock their own state.
+"""
+
+
+EXPORT_FORMATS = ("excel", "workbook", "csv", "jsonl", "zephyr")
+
+
+class Exporter:
+    """
+    Base class of the export backends.
+    """
+    name = None
+    # Whether what export() did for a ticket lasts on its own, like a file per ticket or tests
+    # created in Zephyr, rather than going into a run-wide file written by close(). A resumed
+    # run does not export a ticket again to a per-ticket backend (see jobjournal.py).
+    per_ticket = False
+
+    def export(self, jira_ticket, epic_link, test_cases):
+        """
+        Export the test cases of one ticket and return where they went.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Finish the run and return the names of the files written.
+        """
+        return []
+
+
+class ExcelExporter(Exporter):
+    """
+    One Zephyr import workbook per ticket, named by output_file(jira_ticket), built on the
+    post-processing processes if there are any.
+    """
+    name = "excel"
+    per_ticket = True
+
+    def __init__(self, output_dir=None, file_name=None):
+        self.output_dir = output_dir
+        self.file_name = file_name
+
+    def output_file(self, jira_ticket):
+        file_name = self.file_name or f"{jira_ticket}_{DEFAULT_OUTPUT_FILE}"
+        if not self.output_dir:
+            return file_name
+        return os.path.join(self.output_dir, file_name)
+
+    def export(self, jira_ticket, epic_link, test_cases):
+        output_file = process_pool.run(build_workbook, self.output_file(jira_ticket), [(epic_link, test_cases)])
+        logging.info(f"Stage 5b - Excel file '{output_file}' created successfully.")
+        return output_file
+
+
+class WorkbookExporter(Exporter):
+    """
+    The test cases of every ticket in one Zephyr import workbook for the run (see ZephyrWorkbookWriter).
+    """
+    name = "workbook"
+
+    def __init__(self, output_file):
+        self.writer = ZephyrWorkbookWriter(output_file, pool=process_pool if process_pool.processes > 0 else None)
+
+    def export(self, jira_ticket, epic_link, test_cases):
+        return self.writer.add_ticket(jira_ticket, epic_link, test_cases)
+
+    def close(self):
+        return self.writer.close()
+
+
+class CsvExporter(Exporter):
+    """
+    One CSV file for the run, one row per test case step with the columns of the Zephyr workbook.
+    External ids run on across tickets.
+    """
+    name = "csv"
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self._file = None
+        self._writer = None
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def export(self, jira_ticket, epic_link, test_cases):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.output_file, 'w', newline='', encoding='utf-8')
+                self._writer = csv.writer(self._file)
+                self._writer.writerow(HEADERS)
+            for test_case in test_cases:
+                self._writer.writerows(test_case_rows(self._next_id, test_case, epic_link))
+                self._next_id += 1
+            self._file.flush()
+        return self.output_file
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return []
+            self._file.close()
+            self._file = None
+            logging.info(f"Stage 5b - CSV file '{self.output_file}' created successfully.")
+            return [self.output_file]
+
+
+class JsonlExporter(Exporter):
+    """
+    One JSON line per test case, tagged with its JIRA ticket and EPIC link.
+    """
+    name = "jsonl"
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, jira_ticket, epic_link, test_cases):
+        lines = [json.dumps({"ticket": jira_ticket, "epicLink": epic_link, **test_case}, ensure_ascii=False)
+                 for test_case in test_cases]
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.output_file, 'w', encoding='utf-8')
+            self._file.write("".join(line + "\n" for line in lines))
+            self._file.flush()
+        return self.output_file
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return []
+            self._file.close()
+            self._file = None
+            logging.info(f"Stage 5b - JSON lines file '{self.output_file}' created successfully.")
+            return [self.output_file]
+
+
+def _create_upload_jira_session():
+    """
+    JIRA session for creating issues. Only throttled (429) requests are retried: a create that
+    failed with a server error may still have been applied, and is not repeated blindly.
+    """
+    session = build_session(config.ZEPHYR_UPLOAD_WORKERS, (config.HTTP_CONNECT_TIMEOUT, config.JIRA_READ_TIMEOUT),
+                            config.HTTP_MAX_RETRIES, config.HTTP_BACKOFF_FACTOR, retry_methods=("POST",),
+                            retry_status_codes=(429,))
+    from requests.auth import HTTPBasicAuth
+    session.auth = HTTPBasicAuth(config.JIRA_USER_NAME, config.JIRA_API_TOKEN)
+    session.headers.update({"Accept": "application/json"})
+    return session
+
+
+def _create_zephyr_session():
+    session = build_session(config.ZEPHYR_UPLOAD_WORKERS, (config.HTTP_CONNECT_TIMEOUT, config.JIRA_READ_TIMEOUT),
+                            config.HTTP_MAX_RETRIES, config.HTTP_BACKOFF_FACTOR, retry_methods=("POST",),
+                            retry_status_codes=(429,))
+    session.headers.update({"Authorization": f"Bearer {config.ZEPHYR_API_TOKEN}", "Accept": "application/json"})
+    return session
+
+
+upload_jira_session = SharedSession("JIRA upload", _create_upload_jira_session)
+zephyr_session = SharedSession("Zephyr", _create_zephyr_session)
+
+
+def validate_Zephyr_env_vars():
+    """
+    Validate that the environment variables needed to upload to Zephyr are set
+    """
+    if config.ZEPHYR_API_TOKEN == "not_found":
+        logging.error("Zephyr API Token not set")
+        return False
+    return True
+
+
+class ZephyrApiExporter(Exporter):
+    """
+    Create the tests directly instead of going through the Internal Importer: the test issues of
+    a ticket are created with JIRA bulk create requests of up to ZEPHYR_CREATE_BATCH_SIZE issues,
+    then all the steps of each test are appended with one Zephyr request per test. The step
+    requests run concurrently on a pool of ZEPHYR_UPLOAD_WORKERS, and all requests together are
+    kept under ZEPHYR_REQUESTS_PER_SECOND.
+    With an upload_log (jobjournal.UploadLog) every test is recorded as soon as it is created
+    and again once its steps are added. A ticket exported again in a resumed run then only
+    creates the tests, and adds the steps, that are missing, instead of duplicating its tests.
+    The fields follow the mapping in zfj_import_config.json.
+    """
+    name = "zephyr"
+    per_ticket = True
+
+    def __init__(self, project_key=None, workers=None, requests_per_second=None, batch_size=None,
+                 upload_log=None):
+        self.upload_log = upload_log
+        self.project_key = project_key or config.ZEPHYR_PROJECT_KEY
+        self.batch_size = batch_size or config.ZEPHYR_CREATE_BATCH_SIZE
+        self.rate_limiter = RateLimiter(requests_per_second or config.ZEPHYR_REQUESTS_PER_SECOND)
+        self.executor = ThreadPoolExecutor(max_workers=workers or config.ZEPHYR_UPLOAD_WORKERS,
+                                           thread_name_prefix="zephyr-upload")
+        self.created = []
+
+    def issue_fields(self, jira_ticket, epic_link, test_case):
+        preconditions = test_case.get('preconditions', '')
+        postconditions = test_case.get('postconditions', '')
+        return {
+            "project": {"key": self.project_key},
+            "issuetype": {"name": config.ZEPHYR_TEST_ISSUE_TYPE},
+            "summary": test_case.get('summary') or f"{jira_ticket} {test_case.get('id', '')}".strip(),
+            "description": f"{preconditions}\n{postconditions}",
+            "assignee": {"accountId": ASSIGNED_TO},
+            "components": [{"name": COMPONENT}],
+            "labels": [LABELS],
+            "priority": {"name": PRIORITY},
+            "customfield_10014": epic_link,  # Epic Link
+        }
+
+    def _post(self, session, url, payload):
+        self.rate_limiter.acquire()
+        response = session.get().post(url, json=payload)
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+    def create_tests(self, jira_ticket, epic_link, test_cases, on_created=None):
+        """
+        Create the test issues in bulk and return their keys, None for a test that failed.
+        on_created(n, key) is called for each test created, as soon as its bulk request returns.
+        """
+        keys = []
+        for start in range(0, len(test_cases), self.batch_size):
+            batch = test_cases[start:start + self.batch_size]
+            payload = {"issueUpdates": [{"fields": self.issue_fields(jira_ticket, epic_link, test_case)}
+                                        for test_case in batch]}
+            result = self._post(upload_jira_session, config.JIRA_BULK_CREATE_ENDPOINT, payload)
+
+            # Created issues are listed in order, skipping the failed elements
+            failed = {error.get("failedElementNumber"): error for error in result.get("errors", [])}
+            created = iter(result.get("issues", []))
+            for n in range(len(batch)):
+                if n in failed:
+                    logging.error(f"Could not create test {start + n + 1} for {jira_ticket}: "
+                                  f"{failed[n].get('elementErrors')}")
+                    keys.append(None)
+                else:
+                    keys.append(next(created, {}).get("key"))
+                    if on_created is not None and keys[-1] is not None:
+                        on_created(start + n, keys[-1])
+        return keys
+
+    def add_steps(self, test_key, steps):
+        """
+        Append all steps of a test in one request.
+        """
+        items = [{"inline": {"description": step.get('step', ''), "testData": "",
+                             "expectedResult": step.get('expectedResult', '')}}
+                 for step in steps]
+        self._post(zephyr_session, f"{config.ZEPHYR_BASE_URL}/testcases/{test_key}/teststeps",
+                   {"mode": "APPEND", "items": items})
+
+    def _record(self, jira_ticket, test_case_id, key, steps_added):
+        if self.upload_log is not None:
+            self.upload_log.record(jira_ticket, test_case_id, key, steps_added)
+
+    def export(self, jira_ticket, epic_link, test_cases):
+        ids = test_case_ids(test_cases)
+        # Tests created for the ticket before the run was interrupted are not created again
+        uploaded = self.upload_log.created(jira_ticket) if self.upload_log is not None else {}
+        keys = [uploaded.get(test_case_id, (None, False))[0] for test_case_id in ids]
+        missing = [n for n, test_case_id in enumerate(ids) if test_case_id not in uploaded]
+
+        def on_created(m, key):
+            n = missing[m]
+            self._record(jira_ticket, ids[n], key, not test_cases[n].get('steps'))
+
+        new_keys = self.create_tests(jira_ticket, epic_link, [test_cases[n] for n in missing], on_created)
+        for n, key in zip(missing, new_keys):
+            keys[n] = key
+
+        def add_steps(n):
+            self.add_steps(keys[n], test_cases[n]['steps'])
+            self._record(jira_ticket, ids[n], keys[n], True)
+
+        uploads = [(keys[n], self.executor.submit(add_steps, n)) for n, test_case in enumerate(test_cases)
+                   if keys[n] is not None and test_case.get('steps') and not uploaded.get(ids[n], (None, False))[1]]
+
+        failures = [key for key in keys if key is None]
+        for key, upload in uploads:
+            try:
+                upload.result()
+            except Exception as e:
+                logging.error(f"Could not add the steps of {key}: {e}")
+                failures.append(key)
+
+        created = [key for key in keys if key is not None]
+        self.created.extend(key for key in new_keys if key is not None)
+        if failures:
+            raise RuntimeError(f"{len(failures)} of {len(test_cases)} tests for {jira_ticket} were not "
+                               f"fully uploaded (created: {', '.join(created) or 'none'})")
+        resumed = len(created) - sum(1 for key in new_keys if key is not None)
+        logging.info(f"Stage 5b - {len(created)} tests for {jira_ticket} created in Zephyr: {', '.join(created)}"
+                     + (f" ({resumed} of them before the run was resumed)" if resumed else ""))
+        return f"zephyr:{','.join(created)}"
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.created:
+            logging.info(f"{len(self.created)} tests created in Zephyr project {self.project_key}")
+        return []
+
+
+def test_case_ids(test_cases):
+    """
+    Identify the test cases of a ticket by their content, so that a resumed run recognises them
+    whatever their position; a repeated test case is told apart by its occurrence.
+    """
+    seen = collections.Counter()
+    ids = []
+    for test_case in test_cases:
+        digest = content_hash(test_case)
+        seen[digest] += 1
+        ids.append(f"{digest}:{seen[digest]}")
+    return ids
+
+
+def create_exporters(formats, output_dir=None, run_id=None, excel_file_name=None, upload_log=None):
+    """
+    Build the export backends named in formats for one run. The run-wide files are named
+    Zephyr_Test_Cases_<run_id>.<ext> and placed in output_dir when it is given. The tests
+    created in Zephyr are recorded in upload_log when it is given.
+    """
+    def run_file(ext):
+        file_name = f"Zephyr_Test_Cases_{run_id}.{ext}"
+        return os.path.join(output_dir, file_name) if output_dir else file_name
+
+    exporters = []
+    for name in formats:
+        if name == "excel":
+            exporters.append(ExcelExporter(output_dir, excel_file_name))
+        elif name == "workbook":
+            exporters.append(WorkbookExporter(run_file("xlsx")))
+        elif name == "csv":
+            exporters.append(CsvExporter(run_file("csv")))
+        elif name == "jsonl":
+            exporters.append(JsonlExporter(run_file("jsonl")))
+        elif name == "zephyr":
+            exporters.append(ZephyrApiExporter(upload_log=upload_log))
+        else:
+            raise ValueError(f"Unknown export format '{name}', expected one of {', '.join(EXPORT_FORMATS)}")
+    return exporters
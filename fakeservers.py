@@ -0,0 +1,516 @@
+import argparse
+import collections
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+"""
+    Local stand-ins for the external services, so that the tool can be exercised and measured
+    without hitting the real JIRA instance or Azure OpenAI deployment.
+
+    Each fake runs an HTTP server on a background thread and serves the subset of the REST API
+    used by this project. Point the tool at it with the matching environment variable, e.g.
+
+        python fakeservers.py jira --port 8081 --issues 500
+        python fakeservers.py openai --port 8082
+        JIRA_BASE_URL=http://127.0.0.1:8081 AZURE_OPENAI_BASE_PATH=http://127.0.0.1:8082/openai/deployments \
+            python app.py --jql "project = FAKE" --epic FAKE-1
+
+    or start it from Python with 'with FakeJira(issues) as jira:' and use jira.base_url.
+
+    Every fake can add latency to each request, with a slow tail (slow_rate, slow_latency), and
+    answer a share of the requests with 429 Too Many Requests and a Retry-After header
+    (throttle_rate), as the real services do under load. The latency and throttling can be changed while the fake is running.
+"""
+
+
+def make_jira_issue(key, comments=5, words_per_body=50, changelog=0, updated="2024-01-01T00:00:00.000+0000",
+                    variant=None):
+    """
+    Build a synthetic JIRA issue in the shape returned by the REST API, with some fields that
+    are not in the WHITELIST so that filtering has something to remove. changelog adds that
+    many change history entries, a large subtree that is never whitelisted.
+    By default every issue has the same text; issues of different variants have different text,
+    and issues of the same variant are clones of each other.
+    """
+    if variant is None:
+        text = " ".join(f"word{i % 97}" for i in range(words_per_body))
+    else:
+        rng = random.Random(variant)
+        text = " ".join(f"word{rng.randrange(5000)}" for _ in range(words_per_body))
+    issue = {
+        "expand": "renderedFields,names,schema,operations,editmeta,changelog,versionedRepresentations",
+        "id": str(zlib.crc32(key.encode("utf-8")) % 10 ** 6),
+        "self": f"https://example.invalid/rest/api/2/issue/{key}",
+        "key": key,
+        "fields": {
+            "summary": f"Synthetic story {key}",
+            "description": f"As a user I want {key} to work. {text}",
+            "updated": updated,
+            "comment": {
+                "comments": [
+                    {
+                        "self": f"https://example.invalid/rest/api/2/issue/{key}/comment/{n}",
+                        "id": str(n),
+                        "author": {"displayName": f"User {n % 7}", "accountId": f"acc-{n % 7}",
+                                   "avatarUrls": {"48x48": "https://example.invalid/a.png"}},
+                        "body": f"Comment {n} on {key}. {text}",
+                        "created": updated,
+                        "updated": updated,
+                        "jsdPublic": True,
+                    }
+                    for n in range(comments)
+                ],
+                "maxResults": comments,
+                "total": comments,
+                "startAt": 0,
+            },
+        },
+    }
+    if changelog:
+        issue["changelog"] = {
+            "startAt": 0,
+            "maxResults": changelog,
+            "total": changelog,
+            "histories": [
+                {"id": str(n), "author": {"displayName": f"User {n % 7}"}, "created": updated,
+                 "items": [{"field": "description", "fieldtype": "jira", "from": None,
+                            "fromString": text, "to": None, "toString": text}]}
+                for n in range(changelog)
+            ],
+        }
+    return issue
+
+
+class FakeServer:
+    """
+    Run a request handler class on a local ThreadingHTTPServer in a background thread.
+    The handler reaches this object through self.server.fake.
+    throttle_rate is the share of requests answered with 429 and a Retry-After of retry_after
+    seconds, and slow_rate the share that take slow_latency seconds instead of latency (the tail
+    of the latency distribution); these requests are chosen by a seeded random generator, so
+    runs repeat.
+    """
+    def __init__(self, handler_class, host="127.0.0.1", port=0, latency=0.0, throttle_rate=0.0,
+                 retry_after=1, seed=0, slow_rate=0.0, slow_latency=0.0):
+        self.handler_class = handler_class
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.request_count = 0
+        self.throttled_count = 0
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._count_lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def count_request(self):
+        """
+        Count a request and decide whether it is throttled. Returns (throttled, latency).
+        """
+        with self._count_lock:
+            self.request_count += 1
+            throttled = self.throttle_rate > 0 and self._random.random() < self.throttle_rate
+            if throttled:
+                self.throttled_count += 1
+            slow = self.slow_rate > 0 and self._random.random() < self.slow_rate
+            return throttled, self.slow_latency if slow else self.latency
+
+    def reset_counts(self):
+        with self._count_lock:
+            self.request_count = 0
+            self.throttled_count = 0
+            self._random.seed(self.seed)
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), self.handler_class)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """
+    Shared helpers for the fake request handlers.
+    """
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def read_json_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def begin_request(self):
+        """
+        Apply the latency and throttling of the fake. Returns False if the request was
+        answered with 429 and must not be handled.
+        """
+        throttled, latency = self.fake.count_request()
+        if latency:
+            time.sleep(latency)
+        if throttled:
+            # Drain the request body so the kept-alive connection stays usable
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_json(429, {"error": {"code": "429", "message": "Too many requests"}},
+                           {"Retry-After": str(self.fake.retry_after)})
+            return False
+        return True
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.fake.__class__.__name__}: {format % args}")
+
+
+def _select_fields(issue, fields):
+    if not fields or fields == ["*all"]:
+        return issue
+    selected = {k: v for k, v in issue.items() if k != "fields"}
+    selected["fields"] = {k: v for k, v in issue["fields"].items() if k in fields}
+    return selected
+
+
+class FakeJiraHandler(FakeHandler):
+    """
+    Serves GET /rest/api/2/issue/{key} and GET /rest/api/2/search.
+    The JQL of a search is not interpreted: every issue held by the fake matches.
+    For the Zephyr upload it also serves POST /rest/api/2/issue/bulk, which records the created
+    test issues, and the Zephyr POST /testcases/{key}/teststeps, which records their steps, so
+    the same fake can be used as JIRA_BASE_URL and ZEPHYR_BASE_URL.
+    """
+    def do_GET(self):
+        if not self.begin_request():
+            return
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        fields = [f for f in query.get("fields", [""])[0].split(",") if f]
+
+        if url.path.startswith("/rest/api/2/issue/"):
+            key = url.path.rsplit("/", 1)[-1]
+            issue = self.fake.issues.get(key)
+            if issue is None:
+                self.send_json(404, {"errorMessages": ["Issue does not exist or you do not have permission to see it."]})
+            else:
+                self.send_json(200, _select_fields(issue, fields))
+
+        elif url.path == "/rest/api/2/search":
+            start_at = int(query.get("startAt", ["0"])[0])
+            max_results = min(int(query.get("maxResults", ["50"])[0]), self.fake.max_results)
+            issues = list(self.fake.issues.values())
+            page = issues[start_at:start_at + max_results]
+            self.send_json(200, {"startAt": start_at, "maxResults": max_results, "total": len(issues),
+                                 "issues": [_select_fields(issue, fields) for issue in page]})
+
+        else:
+            self.send_json(404, {"errorMessages": [f"Unknown path {url.path}"]})
+
+    def do_POST(self):
+        if not self.begin_request():
+            return
+        path = urlparse(self.path).path
+        body = self.read_json_body()
+
+        if path == "/rest/api/2/issue/bulk":
+            issues = [self.fake.create_issue(update.get("fields", {})) for update in body.get("issueUpdates", [])]
+            self.send_json(201, {"issues": [{"id": issue["id"], "key": issue["key"]} for issue in issues],
+                                 "errors": []})
+
+        elif path.startswith("/testcases/") and path.endswith("/teststeps"):
+            key = path.split("/")[2]
+            if key not in self.fake.created:
+                self.send_json(404, {"errorCode": 404, "message": f"Test case {key} not found"})
+                return
+            with self.fake.lock:
+                steps = self.fake.test_steps.setdefault(key, [])
+                if body.get("mode") == "OVERWRITE":
+                    steps.clear()
+                steps.extend(body.get("items", []))
+            self.send_json(201, {"id": len(steps)})
+
+        else:
+            self.send_json(404, {"errorMessages": [f"Unknown path {path}"]})
+
+
+class FakeJira(FakeServer):
+    """
+    Fake JIRA server holding a dictionary of issues by key.
+    max_results caps the page size of a search, as the real JIRA does.
+    """
+    def __init__(self, issues=None, latency=0.0, max_results=100, host="127.0.0.1", port=0, throttle_rate=0.0,
+                 retry_after=1):
+        super().__init__(FakeJiraHandler, host, port, latency, throttle_rate, retry_after)
+        self.issues = {issue["key"]: issue for issue in (issues or [])}
+        self.max_results = max_results
+        # Test issues created through the bulk create endpoint, and their steps, by key
+        self.created = {}
+        self.test_steps = {}
+        self.lock = threading.Lock()
+
+    def create_issue(self, fields):
+        with self.lock:
+            project = fields.get("project", {}).get("key", "FAKE")
+            key = f"{project}-{10000 + len(self.created) + 1}"
+            issue = {"id": str(zlib.crc32(key.encode("utf-8"))), "key": key, "fields": fields}
+            self.created[key] = issue
+        return issue
+
+
+# The canned LLM answer: the test cases generated for the sample ticket, wrapped in a ```json fence
+DEFAULT_CANNED_RESPONSE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                            "INVHUB-11696_test_case_steps.json")
+
+
+def load_canned_content(path=DEFAULT_CANNED_RESPONSE_FILE):
+    with open(path, 'r', encoding='utf-8') as f:
+        return "```json\n" + f.read().strip() + "\n```"
+
+
+class FakeChatCompletionsHandler(FakeHandler):
+    """
+    Serves POST .../chat/completions with a canned answer, as one JSON response or, when the
+    request asks for "stream": true, as server-sent events of chunk_chars characters each.
+    """
+    def do_POST(self):
+        if not self.begin_request():
+            return
+        body = self.read_json_body()
+
+        if not urlparse(self.path).path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"code": "404", "message": "Resource not found"}})
+            return
+
+        content = self.fake.content_for(body)
+        prompt_chars = sum(len(m.get("content", "")) for m in body.get("messages", []))
+        usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        # Like Azure, a request counts against the tokens quota with its max_tokens, not its actual answer
+        admitted, retry_after, headers = self.fake.admit(usage["prompt_tokens"] + body.get("max_tokens", 0))
+        if not admitted:
+            self.send_json(429, {"error": {"code": "429", "message": "Rate limit of the deployment exceeded"}},
+                           dict(headers, **{"Retry-After": str(max(1, math.ceil(retry_after))),
+                                            "retry-after-ms": str(int(retry_after * 1000))}))
+            return
+
+        if body.get("stream"):
+            self.send_stream(content, headers)
+            return
+
+        # Generation time of the answer at the fake's token rate
+        if self.fake.tokens_per_second:
+            time.sleep(usage["completion_tokens"] / self.fake.tokens_per_second)
+
+        self.send_json(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "model": "fake",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": usage,
+        }, headers)
+
+    def send_stream(self, content, headers=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.close_connection = True
+
+        size = self.fake.chunk_chars
+        for start in range(0, len(content), size):
+            event = {"id": "chatcmpl-fake", "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": content[start:start + size]},
+                                  "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if self.fake.chunk_delay:
+                time.sleep(self.fake.chunk_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class FakeChatCompletions(FakeServer):
+    """
+    Fake Azure OpenAI chat completions endpoint. Use base_url + '/openai/deployments' as
+    AZURE_OPENAI_BASE_PATH. chunk_delay is the time between streamed chunks; tokens_per_second,
+    if set, adds the time a model would take to generate a non-streamed answer.
+
+    tokens_per_minute and requests_per_minute, if set, are quotas enforced like a deployment's:
+    over a sliding quota_window (60s; shorten it to speed up benchmarks) a request that would
+    exceed either one is answered 429 with the Retry-After until enough of the window has passed,
+    and every answer carries the x-ratelimit-remaining-* headers.
+    """
+    def __init__(self, content=None, latency=0.0, chunk_chars=20, chunk_delay=0.0, host="127.0.0.1", port=0,
+                 throttle_rate=0.0, retry_after=1, tokens_per_second=0.0, tokens_per_minute=0, requests_per_minute=0,
+                 quota_window=60.0):
+        super().__init__(FakeChatCompletionsHandler, host, port, latency, throttle_rate, retry_after)
+        self.content = content if content is not None else load_canned_content()
+        self.vary_content = False
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.tokens_per_second = tokens_per_second
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.quota_window = quota_window
+        self._admitted = collections.deque()
+        self._admitted_tokens = 0
+
+    def content_for(self, body):
+        """
+        The answer to a request: the canned content or, with vary_content, the canned test cases
+        (shared by every ticket, as generated test cases overlap between the tickets of an epic)
+        followed by two test cases made from the words of the prompt.
+        """
+        if not self.vary_content:
+            return self.content
+        parsed = json.loads(self.content.strip("`\n").removeprefix("json"))
+        prompt = body.get("messages", [{}])[-1].get("content", "")
+        rng = random.Random(zlib.crc32(prompt.encode("utf-8")))
+        words = prompt.split() or ["nothing"]
+        for n in range(2):
+            phrase = " ".join(rng.choice(words) for _ in range(12))
+            parsed["testCases"].append({"id": f"TC-VARIANT-{n + 1}", "summary": f"Verify {phrase}",
+                                        "steps": [{"step": f"Perform {phrase}", "expectedResult": f"Done {phrase}"}]})
+        return "```json\n" + json.dumps(parsed, indent=2) + "\n```"
+
+    def admit(self, tokens):
+        """
+        Count a request of the given tokens against the quotas. Returns whether it is admitted,
+        the seconds to wait if it is not, and the rate limit headers to send.
+        """
+        if not self.tokens_per_minute and not self.requests_per_minute:
+            return True, 0.0, {}
+        with self._count_lock:
+            now = time.monotonic()
+            while self._admitted and now - self._admitted[0][0] >= self.quota_window:
+                self._admitted_tokens -= self._admitted.popleft()[1]
+
+            over_tokens = self.tokens_per_minute and self._admitted_tokens + tokens > self.tokens_per_minute
+            over_requests = self.requests_per_minute and len(self._admitted) + 1 > self.requests_per_minute
+            admitted = not (over_tokens or over_requests)
+            if admitted:
+                self._admitted.append((now, tokens))
+                self._admitted_tokens += tokens
+                retry_after = 0.0
+            else:
+                self.throttled_count += 1
+                # Until the oldest admitted request leaves the window
+                retry_after = self.quota_window - (now - self._admitted[0][0]) if self._admitted else self.quota_window
+
+            # Like Azure, only the remaining quota is reported, not the limits
+            headers = {}
+            if self.tokens_per_minute:
+                headers["x-ratelimit-remaining-tokens"] = str(max(0, self.tokens_per_minute - self._admitted_tokens))
+            if self.requests_per_minute:
+                headers["x-ratelimit-remaining-requests"] = str(max(0, self.requests_per_minute - len(self._admitted)))
+            return admitted, retry_after, headers
+
+    def reset_counts(self):
+        super().reset_counts()
+        with self._count_lock:
+            self._admitted.clear()
+            self._admitted_tokens = 0
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Run a local fake of an external service.")
+    parser.add_argument("service", choices=["jira", "openai"], help="service to fake")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--slow-rate", type=float, default=0.0,
+                        help="share of requests that take --slow-latency seconds instead of --latency")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="seconds taken by the slow requests")
+    parser.add_argument("--issues", type=int, default=100, help="number of synthetic JIRA issues")
+    parser.add_argument("--comments", type=int, default=5, help="comments per synthetic JIRA issue")
+    parser.add_argument("--words-per-body", type=int, default=50,
+                        help="words in the description and in each comment of a synthetic JIRA issue")
+    parser.add_argument("--changelog", type=int, default=0, help="change history entries per synthetic JIRA issue")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="share of requests answered with 429 Too Many Requests")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--project", default="FAKE", help="project key of the synthetic JIRA issues")
+    parser.add_argument("--response-file", default=DEFAULT_CANNED_RESPONSE_FILE,
+                        help="JSON file of test cases returned as the LLM answer")
+    parser.add_argument("--chunk-delay", type=float, default=0.0,
+                        help="seconds between streamed LLM response chunks")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0,
+                        help="LLM generation speed for non-streamed answers (0 answers at once)")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens per minute quota of the fake deployment")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute quota of the fake deployment")
+    parser.add_argument("--quota-window", type=float, default=60.0,
+                        help="seconds over which the --tpm and --rpm quotas are counted")
+    return parser
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = build_arg_parser().parse_args()
+
+    if args.service == "jira":
+        issues = [make_jira_issue(f"{args.project}-{n}", comments=args.comments, words_per_body=args.words_per_body,
+                                  changelog=args.changelog)
+                  for n in range(1, args.issues + 1)]
+        server = FakeJira(issues, latency=args.latency, port=args.port, throttle_rate=args.throttle_rate,
+                          retry_after=args.retry_after)
+    else:
+        server = FakeChatCompletions(load_canned_content(args.response_file), latency=args.latency,
+                                     chunk_delay=args.chunk_delay, port=args.port, throttle_rate=args.throttle_rate,
+                                     retry_after=args.retry_after, tokens_per_second=args.tokens_per_second,
+                                     tokens_per_minute=args.tpm, requests_per_minute=args.rpm,
+                                     quota_window=args.quota_window)
+    server.slow_rate = args.slow_rate
+    server.slow_latency = args.slow_latency
+
+    server.start()
+    logging.info(f"Fake {args.service} listening on {server.base_url} - press Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+
+
+"""
+    Shared HTTP sessions for the JIRA and Azure OpenAI services.
+
+    A session keeps its connections alive between calls, so a batch run pays the TCP and TLS
+    handshake once per pooled connection instead of once per request. Every request gets a
+    default timeout so that a hung endpoint can no longer hang the run forever, and throttled
+    (429) or failed (5xx) requests are retried with exponential backoff, waiting for the
+    'Retry-After' period when the server sends one.
+
+    requests is only imported when the first session is built: it is the largest part of the
+    start-up time of the tool, and runs served from the LLM response cache may never need it.
+"""
+
+
+# HTTP status codes that are retried: throttling and transient server errors
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+_timeout_session_class = None
+
+
+def _get_timeout_session_class():
+    """
+    Return the TimeoutSession class, defining it on first use.
+    """
+    global _timeout_session_class
+    if _timeout_session_class is None:
+        import requests
+
+        class TimeoutSession(requests.Session):
+            """
+            A requests Session that applies a default timeout to every request.
+            """
+            def __init__(self, timeout):
+                super().__init__()
+                self.timeout = timeout
+
+            def request(self, method, url, **kwargs):
+                kwargs.setdefault("timeout", self.timeout)
+                return super().request(method, url, **kwargs)
+
+        _timeout_session_class = TimeoutSession
+    return _timeout_session_class
+
+
+def build_session(pool_size, timeout, max_retries, backoff_factor, retry_methods=None,
+                  retry_status_codes=RETRY_STATUS_CODES):
+    """
+    Build a session with a keep-alive connection pool of pool_size connections per host,
+    a default (connect, read) timeout and retries with exponential backoff.
+    retry_methods lists the HTTP methods that are safe to retry, e.g. POST for the LLM query.
+    retry_status_codes can be narrowed, e.g. to 429 only for requests that create data and
+    must not be repeated after a server error.
+    """
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=retry_status_codes,
+        allowed_methods=frozenset(retry_methods or Retry.DEFAULT_ALLOWED_METHODS),
+        # urllib3 retries any response with a Retry-After header, whatever status_forcelist says,
+        # so a session that leaves 429 to its caller must not look at the header
+        respect_retry_after_header=429 in retry_status_codes,
+        # Hand the last response back to the caller so that raise_for_status() reports it
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = _get_timeout_session_class()(timeout)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class SharedSession:
+    """
+    Lazily create one session per service and share it between all threads of the run.
+    The factory is called the first time the session is needed.
+    """
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._session = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    logging.debug(f"Creating shared HTTP session for {self.name}")
+                    self._session = self._factory()
+        return self._session
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+class RateLimiter:
+    """
+    Spread requests evenly at no more than rate requests per second across all threads.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until the next request is allowed.
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
@@ -0,0 +1,225 @@
+import contextvars
+import json
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+"""
+    Per-stage timing, token and cost instrumentation.
+
+    The stages record how long they take for each ticket (JIRA fetch, filtering, prompt build,
+    LLM query, parsing and each export backend), along with counters such as the size of the
+    JIRA payload and the prompt and completion tokens from the 'usage' field of the LLM
+    response. At the end of a run the records are aggregated per stage (count, total, p50, p95,
+    max) and for the whole run (throughput, tokens per second, estimated cost) into a report
+    that can be written as JSON or in the Prometheus text format:
+
+        python app.py --batch tickets.txt --epic INVHUB-10821 --report run_report.json
+        python app.py --batch tickets.txt --epic INVHUB-10821 --report run_report.prom
+"""
+
+
+# The key the metrics of the current job are recorded under instead of its ticket (RunMetrics.job)
+_job_key = contextvars.ContextVar("metrics_job_key", default=None)
+
+
+def percentile(values, pct):
+    """
+    Return the pct percentile of values (nearest rank), or 0.0 for no values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class RunMetrics:
+    """
+    Thread-safe collector of per-ticket timings and counters for one run.
+    Costs are estimated from the prices per 1,000 prompt and completion tokens; responses served
+    from the LLM response cache cost nothing.
+    Within job(key) the records go under key instead of the ticket, e.g. in the service, which
+    runs the same ticket more than once.
+    """
+    def __init__(self, prompt_cost_per_1k=0.0, completion_cost_per_1k=0.0):
+        self.prompt_cost_per_1k = prompt_cost_per_1k
+        self.completion_cost_per_1k = completion_cost_per_1k
+        self.tickets = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def job(self, key):
+        """
+        Record the metrics of the enclosed block, and of the calls run through map_in_context
+        from it, under key.
+        """
+        token = _job_key.set(key)
+        try:
+            yield
+        finally:
+            _job_key.reset(token)
+
+    def forget(self, key):
+        """
+        Drop the records of a ticket or job.
+        """
+        with self._lock:
+            self.tickets.pop(key, None)
+
+    def _ticket(self, ticket):
+        ticket = _job_key.get() or ticket
+        record = self.tickets.get(ticket)
+        if record is None:
+            record = self.tickets[ticket] = {"timings": {}, "counters": {}}
+        return record
+
+    def add_time(self, ticket, name, seconds):
+        with self._lock:
+            timings = self._ticket(ticket)["timings"]
+            timings[name] = timings.get(name, 0.0) + seconds
+
+    def add(self, ticket, name, value):
+        with self._lock:
+            counters = self._ticket(ticket)["counters"]
+            counters[name] = counters.get(name, 0) + value
+
+    @contextmanager
+    def time(self, ticket, name):
+        """
+        Time the enclosed block and add it to the ticket's timing of that name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(ticket, name, time.perf_counter() - start)
+
+    def add_usage(self, ticket, usage, cached=False, estimated=False):
+        """
+        Record the token usage of one LLM response.
+        """
+        prompt_tokens = usage.get("prompt_tokens", 0) or 0
+        completion_tokens = usage.get("completion_tokens", 0) or 0
+        self.add(ticket, "llm_requests", 1)
+        if cached:
+            self.add(ticket, "llm_cache_hits", 1)
+            return
+        self.add(ticket, "prompt_tokens", prompt_tokens)
+        self.add(ticket, "completion_tokens", completion_tokens)
+        if estimated:
+            self.add(ticket, "estimated_tokens", prompt_tokens + completion_tokens)
+        self.add(ticket, "cost", prompt_tokens / 1000 * self.prompt_cost_per_1k
+                 + completion_tokens / 1000 * self.completion_cost_per_1k)
+
+    def report(self, elapsed):
+        """
+        Aggregate the records into the run report.
+        """
+        with self._lock:
+            tickets = {ticket: {"timings": dict(record["timings"]), "counters": dict(record["counters"])}
+                       for ticket, record in self.tickets.items()}
+
+        stages = {}
+        for record in tickets.values():
+            for name, seconds in record["timings"].items():
+                stages.setdefault(name, []).append(seconds)
+
+        totals = {}
+        for record in tickets.values():
+            for name, value in record["counters"].items():
+                totals[name] = totals.get(name, 0) + value
+
+        llm_seconds = sum(stages.get("llm_query", []))
+        completion_tokens = totals.get("completion_tokens", 0)
+        return {
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "run": {
+                "tickets": len(tickets),
+                "elapsed_seconds": round(elapsed, 3),
+                "tickets_per_second": round(len(tickets) / elapsed, 3) if elapsed > 0 else 0.0,
+                "prompt_tokens": totals.get("prompt_tokens", 0),
+                "completion_tokens": completion_tokens,
+                "completion_tokens_per_second": round(completion_tokens / llm_seconds, 1) if llm_seconds else 0.0,
+                "estimated_cost": round(totals.get("cost", 0.0), 4),
+                "counters": {k: (round(v, 4) if isinstance(v, float) else v) for k, v in sorted(totals.items())},
+            },
+            "stages": {name: {"count": len(values),
+                              "total_seconds": round(sum(values), 4),
+                              "p50_seconds": round(percentile(values, 50), 4),
+                              "p95_seconds": round(percentile(values, 95), 4),
+                              "max_seconds": round(max(values), 4)}
+                       for name, values in stages.items()},
+            "tickets": tickets,
+        }
+
+
+def map_in_context(executor, func, items):
+    """
+    executor.map() that runs each call in a copy of the caller's context, so that the metrics of
+    the calls go to the caller's job (RunMetrics.job).
+    """
+    futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+    return (future.result() for future in futures)
+
+
+def to_prometheus(report):
+    """
+    Render the run report in the Prometheus text exposition format.
+    """
+    lines = []
+
+    def metric(name, help_text, kind, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{suffix}{{{label_text}}} {value}" if label_text else f"{name}{suffix} {value}")
+
+    run = report["run"]
+    metric("testgen_run_tickets", "Tickets processed in the run", "gauge", [("", {}, run["tickets"])])
+    metric("testgen_run_elapsed_seconds", "Wall time of the run", "gauge", [("", {}, run["elapsed_seconds"])])
+    metric("testgen_run_tickets_per_second", "Ticket throughput of the run", "gauge",
+           [("", {}, run["tickets_per_second"])])
+    metric("testgen_llm_tokens", "LLM tokens used in the run", "gauge",
+           [("", {"type": "prompt"}, run["prompt_tokens"]), ("", {"type": "completion"}, run["completion_tokens"])])
+    metric("testgen_llm_completion_tokens_per_second", "LLM completion tokens per second of query time", "gauge",
+           [("", {}, run["completion_tokens_per_second"])])
+    metric("testgen_estimated_cost", "Estimated LLM cost of the run", "gauge", [("", {}, run["estimated_cost"])])
+
+    samples = []
+    for name, stage in report["stages"].items():
+        samples += [("", {"stage": name, "quantile": "0.5"}, stage["p50_seconds"]),
+                    ("", {"stage": name, "quantile": "0.95"}, stage["p95_seconds"]),
+                    ("_sum", {"stage": name}, stage["total_seconds"]),
+                    ("_count", {"stage": name}, stage["count"])]
+    metric("testgen_stage_seconds", "Time per ticket spent in each stage", "summary", samples)
+    return "\n".join(lines) + "\n"
+
+
+def write_report(report, path):
+    """
+    Write the run report to path: Prometheus text for a .prom file, JSON otherwise.
+    """
+    with open(path, 'w') as f:
+        if path.endswith(".prom"):
+            f.write(to_prometheus(report))
+        else:
+            json.dump(report, f, indent=4)
+    logging.info(f"Run report written to {path}")
+
+
+def log_stage_timings(report):
+    """
+    Log where the wall time of the run went, stage by stage.
+    """
+    for name, stage in sorted(report["stages"].items(), key=lambda item: -item[1]["total_seconds"]):
+        logging.info(f"  {name}: {stage['count']} tickets, p50 {stage['p50_seconds']:.3f}s, "
+                     f"p95 {stage['p95_seconds']:.3f}s, total {stage['total_seconds']:.2f}s")
+    run = report["run"]
+    logging.info(f"  tokens: {run['prompt_tokens']} prompt, {run['completion_tokens']} completion "
+                 f"({run['completion_tokens_per_second']} completion tokens/s), "
+                 f"estimated cost {run['estimated_cost']:.4f}")
@@ -1,13 +1,38 @@
 
-import requests
+import functools
+import json
 import logging
-from requests.auth import HTTPBasicAuth
-
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 # Import OpenAI Environment Variables
-from openaienvvars import (JIRA_BASE_URL, JIRA_RETRIEVE_ENDPOINT, 
-                           JIRA_CREATE_ENDPOINT, JIRA_USER_NAME, JIRA_API_TOKEN)
+from openaienvvars import config
+
+
+# Import the shared HTTP session support
+from httpclient import build_session, SharedSession
+
+
+
+def _create_jira_session():
+    """
+    Build the JIRA session: pooled keep-alive connections with the JIRA credentials attached once.
+    """
+    session = build_session(config.HTTP_POOL_SIZE, (config.HTTP_CONNECT_TIMEOUT, config.JIRA_READ_TIMEOUT),
+                            config.HTTP_MAX_RETRIES, config.HTTP_BACKOFF_FACTOR)
+    from requests.auth import HTTPBasicAuth
+    session.auth = HTTPBasicAuth(config.JIRA_USER_NAME, config.JIRA_API_TOKEN)
+    session.headers.update({"Accept": "application/json"})
+    return session
+
+
+# One JIRA session shared by every call in the run
+jira_session = SharedSession("JIRA", _create_jira_session)
+
+
+# Fields requested for each ticket: the whitelisted fields plus the update time used by incremental mode
+JIRA_ISSUE_FIELDS = "summary,description,comment,updated"
 
 
 # Check if the required environment variables are set
@@ -15,10 +40,10 @@ def validate_JIRA_env_vars():
     """
     Validate that all required environment variables are set
     """
-    if JIRA_USER_NAME == "not_found":
+    if config.JIRA_USER_NAME == "not_found":
         logging.error("JIRA User Name not set")
         return False
-    if JIRA_API_TOKEN == "not_found":
+    if config.JIRA_API_TOKEN == "not_found":
         logging.error("JIRA API Token not set")
         return False
     return True
@@ -41,6 +66,174 @@ def filter_dict(d, whitelist):
     return result
 
 
+class WhitelistPlan:
+    """
+    A whitelist compiled into a projection plan.
+    fields maps each whitelisted key to the plan for its value, or to None to keep the value whole.
+    array is the plan applied to the dictionaries of a list value ('__array__' in the whitelist).
+    """
+    __slots__ = ("fields", "array")
+
+    def __init__(self, fields, array):
+        self.fields = fields
+        self.array = array
+
+
+def compile_whitelist(whitelist):
+    """
+    Compile a whitelist such as WHITELIST in app.py once into a WhitelistPlan, so that projecting
+    a JIRA response no longer re-inspects the whitelist at every node.
+    """
+    if not isinstance(whitelist, dict):
+        return None
+
+    fields = {k: compile_whitelist(v) for k, v in whitelist.items() if k != '__array__'}
+    array = compile_whitelist(whitelist['__array__']) if '__array__' in whitelist else None
+    return WhitelistPlan(fields, array)
+
+
+def project_dict(d, plan):
+    """
+    Iterative equivalent of filter_dict using a compiled WhitelistPlan.
+    Keys keep the order of the source dictionary, so the result serialises exactly as filter_dict's.
+    """
+    result = {}
+    stack = [(d, plan, result)]
+
+    while stack:
+        src, node, dst = stack.pop()
+        fields = node.fields
+        for k, v in src.items():
+            if k not in fields:
+                continue
+            child = fields[k]
+            if child is None:
+                dst[k] = v
+            elif type(v) is dict:
+                dst[k] = sub = {}
+                stack.append((v, child, sub))
+            elif type(v) is list and child.array is not None:
+                dst[k] = out = []
+                for elem in v:
+                    if type(elem) is dict:
+                        sub = {}
+                        out.append(sub)
+                        stack.append((elem, child.array, sub))
+                    else:
+                        out.append(elem)
+            else:
+                dst[k] = v
+
+    return result
+
+
+# Marks a value that is outside the whitelist while streaming
+_SKIP = object()
+
+
+def _project_events(events, plan):
+    """
+    Build the projected dictionary from a stream of ijson basic_parse events.
+    Each open container is a frame [container, plan, pending plan for the next value]; a plan
+    of None keeps everything below it. Subtrees outside the whitelist are skipped by depth
+    counting without building anything.
+    """
+    root = None
+    frames = []
+    skip_depth = 0
+
+    for event, value in events:
+        if skip_depth:
+            if event in ("start_map", "start_array"):
+                skip_depth += 1
+            elif event in ("end_map", "end_array"):
+                skip_depth -= 1
+            continue
+
+        if event == "map_key":
+            frame = frames[-1]
+            node = frame[1]
+            if node is None:
+                frame[2] = None
+            else:
+                frame[2] = node.fields[value] if value in node.fields else _SKIP
+            frame.append(value)
+            continue
+
+        if event in ("end_map", "end_array"):
+            frames.pop()
+            continue
+
+        # A value starts: work out the plan that applies to it and where it goes
+        if not frames:
+            child_plan, attach = plan, None
+        else:
+            frame = frames[-1]
+            container = frame[0]
+            if type(container) is dict:
+                child_plan = frame[2]
+                key = frame.pop()
+                if child_plan is _SKIP:
+                    if event in ("start_map", "start_array"):
+                        skip_depth = 1
+                    continue
+                attach = (container, key)
+            else:
+                # Element of a list: dictionaries use the list's '__array__' plan
+                child_plan = frame[1]
+                attach = (container, None)
+
+        if event == "start_map":
+            new_value = {}
+            frames.append([new_value, child_plan, None])
+        elif event == "start_array":
+            new_value = []
+            # A list keeps its elements unless the whitelist has an '__array__' plan for them
+            frames.append([new_value, child_plan.array if child_plan is not None else None])
+        else:
+            new_value = value
+
+        if attach is None:
+            root = new_value
+        elif attach[1] is None:
+            attach[0].append(new_value)
+        else:
+            attach[0][attach[1]] = new_value
+
+    return root
+
+
+@functools.lru_cache(maxsize=None)
+def load_ijson():
+    """
+    Return the optional ijson module, or None when it is not installed. With it, JIRA responses
+    are projected while they are parsed, so the fields outside the whitelist are never built as
+    Python objects. Like requests and openpyxl, it is imported when first needed.
+    """
+    try:
+        import ijson
+    except ImportError:
+        return None
+    return ijson
+
+
+def project_json(data, plan):
+    """
+    Parse a raw JSON document (bytes, str or a binary file) and project it with a WhitelistPlan.
+    With ijson installed the projection happens while parsing; otherwise the document is parsed
+    with json and then projected.
+    """
+    ijson = load_ijson()
+    if ijson is not None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return _project_events(ijson.basic_parse(data, use_float=True), plan)
+
+    if hasattr(data, "read"):
+        data = data.read()
+    return project_dict(json.loads(data), plan)
+
+
 def retrieve_jira_ticket_from_file(jira_ticket):
     """
     Read the json file <jira_ticket>.json and return the contents as a sting
@@ -50,18 +243,98 @@ def retrieve_jira_ticket_from_file(jira_ticket):
 
     
     
-def retrieve_jira_ticket_from_server(jira_ticket):
+def retrieve_jira_ticket_from_server(jira_ticket, plan=None, stats=None):
     """
     Retrieve a JIRA ticket's details from the server using the JIRA REST API.
+    If a compiled WhitelistPlan is given, the raw response is projected with it directly.
+    If a stats dictionary is given, the size of the response and the time taken to fetch and to
+    project it are stored in it.
     """
-    url = JIRA_RETRIEVE_ENDPOINT.format(jira_ticket)
-    auth = HTTPBasicAuth(JIRA_USER_NAME, JIRA_API_TOKEN)
+    import requests
+    url = config.JIRA_RETRIEVE_ENDPOINT.format(jira_ticket)
     
     try:
-        response = requests.get(url, auth=auth)
+        start = time.perf_counter()
+        response = jira_session.get().get(url)
         response.raise_for_status()
-        return response.json()
+        content = response.content
+        fetched = time.perf_counter()
+        ticket_data = project_json(content, plan) if plan is not None else response.json()
+        if stats is not None:
+            stats.update(payload_bytes=len(content), fetch_seconds=fetched - start,
+                         filter_seconds=time.perf_counter() - fetched)
+        return ticket_data
     except requests.exceptions.RequestException as e:
         error_message = f"Error retrieving JIRA ticket: {e}"
         logging.error(error_message)
         return None
+
+
+
+def retrieve_jira_ticket_updated(jira_ticket):
+    """
+    Retrieve only the 'updated' timestamp of a JIRA ticket. This is a cheap request used to check
+    whether a ticket has changed since test cases were last generated for it.
+    """
+    import requests
+    url = config.JIRA_UPDATED_ENDPOINT.format(jira_ticket)
+
+    try:
+        response = jira_session.get().get(url)
+        response.raise_for_status()
+        return response.json().get("fields", {}).get("updated")
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error retrieving JIRA ticket update time: {e}")
+        return None
+
+
+def search_jira_issues(jql, fields=JIRA_ISSUE_FIELDS, whitelist=None, page_size=None, max_workers=None):
+    """
+    Bulk extraction of JIRA tickets with a JQL search, e.g. '"Epic Link" = INVHUB-10821'.
+    The first page reports the total number of issues; the remaining pages are then fetched
+    concurrently. Issues are yielded as each page arrives, so a few hundred tickets cost a
+    handful of requests instead of one per ticket. With a whitelist (a whitelist dictionary or
+    a compiled WhitelistPlan) each page is projected with project_json as it is parsed, so the
+    fields outside the whitelist are never built.
+    page_size and max_workers default to JIRA_SEARCH_PAGE_SIZE and JIRA_SEARCH_WORKERS.
+    """
+    page_size = page_size or config.JIRA_SEARCH_PAGE_SIZE
+    max_workers = max_workers or config.JIRA_SEARCH_WORKERS
+    session = jira_session.get()
+
+    page_plan = None
+    if whitelist is not None:
+        issue_plan = whitelist if isinstance(whitelist, WhitelistPlan) else compile_whitelist(whitelist)
+        page_plan = WhitelistPlan({"startAt": None, "maxResults": None, "total": None,
+                                   "issues": WhitelistPlan({}, issue_plan)}, None)
+
+    def fetch_page(start_at):
+        params = {"jql": jql, "fields": fields, "startAt": start_at, "maxResults": page_size}
+        response = session.get(config.JIRA_SEARCH_ENDPOINT, params=params)
+        response.raise_for_status()
+        return project_json(response.content, page_plan) if page_plan is not None else response.json()
+
+    def issues_of(page):
+        yield from page.get("issues", [])
+
+    first_page = fetch_page(0)
+    yield from issues_of(first_page)
+
+    # JIRA may return fewer issues per page than requested, so step by what it actually returned
+    step = len(first_page.get("issues", []))
+    total = first_page.get("total", 0)
+    if step == 0 or step >= total:
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_page, start_at) for start_at in range(step, total, step)]
+        for future in as_completed(futures):
+            yield from issues_of(future.result())
+
+
+
+def search_jira_ticket_keys(jql):
+    """
+    Run a JQL search against the JIRA REST API and return the matching ticket keys.
+    """
+    return [issue["key"] for issue in search_jira_issues(jql, fields="key")]
@@ -0,0 +1,225 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+"""
+    Durable journal of the stages each ticket of a batch run has completed.
+
+    A batch run is identified by its run id. As a ticket passes each stage, the journal records
+    the stage together with what the next stage needs, and commits it at once:
+
+        filtered   - the whitelisted ticket data, its JIRA 'updated' timestamp and content hash
+                     (the JIRA fetch and the filtering are one step, fetch_ticket in app.py)
+        generated  - the parsed test cases of the LLM answer
+        exported   - the export backends that were served and their outputs
+
+    A run that was interrupted (crash, quota exhausted, Ctrl-C, a failed JQL search) can be
+    resumed with app.py --resume: each ticket then starts after the last stage it completed, so
+    a ticket whose test cases were generated is never sent to the LLM again, and a ticket
+    already exported to a per-ticket backend (the Excel file of the ticket, Zephyr) is not
+    exported to it twice. Tickets that failed are retried from their last completed stage.
+
+    The tests created in Zephyr (--export zephyr) are journaled one by one as well, together
+    with whether their steps were added, so that a ticket whose upload failed part way does not
+    create its tests a second time when the run is resumed (UploadLog).
+"""
+
+
+FILTERED = "filtered"
+GENERATED = "generated"
+EXPORTED = "exported"
+STAGES = (FILTERED, GENERATED, EXPORTED)
+
+
+class JobJournal:
+    """
+    SQLite-backed journal of batch runs and of the stages of their tickets, shared by all
+    threads of the run. Runs older than max_age_days are dropped when another run starts.
+    """
+    def __init__(self, path, max_age_days=14):
+        self.path = path
+        self.max_age_days = max_age_days
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " run_id TEXT PRIMARY KEY,"
+                " started_at REAL NOT NULL,"
+                " finished_at REAL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tickets ("
+                " run_id TEXT NOT NULL,"
+                " ticket TEXT NOT NULL,"
+                " stage TEXT NOT NULL,"
+                " updated TEXT,"
+                " content_hash TEXT,"
+                " reduced_ticket TEXT,"
+                " parsed TEXT,"
+                " exported_to TEXT,"
+                " outputs TEXT,"
+                " error TEXT,"
+                " recorded_at REAL NOT NULL,"
+                " PRIMARY KEY (run_id, ticket))")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                " run_id TEXT NOT NULL,"
+                " ticket TEXT NOT NULL,"
+                " test_case TEXT NOT NULL,"
+                " test_key TEXT NOT NULL,"
+                " steps_added INTEGER NOT NULL,"
+                " PRIMARY KEY (run_id, ticket, test_case))")
+            self._conn.commit()
+        return self._conn
+
+    def start_run(self, run_id, resume=False):
+        """
+        Start journaling a run and return the journal entries of its tickets by ticket: empty for
+        a new run, whose earlier entries under the same run id are discarded, or those of the
+        interrupted run being resumed, which is not dropped for its age.
+        """
+        with self._lock:
+            conn = self._connection()
+            if self.max_age_days:
+                # The run being resumed is kept however old it is
+                cutoff = time.time() - self.max_age_days * 86400
+                kept = run_id if resume else None
+                for table in ("tickets", "uploads"):
+                    conn.execute(f"DELETE FROM {table} WHERE run_id IN "
+                                 f"(SELECT run_id FROM runs WHERE started_at < ? AND run_id IS NOT ?)", (cutoff, kept))
+                conn.execute("DELETE FROM runs WHERE started_at < ? AND run_id IS NOT ?", (cutoff, kept))
+            if resume and conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone() is None:
+                logging.warning(f"Run {run_id} is not in the job journal, all its tickets start over")
+            if not resume:
+                conn.execute("DELETE FROM tickets WHERE run_id = ?", (run_id,))
+                conn.execute("DELETE FROM uploads WHERE run_id = ?", (run_id,))
+            conn.execute("INSERT OR REPLACE INTO runs (run_id, started_at, finished_at) VALUES "
+                         "(?, COALESCE((SELECT started_at FROM runs WHERE run_id = ?), ?), NULL)",
+                         (run_id, run_id, time.time()))
+            conn.commit()
+            rows = conn.execute(
+                "SELECT ticket, stage, updated, content_hash, reduced_ticket, parsed, exported_to, outputs, error "
+                "FROM tickets WHERE run_id = ?", (run_id,)).fetchall()
+        entries = {}
+        for ticket, stage, updated, ticket_hash, reduced_ticket, parsed, exported_to, outputs, error in rows:
+            entries[ticket] = {
+                "stage": stage, "updated": updated, "content_hash": ticket_hash,
+                "reduced_ticket": json.loads(reduced_ticket) if reduced_ticket is not None else None,
+                "parsed": json.loads(parsed) if parsed is not None else None,
+                "exported_to": json.loads(exported_to) if exported_to is not None else [],
+                "outputs": json.loads(outputs) if outputs is not None else [],
+                "error": error,
+            }
+        return entries
+
+    def last_unfinished_run(self):
+        """
+        Return the id of the most recently started run that did not finish, or None.
+        """
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT run_id FROM runs WHERE finished_at IS NULL ORDER BY started_at DESC LIMIT 1").fetchone()
+        return row[0] if row is not None else None
+
+    def has_run(self, run_id):
+        with self._lock:
+            row = self._connection().execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return row is not None
+
+    def finish_run(self, run_id):
+        """
+        Mark a run whose tickets all completed, so that --resume without a run id skips it.
+        """
+        self._execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def filtered(self, run_id, ticket, updated, ticket_hash, reduced_ticket):
+        self._execute(
+            "INSERT OR REPLACE INTO tickets (run_id, ticket, stage, updated, content_hash, reduced_ticket, recorded_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (run_id, ticket, FILTERED, updated, ticket_hash, json.dumps(reduced_ticket), time.time()))
+
+    def generated(self, run_id, ticket, updated, ticket_hash, parsed):
+        # The filtered ticket is no longer needed once its test cases are generated
+        self._execute(
+            "INSERT OR REPLACE INTO tickets (run_id, ticket, stage, updated, content_hash, parsed, recorded_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (run_id, ticket, GENERATED, updated, ticket_hash, json.dumps(parsed), time.time()))
+
+    def exported(self, run_id, ticket, exported_to, outputs):
+        """
+        Record the export backends the ticket was exported to. The generation is kept, since
+        the run-wide files are written again by a resumed run.
+        """
+        self._execute(
+            "INSERT INTO tickets (run_id, ticket, stage, exported_to, outputs, recorded_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (run_id, ticket) DO UPDATE SET stage = excluded.stage, exported_to = excluded.exported_to, "
+            "outputs = excluded.outputs, error = NULL, recorded_at = excluded.recorded_at",
+            (run_id, ticket, EXPORTED, json.dumps(sorted(exported_to)), json.dumps(outputs), time.time()))
+
+    def failed(self, run_id, ticket, error):
+        """
+        Note why a ticket failed; it keeps the last stage it completed.
+        """
+        self._execute("UPDATE tickets SET error = ?, recorded_at = ? WHERE run_id = ? AND ticket = ?",
+                      (error, time.time(), run_id, ticket))
+
+    def uploaded(self, run_id, ticket, test_case, test_key, steps_added):
+        """
+        Record a test created in Zephyr for a test case of a ticket, and whether its steps were added.
+        """
+        self._execute("INSERT OR REPLACE INTO uploads (run_id, ticket, test_case, test_key, steps_added) "
+                      "VALUES (?, ?, ?, ?, ?)", (run_id, ticket, test_case, test_key, int(steps_added)))
+
+    def uploads(self, run_id, ticket):
+        """
+        Return the tests created in Zephyr for a ticket of the run, as (test key, steps added)
+        by test case.
+        """
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT test_case, test_key, steps_added FROM uploads WHERE run_id = ? AND ticket = ?",
+                (run_id, ticket)).fetchall()
+        return {test_case: (test_key, bool(steps_added)) for test_case, test_key, steps_added in rows}
+
+    def _execute(self, sql, params):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(sql, params)
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class UploadLog:
+    """
+    The tests created in Zephyr for the tickets of one run, as the ZephyrApiExporter
+    (exporters.py) records them in the journal while it uploads.
+    """
+    def __init__(self, journal, run_id):
+        self.journal = journal
+        self.run_id = run_id
+
+    def created(self, ticket):
+        return self.journal.uploads(self.run_id, ticket)
+
+    def record(self, ticket, test_case, test_key, steps_added):
+        self.journal.uploaded(self.run_id, ticket, test_case, test_key, steps_added)
+
+
+def log_resumed_tickets(run_id, entries):
+    """
+    Log how far the tickets of a resumed run had got.
+    """
+    counts = {stage: sum(1 for entry in entries.values() if entry["stage"] == stage) for stage in STAGES}
+    logging.info(f"Resuming run {run_id}: {counts[EXPORTED]} tickets exported, {counts[GENERATED]} generated "
+                 f"and {counts[FILTERED]} fetched before the interruption")
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+"""
+    On-disk cache of LLM responses.
+
+    The LLM is queried with TEMPERATURE = 0, so the same prompt, ticket and model settings give the
+    same test cases. Responses are stored in a SQLite database keyed by a hash of everything that
+    affects the completion: the system prompt from LLM_Prompt.txt, the filtered JIRA ticket JSON,
+    the deployment name, MAX_TOKENS and TEMPERATURE. Rerunning an unchanged ticket (e.g. after a
+    change to the Excel format, or after a crash) then takes milliseconds instead of a full LLM
+    round trip.
+
+    Entries older than max_age_seconds are treated as misses and removed, and the least recently
+    used entries are evicted when the total size of the stored responses goes over max_bytes.
+"""
+
+
+def make_cache_key(system_prompt, user_prompt, deployment, max_tokens, temperature, response_format=None):
+    """
+    Build the content-addressed key for one LLM request.
+    """
+    parts = [system_prompt, user_prompt, deployment, max_tokens, temperature]
+    if response_format is not None:
+        parts.append(response_format)
+    material = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    SQLite-backed cache of LLM responses with size and age based eviction and hit/miss statistics.
+    The database is opened on first use and shared by all threads of the run.
+    """
+    def __init__(self, path, max_bytes, max_age_seconds, enabled=True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " last_access REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key):
+        """
+        Return the cached response for the key, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                row = conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] > self.max_age_seconds:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    conn.commit()
+                    self.evictions += 1
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+                self.hits += 1
+                return json.loads(row[0])
+            except (sqlite3.Error, ValueError) as e:
+                logging.error(f"Error reading LLM response cache: {e}")
+                self.misses += 1
+                return None
+
+    def put(self, key, response):
+        """
+        Store a response and evict expired or least recently used entries to stay within the limits.
+        """
+        if not self.enabled:
+            return
+
+        data = json.dumps(response)
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute("INSERT OR REPLACE INTO responses (key, response, size, created, last_access) "
+                             "VALUES (?, ?, ?, ?, ?)", (key, data, len(data), now, now))
+                self.stores += 1
+                self._evict(conn, now)
+                conn.commit()
+            except sqlite3.Error as e:
+                logging.error(f"Error writing LLM response cache: {e}")
+
+    def _evict(self, conn, now):
+        cursor = conn.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age_seconds,))
+        self.evictions += cursor.rowcount
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Remove every cached response.
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+    def stats(self):
+        """
+        Return the hit/miss statistics of this run.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def log_cache_stats(cache):
+    """
+    Log the cache statistics, if the cache was used in this run.
+    """
+    if not cache.enabled:
+        logging.info("LLM response cache bypassed")
+        return
+    stats = cache.stats()
+    if stats["hits"] + stats["misses"] == 0:
+        return
+    logging.info(f"LLM response cache: {stats['hits']} hits, {stats['misses']} misses "
+                 f"({stats['hit_rate']:.0%} hit rate), {stats['stores']} stored, {stats['evictions']} evicted "
+                 f"[{os.path.basename(cache.path)}]")
@@ -0,0 +1,370 @@
+import collections
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+
+
+# Import the percentiles of the run report, used for the hedging delay
+from instrumentation import percentile
+
+
+# Import the client side rate limiter, one per deployment
+from ratelimit import AdaptiveRateLimiter, retry_after_seconds, log_limiter_stats, SUCCEEDED, THROTTLED, FAILED
+
+
+"""
+    Routing of the LLM requests over several Azure OpenAI deployments, e.g. the same model
+    deployed in more than one region, so that one slow or throttled deployment no longer
+    stalls every ticket.
+
+      - Each request goes to a healthy deployment chosen at random in proportion to its weight.
+        A deployment of weight 0 is a standby, only used when no other is healthy.
+      - A deployment that throttles a request (429) is left out until its Retry-After has
+        passed, and one that fails FAILURE_THRESHOLD requests in a row (connection errors or
+        5xx) for FAILURE_COOLDOWN seconds. The request itself fails over to another deployment
+        straight away.
+      - Hedged requests, for interactive runs: when the answer has not arrived after the usual
+        latency of the deployment, the same request is sent to a second deployment and the
+        first successful answer is used. The other one is closed when it arrives. The delay is
+        the p95 latency, but at most HEDGE_P50_FACTOR times the median: a few slow answers among
+        the recent ones would otherwise raise the p95 to the very latency hedging should cut.
+
+    Every deployment has its own rate limiter (ratelimit.py), as quotas are per deployment.
+    The deployments must serve the same model: the LLM response cache does not tell them apart.
+"""
+
+
+# Failed requests in a row that take a deployment out of rotation, and for how long
+FAILURE_THRESHOLD = 3
+FAILURE_COOLDOWN = 30.0
+
+# Latencies kept per deployment, and the number needed before they set the hedging delay
+LATENCY_SAMPLES = 100
+MIN_LATENCY_SAMPLES = 20
+
+# The hedging delay is at most this many times the median latency of the deployment
+HEDGE_P50_FACTOR = 1.5
+
+# Threads sending the hedged requests
+HEDGE_WORKERS = 32
+
+# Fields of an AI_DEPLOYMENTS entry
+DEPLOYMENT_FIELDS = ("name", "base_path", "deployment", "api_key", "api_version", "weight",
+                     "tokens_per_minute", "requests_per_minute")
+
+
+class Deployment:
+    """
+    One Azure OpenAI deployment: its endpoint and API key, its share of the requests (weight),
+    its rate limiter and its health. Latencies are kept apart for blocking requests and for
+    streamed ones, whose latency is the time to the response headers.
+    """
+    def __init__(self, name, base_path, deployment, api_key, api_version, weight=1.0, limiter=None):
+        self.name = name
+        self.endpoint = f"{base_path}/{deployment}/chat/completions?api-version={api_version}"
+        self.api_key = api_key
+        self.weight = float(weight)
+        self.limiter = limiter if limiter is not None else AdaptiveRateLimiter()
+        self.latencies = {False: collections.deque(maxlen=LATENCY_SAMPLES),
+                          True: collections.deque(maxlen=LATENCY_SAMPLES)}
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.unavailable_until = 0.0
+        self._lock = threading.Lock()
+
+    def healthy(self, now=None):
+        return (time.monotonic() if now is None else now) >= self.unavailable_until
+
+    def record_success(self, latency, stream):
+        with self._lock:
+            self.requests += 1
+            self.consecutive_failures = 0
+            self.latencies[stream].append(latency)
+
+    def record_throttled(self, retry_after):
+        with self._lock:
+            self.requests += 1
+            self.unavailable_until = max(self.unavailable_until, time.monotonic() + retry_after)
+
+    def record_failure(self, down=False):
+        """
+        Count a failed request. The deployment is taken out of rotation after FAILURE_THRESHOLD
+        failures in a row, or at once when it is down (the connection failed).
+        """
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.consecutive_failures += 1
+            if down or self.consecutive_failures >= FAILURE_THRESHOLD:
+                self.unavailable_until = time.monotonic() + FAILURE_COOLDOWN
+                logging.warning(f"LLM deployment {self.name} failing, left out for {FAILURE_COOLDOWN:.0f}s")
+
+    def latency_percentile(self, stream, p):
+        """
+        Return the p-th percentile latency of the recent requests, or None until there are
+        enough of them.
+        """
+        with self._lock:
+            samples = list(self.latencies[stream])
+        return percentile(samples, p) if len(samples) >= MIN_LATENCY_SAMPLES else None
+
+    def latency_p95(self, stream):
+        return self.latency_percentile(stream, 95)
+
+    def hedge_delay(self, stream, default):
+        """
+        How long to wait for an answer before hedging: the p95 latency, capped at HEDGE_P50_FACTOR
+        times the median and at default, which is used alone until the latencies are known.
+        """
+        p95, p50 = self.latency_p95(stream), self.latency_percentile(stream, 50)
+        if p95 is None:
+            return default
+        return min(p95, HEDGE_P50_FACTOR * p50, default)
+
+    def stats(self):
+        p95 = self.latency_p95(False)
+        return {"requests": self.requests, "failures": self.failures, "healthy": self.healthy(),
+                "weight": self.weight, "p95_seconds": round(p95, 3) if p95 is not None else None,
+                "limiter": self.limiter.stats()}
+
+
+class DeploymentRouter:
+    """
+    Send chat completions requests to a list of deployments, with failover and optional hedging.
+    A request is attempted up to max_attempts times in all. hedge_delay is the delay before a
+    hedged request until the deployment's own latencies are known, and the longest delay after.
+    """
+    def __init__(self, deployments, max_attempts=6, hedge_delay=10.0, seed=None):
+        if not deployments:
+            raise ValueError("No Azure OpenAI deployment configured")
+        self.deployments = list(deployments)
+        self.max_attempts = max(1, max_attempts)
+        self.hedge_delay = hedge_delay
+        self.failovers = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def choose(self, exclude=()):
+        """
+        Pick a deployment for a request, leaving out those in exclude unless there is no other:
+        a healthy one at random by weight, the standbys if no weighted one is healthy, or else
+        the one that will be available again first.
+        """
+        candidates = [d for d in self.deployments if d not in exclude] or self.deployments
+        now = time.monotonic()
+        healthy = [d for d in candidates if d.healthy(now)]
+        if not healthy:
+            return min(candidates, key=lambda d: d.unavailable_until)
+        weighted = [d for d in healthy if d.weight > 0]
+        with self._lock:
+            if weighted:
+                return self._random.choices(weighted, weights=[d.weight for d in weighted])[0]
+            return self._random.choice(healthy)
+
+    def _send(self, deployment, session, request_body, estimated_tokens, stream):
+        """
+        One attempt on one deployment. Returns (deployment, response, error); the deployment's
+        limiter slot is held until _release().
+        """
+        import requests
+        deployment.limiter.acquire(estimated_tokens)
+        start = time.perf_counter()
+        try:
+            response = session.post(deployment.endpoint, json=request_body, stream=stream,
+                                    headers={"api-key": deployment.api_key})
+        except Exception as e:
+            deployment.limiter.release(FAILED)
+            if isinstance(e, requests.exceptions.RequestException):
+                deployment.record_failure(down=isinstance(e, requests.exceptions.ConnectionError))
+            return deployment, None, e
+        deployment.limiter.update_from_headers(response.headers)
+        if response.status_code == 429:
+            deployment.record_throttled(retry_after_seconds(response.headers))
+        elif response.status_code >= 500:
+            deployment.record_failure()
+        else:
+            deployment.record_success(time.perf_counter() - start, stream)
+        return deployment, response, None
+
+    def _release(self, deployment, response):
+        response.close()
+        if response.status_code == 429:
+            deployment.limiter.release(THROTTLED, retry_after_seconds(response.headers))
+        else:
+            deployment.limiter.release(FAILED if response.status_code >= 500 else SUCCEEDED)
+
+    def _discard(self, future):
+        deployment, response, _ = future.result()
+        if response is not None:
+            self._release(deployment, response)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+            return self._executor
+
+    def _send_hedged(self, primary, session, request_body, estimated_tokens, stream, exclude):
+        """
+        Send the request to primary and, if no answer has arrived after its hedging delay, to a
+        second deployment as well. Returns the first successful outcome, or the primary's if
+        neither succeeds; the other response is released when it arrives. Without another
+        deployment to send it to, the request is not hedged: the same deployment would most
+        likely be as slow again, and the hedge would only use its quota.
+        """
+        if not any(d is not primary and d not in exclude for d in self.deployments):
+            return self._send(primary, session, request_body, estimated_tokens, stream)
+        delay = primary.hedge_delay(stream, self.hedge_delay)
+        executor = self._get_executor()
+        futures = [executor.submit(self._send, primary, session, request_body, estimated_tokens, stream)]
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            backup = self.choose(exclude=set(exclude) | {primary})
+            with self._lock:
+                self.hedged += 1
+            logging.info(f"LLM request on {primary.name} slower than {delay:.2f}s, hedging on {backup.name}")
+            futures.append(executor.submit(self._send, backup, session, request_body, estimated_tokens, stream))
+
+        winner = None
+        pending = set(futures)
+        while pending and winner is None:
+            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in futures:
+                if future.done() and future.result()[1] is not None and future.result()[1].ok:
+                    winner = future
+                    break
+        if winner is None:
+            winner = futures[0]
+        elif winner is not futures[0]:
+            with self._lock:
+                self.hedge_wins += 1
+
+        for future in futures:
+            if future is not winner:
+                future.add_done_callback(self._discard)
+        return winner.result()
+
+    @contextmanager
+    def request(self, session, request_body, estimated_tokens, stream=False, hedge=False):
+        """
+        POST a chat completions request and yield the response, failing over to another
+        deployment after a 429, a server error or a connection failure. When every deployment
+        has been tried, a throttled request waits for its Retry-After before the next attempt.
+        The last response is yielded whatever its status.
+        """
+        import requests
+        tried = set()
+        for attempt in range(self.max_attempts):
+            last_attempt = attempt == self.max_attempts - 1
+            deployment = self.choose(exclude=tried)
+            if hedge:
+                deployment, response, error = self._send_hedged(deployment, session, request_body,
+                                                                estimated_tokens, stream, tried)
+            else:
+                deployment, response, error = self._send(deployment, session, request_body,
+                                                         estimated_tokens, stream)
+            tried.add(deployment)
+            can_fail_over = not last_attempt and any(d not in tried for d in self.deployments)
+
+            if error is not None:
+                if not can_fail_over or not isinstance(error, requests.exceptions.RequestException):
+                    raise error
+                self._fail_over(deployment, f"request failed ({error})")
+                continue
+
+            if response.status_code == 429 and not last_attempt:
+                retry_after = retry_after_seconds(response.headers)
+                self._release(deployment, response)
+                if can_fail_over:
+                    self._fail_over(deployment, "throttled (429)")
+                    continue
+                logging.warning(f"LLM request throttled (429), retrying in {retry_after:.1f}s")
+                deployment.limiter.backoff(retry_after)
+                continue
+
+            if response.status_code >= 500 and can_fail_over:
+                self._release(deployment, response)
+                self._fail_over(deployment, f"server error {response.status_code}")
+                continue
+
+            try:
+                yield response
+            finally:
+                self._release(deployment, response)
+            return
+
+    def _fail_over(self, deployment, reason):
+        with self._lock:
+            self.failovers += 1
+        logging.warning(f"LLM deployment {deployment.name}: {reason}, failing over")
+
+    def health(self):
+        return {d.name: "ok" if d.healthy() else "unavailable" for d in self.deployments}
+
+    def stats(self):
+        with self._lock:
+            counts = {"failovers": self.failovers, "hedged": self.hedged, "hedge_wins": self.hedge_wins}
+        return dict(counts, deployments={d.name: d.stats() for d in self.deployments})
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+def load_deployments(settings):
+    """
+    Build the deployments from the AI_DEPLOYMENTS setting: a list of objects with any of the
+    DEPLOYMENT_FIELDS. Omitted fields take the values of the single deployment settings
+    (AZURE_OPENAI_BASE_PATH, AZURE_OPENAI_API_EMBEDDINGS_DEPLOYMENT_NAME, AI_API_TOKEN,
+    AZURE_OPENAI_API_VERSION, AI_TOKENS_PER_MINUTE and AI_REQUESTS_PER_MINUTE), and without
+    AI_DEPLOYMENTS those settings make the only deployment. Raises ValueError for an invalid entry.
+    """
+    entries = settings.AI_DEPLOYMENTS or [{}]
+    deployments = []
+    for n, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict):
+            raise ValueError(f"AI_DEPLOYMENTS entry {n} is not an object")
+        unknown = sorted(set(entry) - set(DEPLOYMENT_FIELDS))
+        if unknown:
+            raise ValueError(f"AI_DEPLOYMENTS entry {n} has unknown field(s): {', '.join(unknown)}")
+        deployment = entry.get("deployment", settings.AZURE_OPENAI_API_EMBEDDINGS_DEPLOYMENT_NAME)
+        limiter = AdaptiveRateLimiter(entry.get("tokens_per_minute", settings.AI_TOKENS_PER_MINUTE),
+                                      entry.get("requests_per_minute", settings.AI_REQUESTS_PER_MINUTE),
+                                      settings.AI_MAX_CONCURRENCY, adaptive=settings.AI_ADAPTIVE_CONCURRENCY)
+        deployments.append(Deployment(entry.get("name") or (f"deployment-{n}" if len(entries) > 1 else deployment or "default"),
+                                      entry.get("base_path", settings.AZURE_OPENAI_BASE_PATH), deployment,
+                                      entry.get("api_key", settings.AI_API_TOKEN),
+                                      entry.get("api_version", settings.AZURE_OPENAI_API_VERSION),
+                                      weight=entry.get("weight", 1.0), limiter=limiter))
+    names = [d.name for d in deployments]
+    if len(set(names)) != len(names):
+        raise ValueError(f"AI_DEPLOYMENTS names must be unique: {', '.join(names)}")
+    return deployments
+
+
+def log_router_stats(router):
+    """
+    Log the rate limiting of each deployment and, with several deployments or hedging, how the
+    requests were spread.
+    """
+    several = len(router.deployments) > 1
+    for deployment in router.deployments:
+        log_limiter_stats(deployment.limiter, deployment.name if several else None)
+    stats = router.stats()
+    if several:
+        for name, deployment in stats["deployments"].items():
+            p95 = f"{deployment['p95_seconds']:.2f}s" if deployment['p95_seconds'] is not None else "n/a"
+            logging.info(f"LLM deployment {name}: {deployment['requests']} requests, "
+                         f"{deployment['failures']} failed, p95 latency {p95}")
+    if stats["failovers"] or stats["hedged"]:
+        logging.info(f"LLM routing: {stats['failovers']} failovers, {stats['hedged']} hedged requests "
+                     f"({stats['hedge_wins']} answered first by the hedge)")
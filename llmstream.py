@@ -0,0 +1,109 @@
+import json
+import logging
+
+
+"""
+    Streaming support for LLM responses.
+
+    With "stream": true the chat completions endpoint sends the answer as server-sent events, one
+    small content delta per event. iter_sse_content() turns the event stream into text chunks and
+    TestCaseStreamParser scans those chunks as they arrive, handing back each object of the
+    "testCases" array as soon as its closing brace is seen - long before the model has finished
+    the whole answer. Leading prose or a ```json fence before the JSON object is ignored.
+"""
+
+
+def iter_sse_content(lines):
+    """
+    Yield the content deltas from the lines of a chat completions server-sent event stream.
+    """
+    for line in lines:
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        try:
+            event = json.loads(data)
+        except json.JSONDecodeError as e:
+            logging.error(f"Unreadable event in LLM stream: {e}")
+            continue
+        for choice in event.get("choices", []):
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                yield content
+
+
+class TestCaseStreamParser:
+    """
+    Incremental scanner for the LLM's JSON answer. feed() takes the next chunk of text and returns
+    the test cases whose objects were completed by it, parsed into dictionaries.
+    Only enough of the text is kept to parse the test case currently being received.
+    """
+    def __init__(self, array_key="testCases"):
+        self.array_key = array_key
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.root_key = None          # last key seen in the root object
+        self.key_chars = None         # characters of a root-level string being read
+        self.array_depth = None       # depth inside the testCases array
+        self.item_buffer = None       # text of the test case being read
+        self.emitted = 0
+
+    def feed(self, text):
+        completed = []
+        for ch in text:
+            if not self.started:
+                # Skip anything before the JSON object, e.g. prose or a ```json fence
+                if ch != "{":
+                    continue
+                self.started = True
+
+            if self.item_buffer is not None:
+                self.item_buffer.append(ch)
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.key_chars is not None:
+                        self.root_key = "".join(self.key_chars)
+                        self.key_chars = None
+                elif self.key_chars is not None:
+                    self.key_chars.append(ch)
+                continue
+
+            if ch == '"':
+                self.in_string = True
+                if self.depth == 1:
+                    self.key_chars = []
+            elif ch in "{[":
+                if ch == "[" and self.depth == 1 and self.root_key == self.array_key:
+                    self.array_depth = 2
+                elif ch == "{" and self.array_depth is not None and self.depth == self.array_depth:
+                    self.item_buffer = ["{"]
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.array_depth is not None and self.depth == self.array_depth and self.item_buffer is not None:
+                    item = self._parse_item("".join(self.item_buffer))
+                    self.item_buffer = None
+                    if item is not None:
+                        completed.append(item)
+                elif self.array_depth is not None and self.depth < self.array_depth:
+                    self.array_depth = None
+        return completed
+
+    def _parse_item(self, text):
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError as e:
+            logging.error(f"Could not parse streamed test case: {e}")
+            return None
+        self.emitted += 1
+        return item
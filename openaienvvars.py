@@ -1,26 +1,294 @@
 # Atlassian JIRA and OpenAI Environment Variables
+import json
+import logging
 import os
+import threading
+
+
+"""
+    Settings of the tool: JIRA and Azure OpenAI endpoints and credentials, HTTP, cache, prompt,
+    export and cost settings.
+
+    Nothing is read when this module is imported. The settings are resolved the first time one
+    of them is used, e.g. config.JIRA_BASE_URL, from (highest precedence first):
+
+        1. overrides given on the command line (app.py --set NAME=VALUE)
+        2. environment variables, e.g. to point the tool at the local fake services in fakeservers.py
+        3. the key file: SNR_Azure_OpenAI_Key.txt next to this module, or the file named by
+           --env-file or the OPENAI_ENV_FILE environment variable (NAME=VALUE lines, dotenv style)
+        4. the defaults below
+
+    A missing key file is not an error here; validate_JIRA_env_vars() and
+    validate_OpenAI_env_vars() report the settings that are still missing when they are needed.
+"""
+
+
+_MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The key file with the credentials, looked up next to the code rather than in the current directory
+DEFAULT_ENV_FILE = os.path.join(_MODULE_DIR, 'SNR_Azure_OpenAI_Key.txt')
+
 
 def load_environment_variables(file_path):
+    """
+    Load the NAME=VALUE lines of a dotenv style file into the environment. Blank lines, comments,
+    'export ' prefixes and quotes around values are allowed. Variables already set in the
+    environment take precedence over the file. Returns False if the file does not exist.
+    """
+    if not os.path.exists(file_path):
+        return False
     with open(file_path) as f:
         for line in f:
-            name, value = line.strip().split('=', 1)
-            os.environ[name] = value
-
-# Load environment variables from the file
-load_environment_variables('SNR_Azure_OpenAI_Key.txt')
-
-# Load OpenAI environment variables
-AZURE_OPENAI_BASE_PATH = os.getenv('AZURE_OPENAI_BASE_PATH')
-AI_API_TOKEN = os.getenv('AI_API_TOKEN')
-AZURE_OPENAI_API_EMBEDDINGS_DEPLOYMENT_NAME = os.getenv('AZURE_OPENAI_API_EMBEDDINGS_DEPLOYMENT_NAME')
-AZURE_OPENAI_API_INSTANCE_NAME = os.getenv('AZURE_OPENAI_API_INSTANCE_NAME')
-AZURE_OPENAI_API_VERSION = os.getenv('AZURE_OPENAI_API_VERSION')
-
-
-# Load JIRA environment variables
-JIRA_BASE_URL = "https://netreveal.atlassian.net"
-JIRA_RETRIEVE_ENDPOINT = "https://netreveal.atlassian.net/rest/api/2/issue/{}?fields=description%2Ccomment%2Csummary"
-JIRA_CREATE_ENDPOINT = "https://netreveal.atlassian.net/rest/api/2/issue"
-JIRA_USER_NAME = os.getenv('JIRA_USER_NAME', "not_found")
-JIRA_API_TOKEN = os.getenv('JIRA_API_TOKEN', "not_found")
\ No newline at end of file
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            name, value = line.split('=', 1)
+            name = name.strip()
+            if name.startswith('export '):
+                name = name[len('export '):].strip()
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in ('"', "'"):
+                value = value[1:-1]
+            os.environ.setdefault(name, value)
+    return True
+
+
+_TRUE = ('1', 'true', 'yes', 'on', 'y')
+_FALSE = ('0', 'false', 'no', 'off', 'n')
+
+
+def _flag(value):
+    value = str(value).strip().lower()
+    if value in _TRUE:
+        return True
+    if value in _FALSE:
+        return False
+    raise ValueError(f"expected one of {', '.join(_TRUE + _FALSE)}")
+
+
+def _url(value):
+    return value.rstrip('/')
+
+
+def _json_list(value):
+    # A JSON list, given inline or as the path of a JSON file
+    value = value.strip()
+    if not value:
+        return []
+    if not value.startswith('['):
+        try:
+            with open(value) as f:
+                value = f.read()
+        except OSError as e:
+            raise ValueError(f"cannot read {value}: {e}")
+    parsed = json.loads(value)
+    if not isinstance(parsed, list):
+        raise ValueError("expected a JSON list")
+    return parsed
+
+
+# Every setting: its default and the conversion from the environment variable string
+SETTINGS = {
+    # Azure OpenAI
+    'AZURE_OPENAI_BASE_PATH': (None, str),
+    'AI_API_TOKEN': (None, str),
+    'AZURE_OPENAI_API_EMBEDDINGS_DEPLOYMENT_NAME': (None, str),
+    'AZURE_OPENAI_API_INSTANCE_NAME': (None, str),
+    'AZURE_OPENAI_API_VERSION': (None, str),
+    # Several deployments of the model to spread the requests over (llmrouter.py): a JSON list of
+    # {"name", "base_path", "deployment", "api_key", "api_version", "weight", "tokens_per_minute",
+    # "requests_per_minute"} objects, or the path of a JSON file holding one. Omitted fields take
+    # the settings above. Empty: the one deployment of the settings above.
+    'AI_DEPLOYMENTS': ('', _json_list),
+    # Hedged LLM requests: send a slow request to a second deployment as well after the p95
+    # latency of the first, or after AI_HEDGE_DELAY seconds until that is known
+    'AI_HEDGE_REQUESTS': ('false', _flag),
+    'AI_HEDGE_DELAY': ('10', float),
+
+    # JIRA. JIRA_BASE_URL can be overridden, e.g. to point at the local fake JIRA server in fakeservers.py
+    'JIRA_BASE_URL': ("https://netreveal.atlassian.net", _url),
+    'JIRA_USER_NAME': ("not_found", str),
+    'JIRA_API_TOKEN': ("not_found", str),
+    # Bulk extraction through the JIRA search endpoint: issues per page and pages fetched at the same time
+    'JIRA_SEARCH_PAGE_SIZE': ('50', int),
+    'JIRA_SEARCH_WORKERS': ('4', int),
+
+    # HTTP connection settings shared by the JIRA and Azure OpenAI clients
+    # The pool size should be at least the number of concurrent workers in batch mode
+    'HTTP_POOL_SIZE': ('10', int),
+    'HTTP_CONNECT_TIMEOUT': ('10', float),
+    'JIRA_READ_TIMEOUT': ('30', float),
+    'AI_READ_TIMEOUT': ('120', float),
+    'HTTP_MAX_RETRIES': ('5', int),
+    'HTTP_BACKOFF_FACTOR': ('1', float),
+
+    # LLM response cache settings
+    'LLM_CACHE_PATH': (os.path.join(_MODULE_DIR, '.llm_cache.sqlite'), str),
+    'LLM_CACHE_ENABLED': ('true', _flag),
+    'LLM_CACHE_MAX_MB': ('200', float),
+    'LLM_CACHE_MAX_AGE_DAYS': ('30', float),
+
+    # Record of the tickets test cases have been generated for, used by incremental mode
+    'TICKET_STATE_PATH': (os.path.join(_MODULE_DIR, '.ticket_state.sqlite'), str),
+
+    # Journal of the stages each ticket of a batch run completed, used to resume an interrupted
+    # run (jobjournal.py, app.py --resume); runs older than JOB_JOURNAL_MAX_AGE_DAYS are dropped
+    'JOB_JOURNAL_PATH': (os.path.join(_MODULE_DIR, '.job_journal.sqlite'), str),
+    'JOB_JOURNAL_ENABLED': ('true', _flag),
+    'JOB_JOURNAL_MAX_AGE_DAYS': ('14', float),
+
+    # Prompt budget: the context window of the deployed model, and the maximum number of prompts
+    # a large ticket's comments may be split over (queried in parallel)
+    'AI_CONTEXT_TOKENS': ('8192', int),
+    'AI_PROMPT_MAX_CHUNKS': ('3', int),
+
+    # Client side rate limiting of the Azure OpenAI deployment (ratelimit.py): the deployment's
+    # tokens and requests per minute quotas (0 = not configured, taken from the response headers
+    # if the service sends them), the most concurrent LLM requests, and whether that number adapts
+    # to throttling
+    'AI_TOKENS_PER_MINUTE': ('0', int),
+    'AI_REQUESTS_PER_MINUTE': ('0', int),
+    'AI_MAX_CONCURRENCY': ('16', int),
+    'AI_ADAPTIVE_CONCURRENCY': ('true', _flag),
+
+    # Near-duplicate detection (dedup.py, app.py --dedup): tickets at least DEDUP_TICKET_THRESHOLD
+    # similar to a ticket generated before reuse its test cases, and test cases at least
+    # DEDUP_TEST_CASE_THRESHOLD similar to one already exported for the EPIC are dropped
+    'DEDUP_ENABLED': ('false', _flag),
+    'DEDUP_TICKET_THRESHOLD': ('0.9', float),
+    'DEDUP_TEST_CASE_THRESHOLD': ('0.85', float),
+
+    # Worker processes for the CPU-bound post-processing (procpool.py, app.py --processes): building
+    # the workbooks and the test case signatures of --dedup. 0 = in the threads of the run
+    'POSTPROCESS_PROCESSES': ('0', int),
+
+    # Structured output mode for the LLM answer: unset, 'json_object' or 'json_schema'
+    'AI_RESPONSE_FORMAT': ('', str),
+    # Number of targeted re-queries when the LLM answer cannot be parsed as JSON
+    'AI_PARSE_RETRIES': ('1', int),
+
+    # Direct upload of the test cases (exporters.py): the test issues are created in JIRA in bulk
+    # and their steps added through the Zephyr API
+    'ZEPHYR_BASE_URL': ("https://api.zephyrscale.smartbear.com/v2", _url),
+    'ZEPHYR_API_TOKEN': ("not_found", str),
+    'ZEPHYR_PROJECT_KEY': ("CETASKS", str),
+    'ZEPHYR_TEST_ISSUE_TYPE': ("Test", str),
+    # JIRA accepts up to 50 issues per bulk create request
+    'ZEPHYR_CREATE_BATCH_SIZE': ('50', int),
+    'ZEPHYR_UPLOAD_WORKERS': ('8', int),
+    'ZEPHYR_REQUESTS_PER_SECOND': ('20', float),
+
+    # LLM prices per 1,000 tokens, used to estimate the cost of a run in the run report
+    'AI_PROMPT_COST_PER_1K': ('0.03', float),
+    'AI_COMPLETION_COST_PER_1K': ('0.06', float),
+}
+
+
+def _derived_settings(values):
+    """
+    Settings computed from the others: the JIRA REST endpoints.
+    """
+    base_url = values['JIRA_BASE_URL']
+    return {
+        'JIRA_RETRIEVE_ENDPOINT': base_url + "/rest/api/2/issue/{}?fields=description%2Ccomment%2Csummary%2Cupdated",
+        'JIRA_UPDATED_ENDPOINT': base_url + "/rest/api/2/issue/{}?fields=updated",
+        'JIRA_CREATE_ENDPOINT': base_url + "/rest/api/2/issue",
+        'JIRA_SEARCH_ENDPOINT': base_url + "/rest/api/2/search",
+        'JIRA_BULK_CREATE_ENDPOINT': base_url + "/rest/api/2/issue/bulk",
+    }
+
+
+class Config:
+    """
+    The settings, resolved on first use and then kept for the run. Settings are read as
+    attributes, e.g. config.HTTP_POOL_SIZE. use_env_file() and override() reset the resolved
+    settings, so they take effect for everything that reads a setting afterwards.
+    """
+    def __init__(self, env_file=None):
+        self.env_file = env_file
+        self.overrides = {}
+        self._values = None
+        self._lock = threading.Lock()
+
+    def use_env_file(self, env_file):
+        with self._lock:
+            self.env_file = env_file
+            self._values = None
+
+    def override(self, **values):
+        """
+        Override settings, e.g. from the command line. Raises ValueError for an unknown setting.
+        """
+        unknown = sorted(set(values) - set(SETTINGS))
+        if unknown:
+            raise ValueError(f"Unknown setting(s): {', '.join(unknown)}")
+        with self._lock:
+            self.overrides.update(values)
+            self._values = None
+
+    def _resolve(self):
+        with self._lock:
+            if self._values is not None:
+                return self._values
+            env_file = self.env_file or os.getenv('OPENAI_ENV_FILE') or DEFAULT_ENV_FILE
+            if not load_environment_variables(env_file):
+                logging.debug(f"Key file {env_file} not found, using the environment only")
+
+            values = {}
+            for name, (default, convert) in SETTINGS.items():
+                value = self.overrides.get(name, os.getenv(name, default))
+                try:
+                    values[name] = value if value is None else convert(value)
+                except ValueError:
+                    raise ValueError(f"Invalid value for setting {name}: {value!r}")
+            values.update(_derived_settings(values))
+            self._values = values
+            return values
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        values = self._resolve()
+        if name not in values:
+            raise AttributeError(f"Unknown setting {name}")
+        return values[name]
+
+    def as_dict(self):
+        return dict(self._resolve())
+
+
+# The settings of the run, shared by every module
+config = Config()
+
+
+def __getattr__(name):
+    # Module level access to a setting, e.g. from openaienvvars import JIRA_BASE_URL, resolves the
+    # settings at that point; modules that should not read them at import time use config.NAME
+    if name in SETTINGS or name in _derived_settings({'JIRA_BASE_URL': ''}):
+        return getattr(config, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class LazyObject:
+    """
+    Stand-in for a module level object that is built from the settings, such as the LLM
+    response cache: the factory is called the first time one of its attributes is used, so
+    importing the module reads no settings and command line overrides still apply.
+    """
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_target', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _get(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    object.__setattr__(self, '_target', self._factory())
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get(), name, value)
@@ -0,0 +1,155 @@
+import logging
+import queue
+import threading
+import time
+
+
+"""
+    A staged producer/consumer pipeline used by batch mode.
+
+    Each stage has its own pool of worker threads and a bounded input queue. A worker takes an item
+    from its queue, runs the stage function and hands the result to the next stage's queue. When the
+    next queue is full the worker blocks, so a slow stage (the LLM query) applies backpressure on the
+    stages in front of it instead of letting fetched tickets pile up in memory, while the faster
+    stages keep the slow stage saturated.
+
+    An item whose stage function raises is taken out of the pipeline and reported with the name of
+    the stage that failed; the other items carry on.
+"""
+
+
+# Marks the end of the input for a stage's workers
+_END = object()
+
+
+class Stage:
+    """
+    One step of the pipeline: a function applied to every item, run by a pool of worker threads.
+    """
+    def __init__(self, name, func, workers=1, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        # By default allow a couple of items per worker to wait in the queue
+        self.queue_size = queue_size if queue_size is not None else 2 * self.workers
+        self.busy_time = 0.0
+        self.processed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, ok):
+        with self._lock:
+            self.busy_time += elapsed
+            self.processed += 1
+            if not ok:
+                self.failed += 1
+
+
+class PipelineResult:
+    """
+    Outcome of one input item: the value produced by the last stage, or the error and the stage it failed in.
+    """
+    def __init__(self, index, item):
+        self.index = index
+        self.item = item
+        self.value = item
+        self.error = None
+        self.failed_stage = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class Pipeline:
+    """
+    Run items through a list of stages connected by bounded queues.
+    """
+    def __init__(self, stages):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+
+    def run(self, items, on_result=None):
+        """
+        Feed the items through every stage and return a PipelineResult per item, in input order.
+        on_result, if given, is called with each PipelineResult as soon as the item completes or
+        fails, and the results are left to it: run() then returns an empty list, so that a
+        pipeline fed for the life of a process does not keep every item it has seen.
+        """
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        results = []
+        results_lock = threading.Lock()
+
+        def finish(result):
+            if on_result is None:
+                with results_lock:
+                    results.append(result)
+            else:
+                try:
+                    on_result(result)
+                except Exception as e:
+                    logging.error(f"Error in pipeline result callback: {e}")
+
+        def worker(stage_index):
+            stage = self.stages[stage_index]
+            in_queue = queues[stage_index]
+            is_last = stage_index == len(self.stages) - 1
+
+            while True:
+                result = in_queue.get()
+                if result is _END:
+                    break
+
+                start = time.perf_counter()
+                try:
+                    result.value = stage.func(result.value)
+                    ok = True
+                except Exception as e:
+                    result.error = e
+                    result.failed_stage = stage.name
+                    ok = False
+                stage.record(time.perf_counter() - start, ok)
+
+                if not ok or is_last:
+                    finish(result)
+                else:
+                    # Blocks while the next stage is busy: this is the backpressure
+                    queues[stage_index + 1].put(result)
+
+        # Start the worker pools
+        pools = []
+        for stage_index, stage in enumerate(self.stages):
+            threads = [threading.Thread(target=worker, args=(stage_index,),
+                                        name=f"{stage.name}-{n}", daemon=True)
+                       for n in range(stage.workers)]
+            for t in threads:
+                t.start()
+            pools.append(threads)
+
+        # Feed the first stage, then shut the stages down in order once each one has drained.
+        # Items may come from a generator (e.g. search results arriving page by page); if it
+        # raises, the items already fed still complete before the error is passed on.
+        try:
+            for index, item in enumerate(items):
+                queues[0].put(PipelineResult(index, item))
+        finally:
+            for stage_index, threads in enumerate(pools):
+                for _ in threads:
+                    queues[stage_index].put(_END)
+                for t in threads:
+                    t.join()
+
+        results.sort(key=lambda r: r.index)
+        return results
+
+    def stage_summary(self, elapsed):
+        """
+        Describe how busy each stage was over the run, as a list of strings for logging.
+        """
+        lines = []
+        for stage in self.stages:
+            utilisation = stage.busy_time / (elapsed * stage.workers) if elapsed > 0 else 0.0
+            lines.append(f"{stage.name}: {stage.processed} items, {stage.failed} failed, "
+                         f"{stage.workers} workers, {utilisation:.0%} busy")
+        return lines
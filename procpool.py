@@ -0,0 +1,102 @@
+import logging
+import threading
+from concurrent.futures import Future
+
+
+# Import OpenAI Environment Variables
+from openaienvvars import config, LazyObject
+
+
+"""
+    A pool of processes for the CPU-bound post-processing of a run.
+
+    Once the network waits overlap (batch mode, pipeline.py), what is left is CPU work that the
+    threads of the run share one core for: signatures for near-duplicate test cases (dedup.py)
+    and writing the cells of the Zephyr workbooks (build_workbook in ZephyrImport.py). With
+    POSTPROCESS_PROCESSES (app.py --processes) above 0, the threads hand that work to this pool,
+    one ticket or one workbook per task, and wait for its result; with 0, the default, it runs
+    in the calling thread.
+
+    The pool is opt-in because a task costs about 5-10 ms to send to a process and its result
+    to come back. That only pays off with spare cores, and for tasks of tens of milliseconds or
+    more: a workbook of about 100 step rows takes about 50 ms to build. Decoding an LLM answer
+    takes 1-2 ms even for 1,000 steps, so the answers are decoded in the threads of the run.
+
+    The tasks are module level functions of plain data, so they can be sent to the processes,
+    and they report problems in their results rather than logging them. The processes are
+    started with 'spawn': forking a process that runs threads could copy a lock another thread
+    holds.
+"""
+
+
+class ProcessPool:
+    """
+    Run functions on up to processes worker processes, started when first needed, or in the
+    calling thread when processes is 0. The number of processes can be changed after close().
+    """
+    def __init__(self, processes=0):
+        self.processes = processes
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # multiprocessing and the process pool are only imported once a pool is needed
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+                logging.info(f"Post-processing on {self.processes} processes")
+            return self._executor
+
+    def submit(self, func, *args):
+        """
+        Start func(*args) and return its Future. Without processes it has already run.
+        """
+        if self.processes <= 0:
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            return self._get_executor().submit(func, *args)
+        except BrokenProcessPool:
+            # A process died, e.g. killed for its memory: start a new pool for the next tasks
+            self._discard_executor()
+            raise
+
+    def run(self, func, *args):
+        """
+        Return func(*args), computed in a worker process if there are any.
+        """
+        future = self.submit(func, *args)
+        if self.processes <= 0:
+            return future.result()
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._discard_executor()
+            raise
+
+    def _discard_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def close(self):
+        """
+        Stop the worker processes once their tasks are done.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+# The pool of the run, sized from the POSTPROCESS_PROCESSES setting when first used
+process_pool = LazyObject(lambda: ProcessPool(config.POSTPROCESS_PROCESSES))
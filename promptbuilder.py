@@ -0,0 +1,192 @@
+import json
+import logging
+import math
+import re
+import threading
+
+
+"""
+    Token-budgeted assembly of the LLM prompt for a filtered JIRA ticket.
+
+    The filtered ticket is compacted before it is sent: whitespace runs are collapsed, empty
+    values are dropped and single-key wrappers such as {"comment": {"comments": [...]}} or
+    {"author": {"displayName": "..."}} are flattened, and the JSON is written without spaces.
+
+    Tokens are counted locally so that the prompt fits the model's context window together with
+    the system prompt and the MAX_TOKENS reserved for the answer. The key, summary and description
+    always go in; comments are added most recent first. When a ticket has more comments than fit,
+    they are split over several prompts (chunks), each with the summary and description, which are
+    queried in parallel and whose test cases are merged. Comments beyond the last chunk are dropped.
+"""
+
+
+# Average number of characters per token for English text and JSON with GPT tokenizers
+CHARS_PER_TOKEN = 4
+
+# Tokens reserved for the chat message framing and as a safety margin on estimates
+PROMPT_OVERHEAD_TOKENS = 50
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                # tiktoken is optional and needs its encoding files to be available locally. Without it,
+                # tokens are estimated from the text length, which is close enough for budgeting.
+                # It is imported on first use to keep it out of the start-up time of the tool.
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except ImportError:
+                    pass
+                except Exception as e:
+                    logging.warning(f"tiktoken encoding not available, estimating token counts: {e}")
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text):
+    """
+    Count the tokens in text with tiktoken, or estimate them from the text length.
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def compact_value(value):
+    """
+    Recursively collapse whitespace, drop empty values and flatten single-key dictionaries.
+    """
+    if isinstance(value, str):
+        return _WHITESPACE.sub(" ", value).strip()
+    if isinstance(value, list):
+        items = [compact_value(v) for v in value]
+        return [v for v in items if v not in (None, "", [], {})]
+    if isinstance(value, dict):
+        items = {k: compact_value(v) for k, v in value.items()}
+        items = {k: v for k, v in items.items() if v not in (None, "", [], {})}
+        if len(items) == 1:
+            return next(iter(items.values()))
+        return items
+    return value
+
+
+def compact_ticket(reduced_ticket):
+    """
+    Compact a filtered JIRA ticket for the prompt. The 'fields' are lifted to the top level
+    next to the ticket key.
+    """
+    ticket = {"key": reduced_ticket.get("key")}
+    ticket.update(reduced_ticket.get("fields", {}))
+    compacted = {k: compact_value(v) for k, v in ticket.items()}
+    return {k: v for k, v in compacted.items() if v not in (None, "", [], {})}
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _truncate_to_tokens(text, max_tokens):
+    """
+    Cut text down to about max_tokens, keeping the beginning.
+    """
+    if max_tokens <= 0:
+        return ""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    return text[:int(len(text) * max_tokens / tokens)] + " [truncated]"
+
+
+def build_prompts(reduced_ticket, system_prompt, context_tokens, max_tokens, max_chunks=1):
+    """
+    Build the user prompt(s) for a filtered JIRA ticket within the token budget:
+    context_tokens of the model, less the system prompt and the max_tokens reserved for the answer.
+    Returns a list of at most max_chunks prompt strings; more than one only when the comments
+    do not fit in a single prompt.
+    """
+    budget = context_tokens - max_tokens - count_tokens(system_prompt) - PROMPT_OVERHEAD_TOKENS
+    if budget <= 0:
+        raise ValueError(f"No room for the ticket: the context of {context_tokens} tokens is taken "
+                         f"by the system prompt and the {max_tokens} tokens reserved for the answer")
+
+    ticket = compact_ticket(reduced_ticket)
+    comments = ticket.pop("comment", [])
+    if not isinstance(comments, list):
+        comments = [comments]
+
+    # The summary, description and any other fields always go in; cut the description if they
+    # alone are over budget
+    base_tokens = count_tokens(_dumps(ticket))
+    if base_tokens > budget and isinstance(ticket.get("description"), str):
+        other_tokens = base_tokens - count_tokens(_dumps(ticket["description"]))
+        ticket["description"] = _truncate_to_tokens(ticket["description"], budget - other_tokens)
+        base_tokens = count_tokens(_dumps(ticket))
+        logging.warning(f"{ticket.get('key')}: description truncated to fit the prompt budget")
+
+    if not comments:
+        return [_dumps(ticket)]
+
+    # Fill the chunks with the most recent comments first
+    by_recency = sorted(range(len(comments)), reverse=True,
+                        key=lambda i: (str(comments[i].get("updated", "")) if isinstance(comments[i], dict) else "", i))
+    chunks = [[]]
+    chunk_tokens = base_tokens
+    dropped = 0
+    for i in by_recency:
+        comment_tokens = count_tokens(_dumps(comments[i])) + 1
+        if chunk_tokens + comment_tokens > budget and chunks[-1]:
+            if len(chunks) == max_chunks:
+                dropped += 1
+                continue
+            chunks.append([])
+            chunk_tokens = base_tokens
+        if chunk_tokens + comment_tokens > budget:
+            # A single comment larger than a whole chunk is cut down to what is left
+            comment = dict(comments[i]) if isinstance(comments[i], dict) else {"body": comments[i]}
+            comment["body"] = _truncate_to_tokens(str(comment.get("body", "")), budget - chunk_tokens - 20)
+            comments[i] = comment
+            comment_tokens = count_tokens(_dumps(comment)) + 1
+        chunks[-1].append(i)
+        chunk_tokens += comment_tokens
+
+    if dropped:
+        logging.warning(f"{ticket.get('key')}: {dropped} oldest comments dropped to fit the prompt budget")
+
+    prompts = []
+    for n, chunk in enumerate(chunks, start=1):
+        prompt_ticket = dict(ticket)
+        if len(chunks) > 1:
+            prompt_ticket["note"] = (f"Comments part {n} of {len(chunks)}; generate test cases "
+                                     f"for the requirements covered by these comments")
+        # Present the chosen comments in their original order
+        prompt_ticket["comment"] = [comments[i] for i in sorted(chunk)]
+        prompts.append(_dumps(prompt_ticket))
+    return prompts
+
+
+def merge_test_cases(parsed_responses):
+    """
+    Merge the parsed LLM responses for the chunks of one ticket into one 'testCases' list.
+    Other top-level keys are taken from the first response that has them.
+    """
+    merged = {}
+    test_cases = []
+    for parsed in parsed_responses:
+        for k, v in parsed.items():
+            if k == "testCases":
+                test_cases.extend(v)
+            else:
+                merged.setdefault(k, v)
+    merged["testCases"] = test_cases
+    return merged
@@ -1,50 +1,182 @@
 
 import os
+import json
 import logging
 import re
-import requests
+from contextlib import contextmanager
 
 # Import OpenAI Environment Variables
-from openaienvvars import (AZURE_OPENAI_BASE_PATH, AI_API_TOKEN, 
-                       AZURE_OPENAI_API_EMBEDDINGS_DEPLOYMENT_NAME, 
-                       AZURE_OPENAI_API_INSTANCE_NAME, 
-                       AZURE_OPENAI_API_VERSION)
+from openaienvvars import config, LazyObject
 
 
+# Import the shared HTTP session support
+from httpclient import build_session, SharedSession, RETRY_STATUS_CODES
+
+
+# Import the on-disk cache of LLM responses
+from llmcache import LLMResponseCache, make_cache_key
+
+
+# Import the parsing of streamed (server-sent event) responses
+from llmstream import iter_sse_content
+
+
+# Import the routing over the deployments (each with its rate limiter) and the token counting of the prompts
+from llmrouter import DeploymentRouter, load_deployments
+from promptbuilder import count_tokens
+
 
-# Construct the correct URL
-AI_ENDPOINT = f"{AZURE_OPENAI_BASE_PATH}/{AZURE_OPENAI_API_EMBEDDINGS_DEPLOYMENT_NAME}/chat/completions?api-version={AZURE_OPENAI_API_VERSION}"
-    
 # Define additional parameters for the LLM prompt/response
 MAX_TOKENS = 1500
 TEMPERATURE = 0
 
 
+# Structured output: 'json_object' asks the model for JSON only, 'json_schema' for JSON that
+# matches TEST_CASES_SCHEMA (needs a model and API version that support it)
+RESPONSE_FORMATS = ("json_object", "json_schema")
+
+# The shape of the test cases expected by ZephyrImport.py
+TEST_CASES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "testCases": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "summary": {"type": "string"},
+                    "preconditions": {"type": "string"},
+                    "steps": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "step": {"type": "string"},
+                                "expectedResult": {"type": "string"}
+                            },
+                            "required": ["step", "expectedResult"]
+                        }
+                    },
+                    "postconditions": {"type": "string"}
+                },
+                "required": ["summary", "steps"]
+            }
+        },
+        "testDataAssumptions": {"type": "string"}
+    },
+    "required": ["testCases"]
+}
+
+# Selected with set_response_format(); until then AI_RESPONSE_FORMAT applies
+response_format_mode = None
+
+# Selected with set_hedging(); until then AI_HEDGE_REQUESTS applies
+hedging_mode = None
+
+
+def set_response_format(mode):
+    """
+    Select the structured output mode for this run: None, 'json_object' or 'json_schema'.
+    """
+    global response_format_mode
+    if mode is not None and mode not in RESPONSE_FORMATS:
+        raise ValueError(f"Unknown response format '{mode}', expected one of {', '.join(RESPONSE_FORMATS)}")
+    response_format_mode = mode
+
+
+def set_hedging(enabled):
+    """
+    Turn hedged LLM requests on or off for this run.
+    """
+    global hedging_mode
+    hedging_mode = enabled
+
+
+def _hedging():
+    return config.AI_HEDGE_REQUESTS if hedging_mode is None else hedging_mode
+
+
+def _response_format():
+    mode = response_format_mode or config.AI_RESPONSE_FORMAT
+    if mode == "json_object":
+        return {"type": "json_object"}
+    if mode == "json_schema":
+        return {"type": "json_schema",
+                "json_schema": {"name": "test_cases", "schema": TEST_CASES_SCHEMA}}
+    return None
+
+
+def _create_ai_session():
+    """
+    Build the Azure OpenAI session: pooled keep-alive connections, shared by the deployments,
+    each request carrying the API key of its deployment. The chat completion is retried on POST
+    as well after a server error. Throttled (429) requests are retried by the router instead, so
+    that the rate limiter learns from them; with several deployments a failed request is retried
+    once and then fails over to another deployment.
+    """
+    max_retries = config.HTTP_MAX_RETRIES if len(ai_router.deployments) == 1 else 1
+    session = build_session(config.HTTP_POOL_SIZE, (config.HTTP_CONNECT_TIMEOUT, config.AI_READ_TIMEOUT),
+                            max_retries, config.HTTP_BACKOFF_FACTOR, retry_methods=["POST"],
+                            retry_status_codes=tuple(c for c in RETRY_STATUS_CODES if c != 429))
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+
+# One Azure OpenAI session shared by every call in the run
+ai_session = SharedSession("Azure OpenAI", _create_ai_session)
+
+
+# Cache of LLM responses shared by every call in the run, created from the LLM_CACHE_* settings
+# when first used. Set response_cache.enabled = False to bypass it.
+response_cache = LazyObject(lambda: LLMResponseCache(config.LLM_CACHE_PATH,
+                                                     max_bytes=int(config.LLM_CACHE_MAX_MB * 1024 * 1024),
+                                                     max_age_seconds=config.LLM_CACHE_MAX_AGE_DAYS * 24 * 3600,
+                                                     enabled=config.LLM_CACHE_ENABLED))
+
+
+# The deployments and their rate limits, shared by every call in the run, created from the
+# AZURE_OPENAI_*, AI_DEPLOYMENTS and AI_* settings when first used
+ai_router = LazyObject(lambda: DeploymentRouter(load_deployments(config), max_attempts=config.HTTP_MAX_RETRIES + 1,
+                                                hedge_delay=config.AI_HEDGE_DELAY))
+
+
 def validate_OpenAI_env_vars():
     """
     Validate that all required environment variables are set
     """
-    if AI_API_TOKEN == "not_found":
-        logging.error("AI API Token not set")
+    try:
+        deployments = ai_router.deployments
+    except ValueError as e:
+        logging.error(f"Invalid AI_DEPLOYMENTS: {e}")
+        return False
+    missing = [d.name for d in deployments if d.api_key in (None, "", "not_found")]
+    if missing:
+        logging.error(f"AI API Token not set for {', '.join(missing)}")
         return False
     return True    
 
 
-def query_ai(my_prompt):
+def load_system_prompt():
     """
-    Send the filtered JIRA ticket information to the AI endpoint and retrieve the AI-generated test cases.
-    The prompt for the LLM is stored in a text file in the project folder to allow the user to modify it
-    outside of the Python function code.
+    Read the system prompt for the LLM from LLM_Prompt.txt in the project folder.
     """
-    
     # Define the path to the prompt file
     prompt_file_path = os.path.join(os.path.dirname(__file__), 'LLM_Prompt.txt')
 
     # Read the contents of the file into a variable
     with open(prompt_file_path, 'r', encoding='utf-8') as file:
-        system_prompt = file.read()
+        return file.read()
+
 
-    # Now system_prompt contains the contents of LLM_Prompt.txt
+def build_request(my_prompt, stream=False):
+    """
+    Build the chat completions request body for a prompt, together with its LLM response cache key.
+    """
+    system_prompt = load_system_prompt()
+    response_format = _response_format()
+    cache_key = make_cache_key(system_prompt, my_prompt, config.AZURE_OPENAI_API_EMBEDDINGS_DEPLOYMENT_NAME,
+                               MAX_TOKENS, TEMPERATURE, response_format)
 
     # Construct the request body for the API call to the AI endpoint
     request_body = {
@@ -55,46 +187,299 @@ def query_ai(my_prompt):
         "temperature": TEMPERATURE,
         "max_tokens": MAX_TOKENS
     }
+    if response_format is not None:
+        request_body["response_format"] = response_format
+    if stream:
+        request_body["stream"] = True
+    return cache_key, request_body
 
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": AI_API_TOKEN
-    }
+
+def estimate_request_tokens(request_body):
+    """
+    Estimate the tokens a request counts for against the deployment's quota, as Azure does when
+    it admits it: the tokens of the messages plus the max_tokens reserved for the answer.
+    """
+    return sum(count_tokens(m.get("content") or "") + 4 for m in request_body["messages"]) + request_body["max_tokens"]
+
+
+@contextmanager
+def chat_completion(request_body, stream=False):
+    """
+    POST a chat completions request to one of the deployments (ai_router), within its rate limits,
+    and yield the response. A throttled (429) or failed request fails over to another deployment,
+    or is retried after the Retry-After period, up to HTTP_MAX_RETRIES times; the last response is
+    yielded whatever its status. Slow requests are hedged when hedging is on.
+    """
+    with ai_router.request(ai_session.get(), request_body, estimate_request_tokens(request_body),
+                           stream=stream, hedge=_hedging()) as response:
+        yield response
+
+
+def query_ai(my_prompt, use_cache=True):
+    """
+    Send the filtered JIRA ticket information to the AI endpoint and retrieve the AI-generated test cases.
+    The prompt for the LLM is stored in a text file in the project folder to allow the user to modify it
+    outside of the Python function code.
+    Responses are served from the LLM response cache when the same prompt, ticket and model settings
+    were queried before, unless use_cache is False. A cached response is marked with "cached": true.
+    A new response is only stored by cache_response once its answer has been parsed.
+    """
+    
+    cache_key, request_body = build_request(my_prompt)
+
+    # Serve the response from the cache if this exact request has been answered before
+    if use_cache:
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            logging.info("LLM response served from cache")
+            return dict(cached_response, cached=True)
 
     # Send the request to the AI endpoint and retrieve the response
+    import requests
     try:
-        response = requests.post(AI_ENDPOINT, headers=headers, json=request_body)
+        with chat_completion(request_body) as response:
+            response.raise_for_status()
+            response_json = response.json()
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error querying AI: {e}")
+        return {}
+
+    return response_json
+
+
+def query_ai_stream(my_prompt, use_cache=True, meta=None):
+    """
+    Streaming variant of query_ai: yields the text of the AI response chunk by chunk as the model
+    produces it. A cached answer is yielded as a single chunk; like query_ai's, the complete answer
+    is only stored in the LLM response cache by cache_response once it has been parsed.
+    If a meta dictionary is given, meta["cached"] tells whether the answer came from the cache.
+    Raises requests.exceptions.RequestException if the request fails.
+    """
+    cache_key, request_body = build_request(my_prompt, stream=True)
+
+    if use_cache:
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None and cached_response.get("choices"):
+            logging.info("LLM response served from cache")
+            if meta is not None:
+                meta["cached"] = True
+            yield cached_response["choices"][0]["message"]["content"]
+            return
+
+    with chat_completion(request_body, stream=True) as response:
         response.raise_for_status()
-        return response.json()
+        # Server-sent events are UTF-8; requests would otherwise guess the encoding of text/event-stream
+        response.encoding = "utf-8"
+        for chunk in iter_sse_content(response.iter_lines(decode_unicode=True)):
+            yield chunk
+
+
+def query_ai_fix_json(my_prompt, previous_content, error):
+    """
+    Targeted re-query after an answer could not be parsed as JSON: the model is shown its previous
+    answer and the parse error and asked for the complete JSON only. Once it has been parsed, the
+    corrected answer is stored in the LLM response cache under the original prompt.
+    """
+    _, request_body = build_request(my_prompt)
+    request_body["messages"] += [
+        {"role": "assistant", "content": previous_content},
+        {"role": "user", "content": f"That answer is not valid JSON ({error}). Reply with only the complete "
+                                    f"JSON object of test cases, with no other text and no code fences, "
+                                    f"keeping the answer short enough to finish within the response limit."}
+    ]
+
+    import requests
+    try:
+        with chat_completion(request_body) as response:
+            response.raise_for_status()
+            response_json = response.json()
     except requests.exceptions.RequestException as e:
         logging.error(f"Error querying AI: {e}")
         return {}
-    
 
-def clean_ai_response(response):
+    return response_json
+
+
+def cache_response(my_prompt, response_json):
     """
-    The LLM response will contain other information in addition to the generated test cases.
-    This function will parse the response and return only the generated test cases in JSON format.
+    Store the LLM response to a prompt in the response cache. Called only after its answer has
+    been parsed, so that an answer that cannot be parsed is never served from the cache.
     """
-    
+    cache_key, _ = build_request(my_prompt)
+    response_cache.put(cache_key, {key: value for key, value in response_json.items() if key != "cached"})
+
+
+# Opening code fences the LLM may wrap its JSON answer in, e.g. ```json, ```JSON, ``` or ~~~
+_FENCE = re.compile(r"(```|~~~)[ \t]*[A-Za-z0-9_-]*[ \t]*\r?\n?")
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+_DECODER = json.JSONDecoder()
+
+
+def _first_bracket(text, start=0):
+    starts = [i for i in (text.find("{", start), text.find("[", start)) if i != -1]
+    return min(starts) if starts else None
+
+
+def _decode_at(text, start):
+    # The value and end of the complete JSON document starting at start, or None
     try:
+        return _DECODER.raw_decode(text, start)
+    except ValueError:
+        return None
+
 
-        # Strip out the leading and end characters returned in the LLM response
-        if response.startswith("```json"):
-            # Use regex to find everything after the opening ```json and before the second ```
-            match = re.search(r'^```json\s*(.*?)\s*```', response, re.DOTALL)
-            if match:
-                parsed_content = match.group(1).strip()    
-        else:
-            print("Failure in parsing LLM response to JSON...\n.")
+def _is_test_case_list(value):
+    return isinstance(value, list) and all(isinstance(item, dict) for item in value)
 
 
+def is_test_cases(value):
+    """
+    Whether a decoded answer holds test cases: an object whose "testCases" is a list of
+    objects, or a non-empty bare array of objects.
+    """
+    if isinstance(value, dict):
+        return _is_test_case_list(value.get("testCases"))
+    return bool(value) and _is_test_case_list(value)
+
+
+def _candidate_starts(response):
+    # Where the answer may start, most likely first: the object that holds "testCases", the
+    # documents opened by code fences, then the first bracket of the response
+    starts = []
+    key = response.find('"testCases"')
+    if key != -1:
+        starts.append(response.rfind("{", 0, key))
+    for fence in _FENCE.finditer(response):
+        starts.append(_first_bracket(response, fence.end()))
+    starts.append(_first_bracket(response))
+    return list(dict.fromkeys(start for start in starts if start is not None and start != -1))
+
+
+def _repair(response, start):
+    # Scan the document starting at start; if it never closes, cut it back to the last complete
+    # element and close its open brackets. Returns (json_text, repaired) or (None, False)
+    stack = []
+    in_string = False
+    escape = False
+    # Cut points where everything before is complete: (position, stack at that point)
+    last_cut = None
+    last_shallow_cut = None
+
+    for i in range(start, len(response)):
+        ch = response[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if not stack or _CLOSERS[stack[-1]] != ch:
+                break
+            stack.pop()
+            if not stack:
+                return response[start:i + 1], False
+            last_cut = (i + 1, tuple(stack))
+            if len(stack) <= 2:
+                last_shallow_cut = last_cut
+        elif ch == ",":
+            last_cut = (i, tuple(stack))
+            if len(stack) <= 2:
+                last_shallow_cut = last_cut
 
+    # The document never closed: repair it from the best cut point
+    cut = last_shallow_cut or last_cut
+    if cut is None:
+        return None, False
+    position, open_brackets = cut
+    closing = "".join(_CLOSERS[b] for b in reversed(open_brackets))
+    return response[start:position] + closing, True
+
+
+def extract_json_text(response):
+    """
+    Find the JSON document of test cases in an LLM response.
+    Leading prose, any code fence style and trailing text are tolerated. Brackets in the prose
+    ("see [1]", "{ticket}") are not taken for the answer: the object that holds "testCases" and
+    the fenced documents are tried before the first bracket of the response, and the first one
+    that holds test cases is used. If none does, e.g. the answer was cut off (it hit max_tokens),
+    the first that does once repaired is used: it is repaired in a single pass by cutting it back
+    to the last complete element - preferring whole top-level items such as complete test cases -
+    and closing the open brackets. Failing that, the first complete document is returned, for
+    decode_answer to reject.
+    Returns (json_text, repaired), or (None, False) if no JSON document was found.
+    """
+    starts = _candidate_starts(response)
+    fallback = None
+    for start in starts:
+        decoded = _decode_at(response, start)
+        if decoded is None:
+            continue
+        value, end = decoded
+        if is_test_cases(value):
+            return response[start:end], False
+        fallback = fallback or (response[start:end], False)
+
+    for start in starts:
+        json_text, repaired = _repair(response, start)
+        if json_text is None:
+            continue
+        try:
+            if is_test_cases(json.loads(json_text)):
+                return json_text, repaired
+        except ValueError:
+            pass
+        fallback = fallback or (json_text, repaired)
+    return fallback or (None, False)
+
+
+def decode_answer(content):
+    """
+    Extract and decode the JSON test cases of an LLM answer. Returns (parsed, repaired, error):
+    the decoded test cases, whether a cut off answer was repaired, and why the answer could not
+    be decoded, if it could not. An answer that is a bare array of test case objects is returned
+    as {"testCases": [...]}; an answer without a list of test case objects is an error, so that
+    the LLM is asked to correct it.
+    """
+    try:
+        json_text, repaired = extract_json_text(content)
+    except Exception:
+        json_text, repaired = None, False
+    if json_text is None:
+        return None, False, "No JSON test cases found in the AI response"
+    try:
+        parsed = json.loads(json_text)
+    except (TypeError, json.JSONDecodeError) as e:
+        return None, repaired, f"Parsed AI content is not available due to JSON decoding failure: {e}"
+    if not is_test_cases(parsed):
+        return None, repaired, "AI response JSON has no 'testCases' list of test case objects"
+    if isinstance(parsed, list):
+        parsed = {"testCases": parsed}
+    return parsed, repaired, None
+
+
+def clean_ai_response(response):
+    """
+    The LLM response will contain other information in addition to the generated test cases.
+    This function will parse the response and return only the generated test cases in JSON format.
+    """
+    
+    try:
+        parsed_content, repaired = extract_json_text(response)
+        if parsed_content is None:
+            logging.error("Failure in parsing LLM response to JSON: no JSON object found in the response")
+        elif repaired:
+            logging.warning("LLM response was cut off - repaired by keeping only its complete elements")
         return parsed_content
-    except KeyError as e:
-        logging.error(f"Key error when cleaning AI response: {e}")
-        return None
     except Exception as e:
         logging.error(f"Unexpected error when cleaning AI response: {e}")
-        return None                                                    
-
+        return None
@@ -0,0 +1,250 @@
+import collections
+import logging
+import math
+import threading
+import time
+
+
+"""
+    Client side rate limiting for the Azure OpenAI deployment.
+
+    A deployment has a tokens-per-minute (TPM) and a requests-per-minute (RPM) quota. Azure counts
+    a request against the TPM quota when it is admitted, estimating it as its prompt tokens plus
+    its max_tokens, and answers 429 Too Many Requests with a Retry-After once either quota is used
+    up. AdaptiveRateLimiter keeps the requests of the run within the quotas instead of finding
+    them by being throttled:
+
+      - TPM and RPM budgets are counted over a sliding minute, as the service counts them. Each
+        request reserves its estimated tokens before it is sent and waits its turn when the
+        budget is spent. Budgets that are not configured are taken from the x-ratelimit-limit-*
+        response headers when the service sends them.
+      - The x-ratelimit-remaining-* headers of every response bring the budgets down to what the
+        service says is left, e.g. when another client shares the deployment.
+      - The number of concurrent requests is adjusted AIMD style: it grows by about one for each
+        window of successful requests and is halved on a 429, and all requests pause for the
+        Retry-After period, so a burst of 429s does not turn into a retry storm.
+"""
+
+
+# Rate limit headers of the chat completions responses. Azure OpenAI sends the remaining
+# requests and tokens of the deployment's quotas; the limits are sent by some deployments.
+REMAINING_REQUESTS_HEADER = "x-ratelimit-remaining-requests"
+REMAINING_TOKENS_HEADER = "x-ratelimit-remaining-tokens"
+LIMIT_REQUESTS_HEADER = "x-ratelimit-limit-requests"
+LIMIT_TOKENS_HEADER = "x-ratelimit-limit-tokens"
+
+# Outcomes of a request, as passed to AdaptiveRateLimiter.release()
+SUCCEEDED = "succeeded"
+THROTTLED = "throttled"
+FAILED = "failed"
+
+
+def retry_after_seconds(headers, default=1.0):
+    """
+    Return the wait asked for by a throttled response: retry-after-ms, or Retry-After in seconds.
+    """
+    for name, scale in (("retry-after-ms", 0.001), ("x-ms-retry-after-ms", 0.001), ("Retry-After", 1.0)):
+        value = headers.get(name)
+        if value:
+            try:
+                return max(0.0, float(value) * scale)
+            except ValueError:
+                # Retry-After may also be an HTTP date, which the service does not send in practice
+                continue
+    return default
+
+
+def _header_number(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class QuotaWindow:
+    """
+    A budget of limit units per period, counted over a sliding window the way the service
+    counts its quota: a reservation is admitted once the reservations of the last period leave
+    room for it. The service counts a request when it arrives, a little after it was reserved
+    here, so a reservation is kept for margin seconds longer than the period. Not thread-safe:
+    AdaptiveRateLimiter serialises the calls.
+    """
+    def __init__(self, limit, period=60.0, margin=0.1):
+        self.limit = float(limit)
+        self.period = period
+        self.margin = margin
+        self.used = 0.0
+        self.entries = collections.deque()
+
+    def _expire(self, now):
+        while self.entries and self.entries[0][0] <= now - self.period - self.margin:
+            self.used -= self.entries.popleft()[1]
+
+    def reserve(self, amount, now):
+        """
+        Take amount from the budget and return the seconds to wait before using it. Reservations
+        that have to wait are queued: later ones wait for them, in arrival order.
+        """
+        self._expire(now)
+        # A single request larger than the whole budget could never be sent otherwise
+        amount = min(amount, self.limit)
+        at = self.entries[-1][0] if self.entries else now
+        at = max(at, now)
+        used = self.used
+        for entry_time, entry_amount in self.entries:
+            if used + amount <= self.limit:
+                break
+            used -= entry_amount
+            at = max(at, entry_time + self.period + self.margin)
+        self.entries.append((at, amount))
+        self.used += amount
+        return at - now
+
+    def limit_to(self, remaining, now):
+        """
+        Bring the budget down to what the service reports as remaining, e.g. when another client
+        uses the same deployment.
+        """
+        self._expire(now)
+        unaccounted = self.limit - self.used - remaining
+        if unaccounted > 0:
+            at = max(now, self.entries[-1][0]) if self.entries else now
+            self.entries.append((at, unaccounted))
+            self.used += unaccounted
+
+
+class AdaptiveRateLimiter:
+    """
+    TPM and RPM budgets and an adaptive limit on concurrent requests for one deployment.
+    Call acquire() before each request and release() with its outcome after it, whatever it is.
+    With adaptive False the concurrency stays at max_concurrency and throttled requests only
+    delay themselves. Budgets of 0 are unlimited until the service reports its limits.
+    """
+    def __init__(self, tokens_per_minute=0, requests_per_minute=0, max_concurrency=16, min_concurrency=1,
+                 adaptive=True, period=60.0):
+        self.period = period
+        self.tokens = QuotaWindow(tokens_per_minute, period) if tokens_per_minute else None
+        self.requests = QuotaWindow(requests_per_minute, period) if requests_per_minute else None
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.adaptive = adaptive
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.completed = 0
+        self.throttled = 0
+        self.failed = 0
+        self.budget_wait_seconds = 0.0
+        self.lowest_limit = self.limit
+        self._cond = threading.Condition()
+
+    def acquire(self, estimated_tokens):
+        """
+        Wait for a free concurrency slot, for the pause after a 429 to end and for room in the
+        budgets, then reserve the request's estimated tokens.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.adaptive and now < self.paused_until:
+                    self._cond.wait(self.paused_until - now)
+                elif self.in_flight >= int(self.limit):
+                    self._cond.wait()
+                else:
+                    break
+            self.in_flight += 1
+            wait = 0.0
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(estimated_tokens, now))
+            self.budget_wait_seconds += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def release(self, outcome=SUCCEEDED, retry_after=None):
+        """
+        Free the request's slot. A THROTTLED request halves the concurrency, at most once per
+        Retry-After period since the requests already in flight are throttled together, and
+        pauses every request for that period; a SUCCEEDED one raises it by 1/limit. A FAILED
+        request (connection error, timeout or server error) only frees its slot: it says
+        nothing about the quota, and must not raise the limit against a deployment that is down.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if outcome == FAILED:
+                self.failed += 1
+            elif outcome == THROTTLED:
+                self.throttled += 1
+                retry_after = retry_after if retry_after is not None else 1.0
+                if self.adaptive:
+                    if now >= self.last_decrease + retry_after:
+                        self.limit = max(float(self.min_concurrency), self.limit / 2)
+                        self.lowest_limit = min(self.lowest_limit, self.limit)
+                        self.last_decrease = now
+                        logging.info(f"LLM throttled: concurrency reduced to {int(self.limit)}, "
+                                     f"pausing {retry_after:.1f}s")
+                    self.paused_until = max(self.paused_until, now + retry_after)
+            else:
+                self.completed += 1
+                if self.adaptive:
+                    self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def update_from_headers(self, headers):
+        """
+        Adopt the limits the service reports for budgets that were not configured, and bring the
+        budgets down to the remaining requests and tokens it reports.
+        """
+        with self._cond:
+            now = time.monotonic()
+            for attr, limit_header, remaining_header in (
+                    ("tokens", LIMIT_TOKENS_HEADER, REMAINING_TOKENS_HEADER),
+                    ("requests", LIMIT_REQUESTS_HEADER, REMAINING_REQUESTS_HEADER)):
+                budget = getattr(self, attr)
+                limit = _header_number(headers, limit_header)
+                if budget is None and limit:
+                    budget = QuotaWindow(limit, self.period)
+                    setattr(self, attr, budget)
+                    logging.info(f"LLM {attr} budget taken from the service: {limit:.0f} per {self.period:.0f}s")
+                remaining = _header_number(headers, remaining_header)
+                if budget is not None and remaining is not None:
+                    budget.limit_to(remaining, now)
+
+    def backoff(self, retry_after):
+        """
+        Wait before retrying a throttled request. The adaptive limiter pauses in acquire() instead.
+        """
+        if not self.adaptive:
+            time.sleep(retry_after)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "completed": self.completed,
+                "throttled": self.throttled,
+                "failed": self.failed,
+                "concurrency": int(self.limit),
+                "lowest_concurrency": int(self.lowest_limit),
+                "budget_wait_seconds": round(self.budget_wait_seconds, 3),
+                "tokens_per_minute": (math.floor(self.tokens.limit * 60 / self.period)
+                                      if self.tokens is not None else None),
+            }
+
+
+def log_limiter_stats(limiter, name=None):
+    """
+    Log what the rate limiter did in this run, if anything was throttled or had to wait.
+    name tells the limiters of several deployments apart.
+    """
+    stats = limiter.stats()
+    if stats["throttled"] == 0 and stats["budget_wait_seconds"] == 0:
+        return
+    logging.info(f"LLM rate limiter{f' ({name})' if name else ''}: {stats['completed']} requests, {stats['throttled']} throttled (429), "
+                 f"{stats['budget_wait_seconds']:.1f}s waiting for budget, concurrency now {stats['concurrency']} "
+                 f"(lowest {stats['lowest_concurrency']})")
@@ -0,0 +1,445 @@
+import json
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+# Import the job functions shared with single-ticket and batch runs
+import app
+
+
+# Import the staged pipeline, kept running for the life of the service
+from pipeline import Pipeline, Stage
+
+
+# Import the shared JIRA and Azure OpenAI sessions, warmed up when the service starts
+from jiraextraction import jira_session
+from queryLLM import ai_session, load_system_prompt
+from promptbuilder import count_tokens
+
+
+# Import the export backends
+from exporters import create_exporters, EXPORT_FORMATS
+
+
+# Import the run report in the Prometheus text format
+from instrumentation import to_prometheus
+
+
+"""
+    Long-running service mode: one warm process that generates test cases for many callers.
+
+        python app.py --serve 8080 --workers 8 --output-dir /data/testcases
+
+    Each CI pipeline submits a job instead of starting the tool, and polls or streams its status:
+
+        POST /jobs                {"ticket": "INVHUB-11696", "epic_link": "INVHUB-10821",
+                                   "export": ["excel"], "refresh": false}
+        GET  /jobs/<id>           the job; ?wait=30 waits up to 30s for it to finish
+        GET  /jobs/<id>/events    the job's status changes as server-sent events
+        GET  /jobs                every job held by the service
+        GET  /health              'ok', or 'draining' during shutdown
+        GET  /metrics             stage timings, tokens and cost in the Prometheus text format
+
+    The jobs run through the same staged pipeline as batch mode, which stays up for the life of
+    the service. Its stages are the concurrency limit per upstream: at most fetch_workers JIRA
+    requests and llm_workers LLM queries at a time, whatever the number of callers. The JIRA and
+    Azure OpenAI sessions are created once when the service starts and keep their connections
+    alive between jobs.
+
+    Results are cached at two levels. In memory, a job for a ticket and EPIC that is already
+    queued or running is joined rather than started again, and the finished result is returned
+    as is for result_ttl seconds. On disk, the service always runs in incremental mode, so a
+    ticket that has not changed since its last generation reuses it, and LLM answers come from
+    the LLM response cache.
+
+    On SIGTERM or SIGINT the service stops accepting jobs, finishes every job it has accepted,
+    writes the pending JSON files and then exits.
+"""
+
+
+# Job states. A job is finished when it is done or failed.
+QUEUED = "queued"
+FETCHING = "fetching"
+GENERATING = "generating"
+EXPORTING = "exporting"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATES = (DONE, FAILED)
+
+# Longest wait allowed for GET /jobs/<id>?wait=N
+MAX_WAIT_SECONDS = 300
+
+
+# Marks the end of the job queue at shutdown
+_STOP = object()
+
+
+class ServiceUnavailable(Exception):
+    """
+    Raised when a job cannot be accepted, e.g. the service is draining or its queue is full.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class JobService:
+    """
+    The job queue, the pipeline that works through it and the record of every job.
+    """
+    def __init__(self, output_dir="service_output", fetch_workers=app.DEFAULT_FETCH_WORKERS,
+                 llm_workers=app.DEFAULT_LLM_WORKERS, export_workers=app.DEFAULT_EXPORT_WORKERS, stream=False,
+                 export_formats=("excel",), max_queued=1000, max_jobs=10000, result_ttl=3600):
+        self.output_dir = output_dir
+        self.stream = stream
+        self.export_formats = tuple(export_formats)
+        self.max_queued = max_queued
+        self.max_jobs = max_jobs
+        self.result_ttl = result_ttl
+        self.pipeline = Pipeline([
+            Stage("jira-fetch", lambda job: self._run_stage(job, FETCHING, app.fetch_job, True), fetch_workers),
+            Stage("llm-query", lambda job: self._run_stage(job, GENERATING, app.generate_job, stream), llm_workers),
+            Stage("excel-export", lambda job: self._run_stage(job, EXPORTING, app.export_job), export_workers),
+        ])
+        self.jobs = OrderedDict()
+        self.active = {}
+        self.draining = False
+        self.started = time.time()
+        self._queue = queue.Queue()
+        self._queued = 0
+        self._changed = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        """
+        Warm up the shared clients and start the pipeline.
+        """
+        app.prepare_output_dir(self.output_dir)
+        jira_session.get()
+        ai_session.get()
+        count_tokens(load_system_prompt())
+        self._thread = threading.Thread(target=self._run_pipeline, name="job-pipeline", daemon=True)
+        self._thread.start()
+        logging.info("Job service started: " + ", ".join(f"{stage.workers} {stage.name} workers"
+                                                          for stage in self.pipeline.stages))
+
+    def _run_pipeline(self):
+        jobs = iter(self._queue.get, _STOP)
+        self.pipeline.run(jobs, on_result=self._finish)
+
+    def submit(self, jira_ticket, epic_link, export_formats=None, refresh=False):
+        """
+        Accept a job and return its record. A job for the same ticket, EPIC and export backends
+        that is queued, running, or finished less than result_ttl seconds ago is returned instead,
+        unless refresh is set.
+        """
+        export_formats = tuple(export_formats or self.export_formats)
+        unknown = [f for f in export_formats if f not in EXPORT_FORMATS]
+        if unknown:
+            raise ValueError(f"Unknown export format(s) {', '.join(unknown)}, expected {', '.join(EXPORT_FORMATS)}")
+        key = (jira_ticket, epic_link, export_formats)
+
+        with self._changed:
+            if self.draining:
+                raise ServiceUnavailable(503, "The service is shutting down")
+            existing = self.jobs.get(self.active.get(key))
+            if existing is not None:
+                if existing["status"] not in FINISHED_STATES:
+                    return dict(existing, joined=True)
+                if (not refresh and existing["status"] == DONE
+                        and time.time() - existing["finished"] < self.result_ttl):
+                    return dict(existing, cached=True)
+            if self._queued >= self.max_queued:
+                raise ServiceUnavailable(429, f"Too many queued jobs ({self._queued})")
+
+            # Each job exports into its own directory, so jobs for the same ticket never collide
+            job_id = uuid.uuid4().hex[:12]
+            job_dir = os.path.join(self.output_dir, job_id)
+            try:
+                exporters = create_exporters(export_formats, app.prepare_output_dir(job_dir), job_id)
+            except (IOError, OSError) as e:
+                raise ServiceUnavailable(500, f"Could not create the output of the job: {e}")
+
+            record = {"id": job_id, "ticket": jira_ticket, "epic_link": epic_link, "export": list(export_formats),
+                      "status": QUEUED, "stage": None, "error": None, "outputs": [], "unchanged": False,
+                      "submitted": time.time(), "finished": None, "elapsed": None, "version": 0}
+            self.jobs[job_id] = record
+            self.active[key] = job_id
+            self._queued += 1
+            self._forget_old_jobs()
+
+            # Queued with the lock held, so that no job can follow the end marker put by shutdown()
+            job = app.new_job(jira_ticket, epic_link, exporters, test_case_dedup=app.new_test_case_dedup(),
+                              output_dir=job_dir)
+            job["id"] = job_id
+            self._queue.put(job)
+            logging.info(f"Job {job_id} queued: {jira_ticket} -> {epic_link} ({', '.join(export_formats)})")
+            return dict(record)
+
+    def _forget_old_jobs(self):
+        # Called with the lock held: drop the oldest finished jobs beyond max_jobs
+        excess = len(self.jobs) - self.max_jobs
+        for job_id in [job_id for job_id, record in self.jobs.items() if record["status"] in FINISHED_STATES]:
+            if excess <= 0:
+                break
+            record = self.jobs.pop(job_id)
+            app.run_metrics.forget(job_id)
+            key = (record["ticket"], record["epic_link"], tuple(record["export"]))
+            if self.active.get(key) == job_id:
+                del self.active[key]
+            excess -= 1
+
+    def _update(self, job_id, **changes):
+        with self._changed:
+            record = self.jobs.get(job_id)
+            if record is not None:
+                record.update(changes)
+                record["version"] += 1
+            self._changed.notify_all()
+
+    def _run_stage(self, job, status, func, *args):
+        if status == FETCHING:
+            with self._changed:
+                self._queued -= 1
+        self._update(job["id"], status=status)
+        # The metrics are kept per job: the same ticket may be submitted again
+        with app.run_metrics.job(job["id"]):
+            return func(job, *args)
+
+    def _finish(self, pipeline_result):
+        """
+        Pipeline callback for a job that completed or failed: finish its export backends and record the result.
+        """
+        job = pipeline_result.item
+        app.close_exporters(job["exporters"])
+        elapsed = time.perf_counter() - job["start"]
+        app.run_metrics.add_time(job["id"], "total", elapsed)
+
+        if pipeline_result.ok:
+            self._update(job["id"], status=DONE, outputs=job["outputs"], unchanged=job["unchanged"],
+                         finished=time.time(), elapsed=round(elapsed, 3))
+            logging.info(f"Job {job['id']} done: {job['ticket']} in {elapsed:.1f}s -> {', '.join(job['outputs'])}")
+            return
+
+        error = pipeline_result.error
+        if isinstance(error, app.TicketProcessingError):
+            stage, message = error.stage, str(error)
+        else:
+            stage, message = pipeline_result.failed_stage, f"Unexpected error: {error}"
+        self._update(job["id"], status=FAILED, stage=stage, error=message, finished=time.time(),
+                     elapsed=round(elapsed, 3))
+        logging.error(f"Job {job['id']} failed: {job['ticket']} at {stage}: {message}")
+
+    def get(self, job_id):
+        with self._changed:
+            record = self.jobs.get(job_id)
+            return dict(record) if record is not None else None
+
+    def list(self):
+        with self._changed:
+            return [dict(record) for record in self.jobs.values()]
+
+    def wait(self, job_id, timeout, after_version=-1):
+        """
+        Wait until the job changes past after_version, or until it is finished when after_version
+        is not given, for at most timeout seconds. Returns the job record.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                record = self.jobs.get(job_id)
+                if record is None:
+                    return None
+                if after_version >= 0 and record["version"] > after_version:
+                    return dict(record)
+                if record["status"] in FINISHED_STATES:
+                    return dict(record)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return dict(record)
+                self._changed.wait(remaining)
+
+    def health(self):
+        with self._changed:
+            counts = {status: 0 for status in (QUEUED, FETCHING, GENERATING, EXPORTING, DONE, FAILED)}
+            for record in self.jobs.values():
+                counts[record["status"]] += 1
+        return {"status": "draining" if self.draining else "ok",
+                "uptime_seconds": round(time.time() - self.started, 1), "jobs": counts,
+                "llm_deployments": app.ai_router.health()}
+
+    def metrics(self):
+        return to_prometheus(app.run_metrics.report(time.time() - self.started))
+
+    def shutdown(self):
+        """
+        Stop accepting jobs, let the pipeline finish every accepted job and write the pending JSON files.
+        """
+        with self._changed:
+            if self.draining:
+                return
+            self.draining = True
+            self._queue.put(_STOP)
+            self._changed.notify_all()
+        logging.info("Job service draining: no new jobs are accepted")
+        if self._thread is not None:
+            self._thread.join()
+        app.json_artifacts.close()
+        jira_session.close()
+        ai_session.close()
+        app.log_cache_stats(app.response_cache)
+        app.log_router_stats(app.ai_router)
+        app.log_dedup_stats(app.ticket_index)
+        app.ai_router.close()
+        app.process_pool.close()
+        logging.info("Job service stopped")
+
+
+class JobServiceHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP interface of the job service, in JSON.
+    """
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def read_json_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, status, text, content_type="text/plain; version=0.0.4"):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") != "/jobs":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            body = self.read_json_body()
+            ticket, epic_link = body["ticket"], body["epic_link"]
+            export_formats = body.get("export")
+            if isinstance(export_formats, str):
+                export_formats = [f.strip() for f in export_formats.split(",") if f.strip()]
+            record = self.service.submit(ticket, epic_link, export_formats, bool(body.get("refresh", False)))
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": f"Expected a JSON body with 'ticket' and 'epic_link': {e}"})
+            return
+        except ServiceUnavailable as e:
+            self.send_json(e.status, {"error": str(e)})
+            return
+        self.send_json(200 if record["status"] in FINISHED_STATES else 202, record)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = parse_qs(url.query)
+
+        if parts == ["health"]:
+            health = self.service.health()
+            self.send_json(503 if health["status"] == "draining" else 200, health)
+        elif parts == ["metrics"]:
+            self.send_text(200, self.service.metrics())
+        elif parts == ["jobs"]:
+            self.send_json(200, {"jobs": self.service.list()})
+        elif len(parts) == 2 and parts[0] == "jobs":
+            try:
+                wait = min(float(query.get("wait", ["0"])[0]), MAX_WAIT_SECONDS)
+            except ValueError:
+                self.send_json(400, {"error": "wait must be a number of seconds"})
+                return
+            record = self.service.wait(parts[1], wait) if wait > 0 else self.service.get(parts[1])
+            if record is None:
+                self.send_json(404, {"error": f"Unknown job {parts[1]}"})
+            else:
+                self.send_json(200, record)
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events":
+            self.stream_events(parts[1])
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def stream_events(self, job_id):
+        """
+        Send each change of the job as a server-sent event until it is finished.
+        """
+        record = self.service.get(job_id)
+        if record is None:
+            self.send_json(404, {"error": f"Unknown job {job_id}"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                self.wfile.write(f"event: status\ndata: {json.dumps(record)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if record["status"] in FINISHED_STATES:
+                    break
+                record = self.service.wait(job_id, MAX_WAIT_SECONDS, after_version=record["version"])
+                if record is None:
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            logging.debug(f"Event stream for job {job_id} closed by the client")
+
+    def log_message(self, format, *args):
+        logging.debug(f"Job service: {format % args}")
+
+
+def parse_address(value):
+    """
+    Split '[HOST:]PORT' into (host, port). The host defaults to 127.0.0.1.
+    """
+    host, _, port = value.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def serve(address, **service_options):
+    """
+    Run the job service on address ('[HOST:]PORT') until SIGTERM or SIGINT, then drain and exit.
+    """
+    host, port = parse_address(address)
+    service = JobService(**service_options)
+    service.start()
+
+    httpd = ThreadingHTTPServer((host, port), JobServiceHandler)
+    httpd.daemon_threads = True
+    httpd.service = service
+    server_thread = threading.Thread(target=httpd.serve_forever, name="job-service-http", daemon=True)
+    server_thread.start()
+    logging.info(f"Job service listening on http://{host}:{httpd.server_address[1]}")
+
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    while not stop.wait(1):
+        pass
+
+    # Status requests are still answered while the accepted jobs finish
+    service.shutdown()
+    httpd.shutdown()
+    httpd.server_close()
@@ -0,0 +1,17 @@
+from dedup import adapt_generation, ticket_signature, signature, similarity
+
+
+def test_adapt_generation_replaces_only_the_whole_key():
+    parsed = {"testCases": [{"summary": "Verify INVHUB-11 (see INVHUB-110 and XINVHUB-11)",
+                             "steps": [{"step": "Open INVHUB-11.", "expectedResult": "INVHUB-11-a shown"}]}]}
+    adapted = adapt_generation(parsed, "INVHUB-11", "INVHUB-12")
+    assert adapted["testCases"][0]["summary"] == "Verify INVHUB-12 (see INVHUB-110 and XINVHUB-11)"
+    assert adapted["testCases"][0]["steps"][0] == {"step": "Open INVHUB-12.", "expectedResult": "INVHUB-12-a shown"}
+    assert parsed["testCases"][0]["summary"].startswith("Verify INVHUB-11 ")
+
+
+def test_ticket_signature_keeps_keys_that_only_share_a_prefix():
+    text = "Depends on INVHUB-110 for the login flow of the portal"
+    assert ticket_signature("INVHUB-11", {"description": text}) == signature(text)
+    clone = ticket_signature("INVHUB-12", {"description": "INVHUB-12: " + text})
+    assert similarity(clone, ticket_signature("INVHUB-11", {"description": "INVHUB-11: " + text})) == 1.0
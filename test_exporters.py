@@ -0,0 +1,104 @@
+import csv
+import json
+import os
+
+import openpyxl
+
+from exporters import ZephyrApiExporter, create_exporters, upload_jira_session, zephyr_session
+from ZephyrImport import HEADERS, DEFAULT_OUTPUT_FILE
+
+
+class MemoryUploadLog:
+    def __init__(self):
+        self.tests = {}
+
+    def created(self, ticket):
+        return dict(self.tests.get(ticket, {}))
+
+    def record(self, ticket, test_case, test_key, steps_added):
+        self.tests.setdefault(ticket, {})[test_case] = (test_key, steps_added)
+
+
+class FakeZephyr(ZephyrApiExporter):
+    def __init__(self, upload_log, fail_steps=()):
+        super().__init__(project_key="TEST", workers=2, requests_per_second=1000, batch_size=2,
+                         upload_log=upload_log)
+        self.issued = []
+        self.steps = {}
+        self.fail_steps = set(fail_steps)
+
+    def _post(self, session, url, payload):
+        if "issueUpdates" in payload:
+            keys = [f"TEST-{len(self.issued) + n + 1}" for n in range(len(payload["issueUpdates"]))]
+            self.issued += keys
+            return {"issues": [{"key": key} for key in keys], "errors": []}
+        key = url.split("/")[-2]
+        if key in self.fail_steps:
+            raise RuntimeError("steps rejected")
+        self.steps[key] = payload["items"]
+        return {}
+
+
+TEST_CASES = [{"summary": f"Test {n}", "steps": [{"step": "Do it", "expectedResult": "Done"}]} for n in range(3)]
+
+
+def test_resumed_upload_creates_only_the_missing_tests():
+    upload_log = MemoryUploadLog()
+    first = FakeZephyr(upload_log, fail_steps={"TEST-2"})
+    try:
+        first.export("T-1", "E-1", TEST_CASES)
+    except RuntimeError:
+        pass
+    first.close()
+    assert first.issued == ["TEST-1", "TEST-2", "TEST-3"]
+
+    resumed = FakeZephyr(upload_log)
+    assert resumed.export("T-1", "E-1", TEST_CASES) == "zephyr:TEST-1,TEST-2,TEST-3"
+    resumed.close()
+    assert resumed.issued == []
+    assert list(resumed.steps) == ["TEST-2"]
+
+
+def test_file_exporters_write_every_ticket(tmp_path):
+    exporters = create_exporters(["excel", "csv", "jsonl"], str(tmp_path), "run-1")
+    for exporter in exporters:
+        exporter.export("T-1", "E-1", TEST_CASES)
+        exporter.export("T-2", "E-1", TEST_CASES[:1])
+    files = [name for exporter in exporters for name in exporter.close()]
+    assert sorted(os.path.basename(name) for name in files) == ["Zephyr_Test_Cases_run-1.csv",
+                                                                "Zephyr_Test_Cases_run-1.jsonl"]
+
+    with open(tmp_path / "Zephyr_Test_Cases_run-1.csv", newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert tuple(rows[0]) == HEADERS
+    # External ids run on across tickets
+    assert [row[0] for row in rows[1:]] == ["1", "2", "3", "4"]
+
+    with open(tmp_path / "Zephyr_Test_Cases_run-1.jsonl", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert [(line["ticket"], line["summary"]) for line in lines] == [("T-1", "Test 0"), ("T-1", "Test 1"),
+                                                                     ("T-1", "Test 2"), ("T-2", "Test 0")]
+
+    workbook = openpyxl.load_workbook(tmp_path / f"T-1_{DEFAULT_OUTPUT_FILE}")
+    # One sheet per test case
+    assert [sheet.cell(2, 2).value for sheet in workbook.worksheets] == ["Test 0", "Test 1", "Test 2"]
+    assert [cell.value for cell in workbook.worksheets[0][1]] == list(HEADERS)
+
+
+def test_zephyr_exporter_creates_the_tests_on_a_fake_server(fake_jira, settings):
+    settings(ZEPHYR_BASE_URL=fake_jira.base_url, ZEPHYR_API_TOKEN="token")
+    upload_jira_session.close()
+    zephyr_session.close()
+    exporter = ZephyrApiExporter(project_key="TEST", batch_size=2, upload_log=MemoryUploadLog())
+    try:
+        result = exporter.export("T-1", "E-1", TEST_CASES)
+    finally:
+        exporter.close()
+        upload_jira_session.close()
+        zephyr_session.close()
+
+    keys = list(fake_jira.created)
+    assert result == "zephyr:" + ",".join(keys)
+    assert [fake_jira.created[key]["fields"]["summary"] for key in keys] == ["Test 0", "Test 1", "Test 2"]
+    assert all(fake_jira.created[key]["fields"]["customfield_10014"] == "E-1" for key in keys)
+    assert {key: len(steps) for key, steps in fake_jira.test_steps.items()} == {key: 1 for key in keys}
@@ -0,0 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import RunMetrics, map_in_context
+
+
+def test_the_same_ticket_in_two_jobs_is_recorded_per_job():
+    metrics = RunMetrics()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for job_id in ("job-1", "job-2"):
+            with metrics.job(job_id):
+                metrics.add_time("T-1", "filter", 1.0)
+                list(map_in_context(executor, lambda part: metrics.add_time("T-1", "llm_query", 2.0), range(2)))
+    report = metrics.report(10.0)
+    assert report["stages"]["llm_query"] == {"count": 2, "total_seconds": 8.0, "p50_seconds": 4.0,
+                                             "p95_seconds": 4.0, "max_seconds": 4.0}
+    assert report["stages"]["filter"]["p95_seconds"] == 1.0
+
+    metrics.forget("job-1")
+    assert list(metrics.report(10.0)["tickets"]) == ["job-2"]
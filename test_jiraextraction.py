@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from fakeservers import make_jira_issue
+from jiraextraction import (compile_whitelist, filter_dict, project_dict, project_json, _project_events,
+                            search_jira_issues)
+
+
+WHITELIST = {
+    "key": True,
+    "fields": {
+        "summary": True,
+        # A list without '__array__' is kept whole
+        "labels": {"name": True},
+        "comment": {"comments": {"__array__": {"author": {"displayName": True}, "body": True}}},
+    },
+}
+
+
+def sample_ticket():
+    ticket = make_jira_issue("FAKE-1", comments=3, changelog=2)
+    ticket["fields"]["labels"] = ["backend", {"name": "kept whole"}]
+    # Lists under '__array__' may hold other values than dictionaries
+    ticket["fields"]["comment"]["comments"] += ["a plain comment", 7, None]
+    return ticket
+
+
+def test_projections_match_filter_dict():
+    ticket = sample_ticket()
+    expected = filter_dict(ticket, WHITELIST)
+    plan = compile_whitelist(WHITELIST)
+    assert expected["fields"]["comment"]["comments"][-3:] == ["a plain comment", 7, None]
+    assert json.dumps(project_dict(ticket, plan)) == json.dumps(expected)
+    ijson = pytest.importorskip("ijson")
+    raw = json.dumps(ticket).encode("utf-8")
+    assert json.dumps(_project_events(ijson.basic_parse(raw, use_float=True), plan)) == json.dumps(expected)
+    assert project_json(raw, plan) == expected
+
+
+def test_search_projects_each_issue_with_the_whitelist(fake_jira):
+    issues = list(search_jira_issues("project = FAKE", whitelist=WHITELIST, page_size=3))
+    assert sorted(issue["key"] for issue in issues) == [f"FAKE-{n}" for n in range(1, 8)]
+    for issue in issues:
+        assert issue == filter_dict(fake_jira.issues[issue["key"]], WHITELIST)
+
+
+def test_search_pages_shorter_than_requested(fake_jira):
+    # The fake returns at most three issues a page, whatever maxResults asks for
+    fake_jira.reset_counts()
+    keys = [issue["key"] for issue in search_jira_issues("project = FAKE", fields="key", page_size=50)]
+    assert sorted(keys) == [f"FAKE-{n}" for n in range(1, 8)]
+    assert fake_jira.request_count == 3
@@ -0,0 +1,17 @@
+import time
+
+from jobjournal import JobJournal
+
+
+def test_resuming_a_run_older_than_max_age_keeps_it(tmp_path):
+    journal = JobJournal(str(tmp_path / "journal.sqlite"), max_age_days=14)
+    journal.start_run("old")
+    journal.filtered("old", "T-1", "2024-06-11", "hash", {"key": "T-1"})
+    journal.start_run("older")
+    journal._execute("UPDATE runs SET started_at = ?", (time.time() - 30 * 86400,))
+
+    entries = journal.start_run("old", resume=True)
+    assert entries["T-1"]["reduced_ticket"] == {"key": "T-1"}
+    assert journal.has_run("old")
+    assert not journal.has_run("older")
+    journal.close()
@@ -0,0 +1,73 @@
+import time
+
+import pytest
+import requests
+
+from fakeservers import FakeChatCompletions
+from llmrouter import Deployment, DeploymentRouter
+from ratelimit import AdaptiveRateLimiter
+
+
+REQUEST_BODY = {"messages": [{"role": "user", "content": "Write the test cases"}], "max_tokens": 100}
+
+
+def deployment(name, server, weight=1.0, limiter=None):
+    base_url = server.base_url if server is not None else "http://127.0.0.1:9"
+    return Deployment(name, base_url + "/openai/deployments", "fake", "key", "2024-06-01", weight, limiter)
+
+
+@pytest.fixture
+def session():
+    with requests.Session() as session:
+        yield session
+
+
+def test_throttled_deployment_fails_over_to_the_standby(session):
+    with FakeChatCompletions(throttle_rate=1.0, retry_after=30) as throttled, FakeChatCompletions() as standby:
+        primary, backup = deployment("primary", throttled), deployment("standby", standby, weight=0)
+        router = DeploymentRouter([primary, backup], seed=0)
+        with router.request(session, REQUEST_BODY, 100) as response:
+            assert response.status_code == 200
+        assert router.failovers == 1
+        assert not primary.healthy() and backup.healthy()
+        assert primary.limiter.stats()["throttled"] == 1
+        assert primary.limiter.limit < primary.limiter.max_concurrency
+        assert standby.request_count == 1
+
+
+def test_unreachable_deployment_frees_its_slot_without_raising_the_limit(session):
+    with FakeChatCompletions() as llm:
+        down, up = deployment("down", None), deployment("up", llm, weight=0)
+        router = DeploymentRouter([down, up], seed=0)
+        with router.request(session, REQUEST_BODY, 100) as response:
+            assert response.status_code == 200
+        stats = down.limiter.stats()
+        assert (stats["completed"], stats["failed"], down.limiter.in_flight) == (0, 1, 0)
+        assert down.limiter.limit == down.limiter.max_concurrency
+        assert not down.healthy()
+
+
+def test_limiter_waits_out_the_quota_of_a_single_deployment(session):
+    with FakeChatCompletions(requests_per_minute=2, quota_window=0.3) as llm:
+        only = deployment("only", llm, limiter=AdaptiveRateLimiter(max_concurrency=4))
+        router = DeploymentRouter([only], max_attempts=10)
+        for _ in range(5):
+            with router.request(session, REQUEST_BODY, 100) as response:
+                assert response.status_code == 200
+        stats = only.limiter.stats()
+        assert stats["completed"] == 5 and stats["throttled"] >= 1
+        assert stats["lowest_concurrency"] < 4
+        assert llm.throttled_count == stats["throttled"]
+
+
+def test_slow_request_is_hedged_on_another_deployment(session):
+    with FakeChatCompletions(latency=2.0) as slow, FakeChatCompletions() as fast:
+        primary, backup = deployment("slow", slow), deployment("fast", fast, weight=0)
+        router = DeploymentRouter([primary, backup], hedge_delay=0.1, seed=0)
+        start = time.perf_counter()
+        with router.request(session, REQUEST_BODY, 100, hedge=True) as response:
+            assert response.status_code == 200
+        assert time.perf_counter() - start < 1.5
+        assert (router.hedged, router.hedge_wins) == (1, 1)
+        assert fast.request_count == 1
+        router.close()
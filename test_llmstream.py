@@ -0,0 +1,42 @@
+import json
+
+from fakeservers import load_canned_content
+# The parser is not imported by name, or pytest would try to collect it as a test class
+import llmstream
+from queryLLM import query_ai_stream, decode_answer
+
+
+def test_sse_events_give_the_content_deltas():
+    lines = ['data: {"choices": [{"delta": {"role": "assistant"}}]}', "",
+             'data: {"choices": [{"delta": {"content": "Hel"}}]}', ": keep-alive",
+             'data: {"choices": [{"delta": {"content": "lo"}}]}', "data: [DONE]",
+             'data: {"choices": [{"delta": {"content": "ignored"}}]}']
+    assert list(llmstream.iter_sse_content(lines)) == ["Hel", "lo"]
+
+
+def test_parser_yields_each_test_case_of_the_streamed_answer(fake_llm):
+    expected, _, error = decode_answer(load_canned_content())
+    assert error is None
+
+    parser = llmstream.TestCaseStreamParser()
+    arrivals = []
+    chunks = 0
+    for chunk in query_ai_stream("Write the test cases", use_cache=False):
+        chunks += 1
+        arrivals += [(chunks, test_case) for test_case in parser.feed(chunk)]
+
+    assert [test_case for _, test_case in arrivals] == expected["testCases"]
+    # The first test case is handed back long before the end of the answer
+    assert arrivals[0][0] < chunks / 2
+    assert fake_llm.request_count == 1
+
+
+def test_parser_skips_leading_prose_and_survives_any_split():
+    answer = 'Sure, here they are:\n```json\n' + json.dumps(
+        {"summary": "x", "testCases": [{"id": "TC-1", "summary": 'a {b} "c"'}, {"id": "TC-2", "steps": []}]}) + "\n```"
+    for size in (1, 3, 11):
+        parser = llmstream.TestCaseStreamParser()
+        items = []
+        for start in range(0, len(answer), size):
+            items += parser.feed(answer[start:start + size])
+        assert [item["id"] for item in items] == ["TC-1", "TC-2"]
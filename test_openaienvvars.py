@@ -0,0 +1,17 @@
+import pytest
+
+# Import OpenAI Environment Variables
+from openaienvvars import config
+
+
+@pytest.mark.parametrize("value, expected", [("true", True), ("On", True), ("y", True), ("1", True),
+                                             ("false", False), ("off", False), ("N", False), ("0", False)])
+def test_flag_values(settings, value, expected):
+    settings(DEDUP_ENABLED=value)
+    assert config.DEDUP_ENABLED is expected
+
+
+def test_unknown_flag_value_names_the_setting(settings):
+    settings(DEDUP_ENABLED="flase")
+    with pytest.raises(ValueError, match="DEDUP_ENABLED"):
+        config.DEDUP_ENABLED
@@ -0,0 +1,53 @@
+import json
+
+from queryLLM import decode_answer, extract_json_text
+
+
+ANSWER = {"testCases": [{"summary": "Fenced step", "steps": [
+    {"step": "Run ```kubectl get pods``` in a shell", "expectedResult": "The pods are listed"}]}]}
+
+
+def test_fence_inside_a_string_value():
+    parsed, repaired, error = decode_answer(json.dumps(ANSWER))
+    assert (parsed, repaired, error) == (ANSWER, False, None)
+
+
+def test_prose_with_a_fenced_block_after_the_document():
+    content = json.dumps(ANSWER) + "\n\nTo run them:\n```bash\npytest -k smoke\n```\n"
+    parsed, repaired, error = decode_answer(content)
+    assert (parsed, repaired, error) == (ANSWER, False, None)
+
+
+def test_fenced_document_after_prose_with_braces():
+    content = "Test cases for {ticket}:\n```json\n" + json.dumps(ANSWER) + "\n```"
+    assert decode_answer(content)[0] == ANSWER
+
+
+def test_cut_off_document_is_repaired():
+    text = json.dumps({"testCases": [{"summary": "one"}, {"summary": "two"}]})
+    json_text, repaired = extract_json_text("```json\n" + text[:-12])
+    assert repaired
+    assert json.loads(json_text) == {"testCases": [{"summary": "one"}]}
+
+
+def test_bare_array_of_test_cases():
+    content = "```json\n" + json.dumps(ANSWER["testCases"]) + "\n```"
+    assert decode_answer(content) == (ANSWER, False, None)
+
+
+def test_prose_with_brackets_before_a_fenced_answer():
+    fenced = "\n```json\n" + json.dumps(ANSWER) + "\n```"
+    assert decode_answer("Test cases (see [1] for details):" + fenced) == (ANSWER, False, None)
+    assert decode_answer("Here you go: {}" + fenced) == (ANSWER, False, None)
+
+
+def test_prose_with_brackets_before_a_cut_off_answer():
+    text = json.dumps({"testCases": [{"summary": "one"}, {"summary": "two"}]})
+    parsed, repaired, error = decode_answer("Per [1]:\n```json\n" + text[:-12])
+    assert (parsed, repaired, error) == ({"testCases": [{"summary": "one"}]}, True, None)
+
+
+def test_answer_without_test_case_objects_is_an_error():
+    for content in ("Here you go: {}", "[1]", '["a", "b"]', '{"testCases": [1, 2]}', '{"summary": "x"}'):
+        parsed, repaired, error = decode_answer(content)
+        assert parsed is None and error is not None, content
@@ -0,0 +1,16 @@
+from ratelimit import AdaptiveRateLimiter, SUCCEEDED, THROTTLED, FAILED
+
+
+def test_failed_requests_free_their_slot_without_raising_the_limit():
+    limiter = AdaptiveRateLimiter(max_concurrency=8)
+    limiter.acquire(10)
+    limiter.release(THROTTLED, retry_after=0.0)
+    limit = limiter.limit
+    for _ in range(5):
+        limiter.acquire(10)
+        limiter.release(FAILED)
+    assert (limiter.limit, limiter.completed, limiter.failed, limiter.in_flight) == (limit, 0, 5, 0)
+
+    limiter.acquire(10)
+    limiter.release(SUCCEEDED)
+    assert limiter.limit > limit and limiter.completed == 1
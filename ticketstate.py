@@ -0,0 +1,101 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+"""
+    Local record of the JIRA tickets test cases have been generated for.
+
+    For every ticket the store keeps the JIRA 'updated' timestamp and a hash of the whitelisted
+    ticket data that was sent to the LLM, alongside the <ticket>_test_case_steps.json file that was
+    produced. In incremental mode this lets a rerun across an epic skip the tickets that have not
+    changed: first with a cheap fields-only request for the 'updated' timestamp, and, if that has
+    moved, by comparing the hash of the filtered data (so edits to fields outside the WHITELIST
+    do not trigger a new LLM query).
+"""
+
+
+def content_hash(reduced_ticket):
+    """
+    Hash the filtered ticket data in a canonical form, independent of key order.
+    """
+    canonical = json.dumps(reduced_ticket, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class TicketStateStore:
+    """
+    SQLite-backed store of the last generation for each JIRA ticket, shared by all threads of the run.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ticket_state ("
+                " ticket TEXT PRIMARY KEY,"
+                " updated TEXT,"
+                " content_hash TEXT NOT NULL,"
+                " json_file TEXT NOT NULL,"
+                " generated_at REAL NOT NULL)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, ticket):
+        """
+        Return the last generation recorded for the ticket as a dictionary, or None.
+        """
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT updated, content_hash, json_file, generated_at FROM ticket_state WHERE ticket = ?",
+                (ticket,)).fetchone()
+        if row is None:
+            return None
+        return {"updated": row[0], "content_hash": row[1], "json_file": row[2], "generated_at": row[3]}
+
+    def get_output(self, ticket):
+        """
+        Return the recorded state only if its JSON file of test cases still exists.
+        """
+        state = self.get(ticket)
+        if state is None or not os.path.exists(state["json_file"]):
+            return None
+        return state
+
+    def record(self, ticket, updated, ticket_hash, json_file):
+        """
+        Record a successful generation for the ticket.
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO ticket_state (ticket, updated, content_hash, json_file, generated_at) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         (ticket, updated, ticket_hash, os.path.abspath(json_file), time.time()))
+            conn.commit()
+
+    def touch(self, ticket, updated):
+        """
+        Store a newer 'updated' timestamp for a ticket whose filtered data did not change.
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("UPDATE ticket_state SET updated = ? WHERE ticket = ?", (updated, ticket))
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def log_unchanged_ticket(ticket, reason):
+    logging.info(f"{ticket} unchanged since last generation ({reason}) - reusing previous test cases")